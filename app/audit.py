@@ -0,0 +1,387 @@
+import argparse
+import atexit
+import enum
+import getpass
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date, datetime
+from decimal import Decimal
+from functools import lru_cache
+
+# Add the parent directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import (Column, DateTime, DDL, Index, Integer, MetaData, String, Table, Text, create_engine,
+                        event, inspect, select, text)
+from sqlalchemy.orm import Session
+from app.encryption import enabled as encryption_enabled
+from app.facilities import current_facility
+from app.models import (Patient, Staff, Appointment, AppointmentSeries, MedicalRecord, Bill, EncryptedString,
+                        row_read_listeners)
+
+# Audit trail: who read or changed which record, and what changed.
+#   reads   - every Patient/Staff/Appointment/MedicalRecord/Bill instance a
+#             session loads (mapper load/refresh events), at most once per
+#             session and record every READ_COALESCE_SECONDS, and the
+#             rows listings read as tuples (models.read_rows)
+#   writes  - create/update/delete/restore with the changed columns, taken
+#             from the flush and logged only once the transaction commits
+#   purges  - TrashService.purge records the ids it removes
+# Changes to encrypted columns are logged without their values while
+# encryption is on, so the trail holds no plain text copy of them; their
+# blind indexes are never logged.
+# Events are appended to an in-memory buffer (a list append under a lock on
+# the hot path) and written in batches by a background thread to a separate
+# database, hospital_audit.db, whose triggers reject UPDATE and DELETE.
+# There is one audit trail for the whole group; each event carries the
+# facility whose database the record lives in.
+
+AUDIT_DATABASE_PATH = 'hospital_audit.db'
+AUDITED_MODELS = (Patient, Staff, Appointment, AppointmentSeries, MedicalRecord, Bill)
+FLUSH_SIZE = 500            # events that trigger a write without waiting for the timer
+FLUSH_INTERVAL = 1.0        # seconds between background writes
+READ_COALESCE_SECONDS = 60
+IGNORED_COLUMNS = {'version'}
+REDACTED = '[encrypted]'    # logged instead of the values of encrypted columns while encryption is on
+ACTIONS = ('read', 'create', 'update', 'delete', 'restore', 'purge')
+
+metadata = MetaData()
+
+audit_events = Table(
+    'audit_events', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('at', DateTime, nullable=False),
+    Column('actor', String(100), nullable=False),
+    Column('action', String(10), nullable=False),
+    Column('entity', String(50), nullable=False),   # table name
+    Column('entity_id', Integer),
+    Column('patient_id', Integer),
+    Column('facility', String(30), nullable=False, server_default='main'),
+    Column('changes', Text),                        # JSON {column: [old, new]}, encoded by the writer
+    Index('ix_audit_events_patient_at', 'patient_id', 'at'),
+    Index('ix_audit_events_actor_at', 'actor', 'at'),
+    Index('ix_audit_events_at', 'at'),
+)
+
+# Append-only: rows can be inserted but never changed or removed
+for operation in ('UPDATE', 'DELETE'):
+    event.listen(audit_events, 'after_create', DDL(
+        f"CREATE TRIGGER IF NOT EXISTS audit_events_no_{operation.lower()} BEFORE {operation} ON audit_events "
+        f"BEGIN SELECT RAISE(ABORT, 'audit_events is append-only'); END"
+    ))
+
+_actor = ContextVar('audit_actor', default=None)
+
+@lru_cache(maxsize=None)
+def default_actor():
+    return os.environ.get('HOSPITAL_USER') or getpass.getuser()
+
+def current_actor():
+    return _actor.get() or default_actor()
+
+def set_actor(name):
+    #Attribute this context's (thread's or task's) events to name
+    _actor.set(name)
+
+@contextmanager
+def acting_as(name):
+    token = _actor.set(name)
+    try:
+        yield
+    finally:
+        _actor.reset(token)
+
+def _plain(value):
+    # JSON-friendly column values: labels for status enums, text for dates and money
+    if isinstance(value, enum.Enum):
+        return str(value)
+    if isinstance(value, (date, datetime, Decimal)):
+        return str(value)
+    return value
+
+class AuditLog:
+    def __init__(self, path=AUDIT_DATABASE_PATH, flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self._engine = None
+        self.written = 0
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            self._engine = create_engine(f'sqlite:///{self.path}', echo=False)
+            event.listen(self._engine, 'connect', _audit_pragmas)
+            metadata.create_all(self._engine)
+            with self._engine.begin() as connection:
+                # Trails written before facilities existed are all the main hospital's
+                if 'facility' not in {column['name'] for column in inspect(connection).get_columns('audit_events')}:
+                    connection.execute(text("ALTER TABLE audit_events ADD COLUMN facility VARCHAR(30) NOT NULL DEFAULT 'main'"))
+        return self._engine
+
+    def append(self, events):
+        #Queue events (tuples in audit_events column order, without id)
+        with self.lock:
+            self.buffer.extend(events)
+            size = len(self.buffer)
+        if self.thread is None:
+            self.start()
+        if size >= self.flush_size:
+            self.wakeup.set()
+
+    def record(self, action, entity, entity_id=None, patient_id=None, changes=None, facility=None):
+        self.append([(datetime.utcnow(), current_actor(), action, entity, entity_id, patient_id,
+                      facility or current_facility(), changes or None)])
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self.thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        #Write everything buffered so far in one transaction; returns the number of events written
+        with self.flush_lock:
+            with self.lock:
+                events, self.buffer = self.buffer, []
+            if not events:
+                return 0
+            columns = [column.name for column in audit_events.columns if column.name != 'id']
+            try:
+                with self.engine.begin() as connection:
+                    connection.execute(audit_events.insert(), [
+                        dict(zip(columns, row[:-1]), changes=json.dumps(row[-1]) if row[-1] else None) for row in events
+                    ])
+            except Exception as e:
+                # Keep the events for the next attempt rather than lose them
+                with self.lock:
+                    self.buffer[:0] = events
+                print(f"Audit log write failed ({e}); {len(events)} events kept for retry", file=sys.stderr)
+                return 0
+            self.written += len(events)
+            return len(events)
+
+def _audit_pragmas(dbapi_connection, connection_record):
+    dbapi_connection.execute('PRAGMA busy_timeout = 5000')
+    dbapi_connection.execute('PRAGMA journal_mode = WAL')
+
+audit_log = AuditLog()
+
+# Session and mapper hooks
+
+def _patient_id(instance):
+    # From already loaded state only; never triggers a lazy load
+    if isinstance(instance, Patient):
+        return instance.__dict__.get('id')
+    return instance.__dict__.get('patient_id')
+
+def _facility(session):
+    # Sessions know the facility they were opened for; others (e.g. bound by hand) use the current one
+    return session.info.get('facility') or current_facility()
+
+def _coalesced(session, key, now):
+    # True if this session logged a read of key within READ_COALESCE_SECONDS; otherwise notes this one
+    reads = session.info.setdefault('audit_reads', {})
+    last = reads.get(key)
+    if last is not None and now - last < READ_COALESCE_SECONDS:
+        return True
+    if len(reads) > 10000:
+        reads.clear()
+    reads[key] = now
+    return False
+
+def _on_read(instance, context, attrs=None):
+    session = context.session
+    if session is None:
+        return
+    key = (type(instance).__table__.name, instance.__dict__.get('id'))
+    if _coalesced(session, key, time.monotonic()):
+        return
+    audit_log.append([(datetime.utcnow(), current_actor(), 'read', key[0], key[1], _patient_id(instance),
+                       _facility(session), None)])
+
+def _on_row_reads(session, model, rows):
+    # Tuples from read_rows carry an id and, for a patient's records, patient_id
+    if model not in AUDITED_MODELS:
+        return
+    entity = model.__table__.name
+    now, at, actor, facility = time.monotonic(), datetime.utcnow(), current_actor(), _facility(session)
+    events = [(at, actor, 'read', entity, row.id, row.id if model is Patient else getattr(row, 'patient_id', None),
+               facility, None)
+              for row in rows if not _coalesced(session, (entity, row.id), now)]
+    if events:
+        audit_log.append(events)
+
+@lru_cache(maxsize=None)
+def _sensitive(mapper):
+    # Keys of the mapper's encrypted columns and their blind indexes
+    encrypted = {attr.key: attr.columns[0].type for attr in mapper.column_attrs
+                 if isinstance(attr.columns[0].type, EncryptedString)}
+    return frozenset(encrypted), frozenset(kind.blind_index for kind in encrypted.values() if kind.blind_index)
+
+def _changes(state, new=False):
+    changes = {}
+    redacted, hidden = _sensitive(state.mapper)
+    if not encryption_enabled():
+        redacted = ()
+    for attr in state.mapper.column_attrs:
+        if attr.key in IGNORED_COLUMNS or attr.key in hidden:
+            continue
+        history = state.attrs[attr.key].history
+        if new:
+            value = state.dict.get(attr.key)
+            if value is not None:
+                changes[attr.key] = [None, REDACTED if attr.key in redacted else _plain(value)]
+        elif history.has_changes():
+            if attr.key in redacted:
+                changes[attr.key] = [REDACTED, REDACTED]
+                continue
+            old = history.deleted[0] if history.deleted else None
+            changes[attr.key] = [_plain(old), _plain(history.added[0] if history.added else None)]
+    return changes
+
+def _after_flush(session, flush_context):
+    # History is still intact here; the events wait in session.info until commit
+    pending = session.info.setdefault('audit_pending', [])
+    actor = current_actor()
+    at = datetime.utcnow()
+    facility = _facility(session)
+    for instances, kind in ((session.new, 'create'), (session.dirty, 'update'), (session.deleted, 'delete')):
+        for instance in instances:
+            if not isinstance(instance, AUDITED_MODELS):
+                continue
+            state = inspect(instance)
+            changes = _changes(state, new=kind == 'create')
+            action = kind
+            if kind == 'update':
+                if not changes:
+                    continue
+                if 'deleted_at' in changes:
+                    action = 'delete' if changes['deleted_at'][0] is None else 'restore'
+            pending.append((at, actor, action, instance.__table__.name, instance.__dict__.get('id'),
+                            _patient_id(instance), facility, changes or None))
+
+def _after_commit(session):
+    pending = session.info.pop('audit_pending', None)
+    if pending:
+        audit_log.append(pending)
+
+def _after_rollback(session):
+    session.info.pop('audit_pending', None)
+
+_installed = False
+
+def install():
+    #Register the audit hooks (done once, when app.database is imported)
+    global _installed
+    if _installed:
+        return
+    for model in AUDITED_MODELS:
+        event.listen(model, 'load', _on_read)
+        event.listen(model, 'refresh', _on_read)
+    row_read_listeners.append(_on_row_reads)
+    event.listen(Session, 'after_flush', _after_flush)
+    event.listen(Session, 'after_commit', _after_commit)
+    event.listen(Session, 'after_rollback', _after_rollback)
+    _installed = True
+
+def uninstall():
+    #Remove the audit hooks, e.g. to measure their overhead
+    global _installed
+    if not _installed:
+        return
+    for model in AUDITED_MODELS:
+        event.remove(model, 'load', _on_read)
+        event.remove(model, 'refresh', _on_read)
+    row_read_listeners.remove(_on_row_reads)
+    event.remove(Session, 'after_flush', _after_flush)
+    event.remove(Session, 'after_commit', _after_commit)
+    event.remove(Session, 'after_rollback', _after_rollback)
+    _installed = False
+
+# Query tooling
+
+def query_events(patient_id=None, actor=None, start=None, end=None, entity=None, action=None, entity_id=None, limit=100,
+                 facility=None):
+    #Audit events matching all given filters, newest first (pending events are flushed first)
+    audit_log.flush()
+    query = select(audit_events)
+    if facility:
+        query = query.where(audit_events.c.facility == facility)
+    if patient_id is not None:
+        query = query.where(audit_events.c.patient_id == patient_id)
+    if actor:
+        query = query.where(audit_events.c.actor == actor)
+    if start:
+        query = query.where(audit_events.c.at >= start)
+    if end:
+        query = query.where(audit_events.c.at < end)
+    if entity:
+        query = query.where(audit_events.c.entity == entity)
+    if entity_id is not None:
+        query = query.where(audit_events.c.entity_id == entity_id)
+    if action:
+        if action not in ACTIONS:
+            raise ValueError(f"Action must be one of: {', '.join(ACTIONS)}")
+        query = query.where(audit_events.c.action == action)
+    with audit_log.engine.connect() as connection:
+        return connection.execute(query.order_by(audit_events.c.at.desc(), audit_events.c.id.desc()).limit(limit)).all()
+
+def format_changes(changes, width=60):
+    if not changes:
+        return ''
+    text = ', '.join(f"{column}: {old} -> {new}" for column, (old, new) in json.loads(changes).items())
+    return text if len(text) <= width else text[:width - 3] + '...'
+
+def _parse_time(value):
+    return datetime.fromisoformat(value)
+
+def main():
+    # Command line entry point: python -m app.audit
+    parser = argparse.ArgumentParser(description='Query the audit trail')
+    parser.add_argument('--patient', type=int, help='patient id')
+    parser.add_argument('--actor')
+    parser.add_argument('--since', type=_parse_time, help='start, e.g. 2026-10-01 or "2026-10-01 08:00" (UTC)')
+    parser.add_argument('--until', type=_parse_time, help='end (exclusive, UTC)')
+    parser.add_argument('--entity', help='table name, e.g. medical_records')
+    parser.add_argument('--id', type=int, help='entity id')
+    parser.add_argument('--action', choices=ACTIONS)
+    parser.add_argument('--facility', help='facility code (default: all)')
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--json', action='store_true', help='one JSON object per line')
+    args = parser.parse_args()
+
+    rows = query_events(args.patient, args.actor, args.since, args.until, args.entity, args.action, args.id, args.limit,
+                        args.facility)
+    if args.json:
+        for row in rows:
+            print(json.dumps(dict(row._mapping, at=row.at.isoformat(),
+                                  changes=json.loads(row.changes) if row.changes else None)))
+        return
+
+    from tabulate import tabulate
+    table_data = [[row.at.strftime('%Y-%m-%d %H:%M:%S'), row.facility, row.actor, row.action, row.entity, row.entity_id,
+                   row.patient_id, format_changes(row.changes)] for row in rows]
+    print(tabulate(table_data, headers=["At (UTC)", "Facility", "Actor", "Action", "Entity", "ID", "Patient", "Changes"],
+                   tablefmt="grid"))
+
+if __name__ == "__main__":
+    main()
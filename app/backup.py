@@ -0,0 +1,296 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+# Add the parent directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database import database_path, facilities, refresh_snapshot
+from app.facilities import MAIN_FACILITY, current_facility, set_facility
+
+# Backups are taken with SQLite's online backup API, a few pages per step, so
+# the CLI can keep committing while a copy is made (copying the file directly
+# can capture a half-written page). Each backup is a .db or .db.gz file with a
+# JSON manifest beside it holding its SHA-256 checksum. Restores verify the
+# checksum and PRAGMA integrity_check before writing anything, then copy the
+# backup into hospital.db with the same API, which takes SQLite's locks
+# instead of replacing the file under open connections. Other facilities'
+# backups go to backups/<facility>/, so each keeps its own rotation.
+
+BACKUP_DIR = 'backups'
+BACKUP_PAGES = 4096
+MAX_RESTARTS = 3
+KEEP_LAST = 7
+KEEP_DAILY = 14
+CHUNK_SIZE = 1024 * 1024
+
+def backup_directory(facility=None):
+    #Backup directory of a facility (the current one by default)
+    facility = facility or current_facility()
+    return BACKUP_DIR if facility == MAIN_FACILITY else os.path.join(BACKUP_DIR, facility)
+
+def _connect_read_only(path):
+    return sqlite3.connect(f'file:{os.path.abspath(path)}?mode=ro', uri=True)
+
+class _Restarted(Exception):
+    pass
+
+def online_copy(source, target, pages=BACKUP_PAGES, progress=None):
+    #Copy between open connections with the backup API, `pages` at a time; returns (page count, restarts)
+    # SQLite restarts a stepped copy whenever another connection writes to the
+    # source. After MAX_RESTARTS the rest is copied in one step, which under
+    # WAL holds only a read snapshot and still does not block writers.
+    state = {'pages': 0, 'remaining': None, 'restarts': 0}
+    def step(status, remaining, total):
+        if state['remaining'] is not None and remaining >= state['remaining']:
+            state['restarts'] += 1
+            if state['restarts'] > MAX_RESTARTS:
+                raise _Restarted
+        state['pages'], state['remaining'] = total, remaining
+        if progress:
+            progress(total - remaining, total)
+    try:
+        source.backup(target, pages=pages, progress=step)
+    except _Restarted:
+        state['remaining'] = None
+        source.backup(target, pages=-1, progress=step)
+    return state['pages'], state['restarts']
+
+def checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def integrity_check(path):
+    #Return 'ok' or the problems PRAGMA integrity_check reports
+    connection = _connect_read_only(path)
+    try:
+        rows = [row[0] for row in connection.execute('PRAGMA integrity_check')]
+    finally:
+        connection.close()
+    return 'ok' if rows == ['ok'] else '; '.join(rows)
+
+def create_backup(database=None, directory=None, compress=True, label=None,
+                  pages=BACKUP_PAGES, rotate=True, progress=None):
+    #Take an online backup; returns its manifest
+    database = database or database_path()
+    directory = directory or backup_directory()
+    os.makedirs(directory, exist_ok=True)
+    created = datetime.now()
+    name = f"hospital_{created:%Y%m%d_%H%M%S}" + (f"_{label}" if label else "")
+    raw_path = os.path.join(directory, name + '.db')
+    partial = raw_path + '.part'
+
+    started = time.perf_counter()
+    source = _connect_read_only(database)
+    target = sqlite3.connect(partial)
+    try:
+        page_count, restarts = online_copy(source, target, pages, progress)
+        target.execute('PRAGMA journal_mode = DELETE')
+        schema_version = target.execute('PRAGMA user_version').fetchone()[0]
+    finally:
+        target.close()
+        source.close()
+    copied = time.perf_counter() - started
+
+    if compress:
+        path = raw_path + '.gz'
+        with open(partial, 'rb') as src, gzip.open(path + '.part', 'wb', compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+        os.remove(partial)
+        os.replace(path + '.part', path)
+    else:
+        path = raw_path
+        os.replace(partial, path)
+
+    manifest = {
+        'name': name,
+        'file': os.path.basename(path),
+        'created_at': created.isoformat(timespec='seconds'),
+        'source': os.path.abspath(database),
+        'label': label,
+        'compressed': compress,
+        'pages': page_count,
+        'restarts': restarts,
+        'size': os.path.getsize(path),
+        'sha256': checksum(path),
+        'schema_version': schema_version,
+        'seconds': round(time.perf_counter() - started, 2),
+        'copy_seconds': round(copied, 2)
+    }
+    # The manifest is written last, so a backup without one is incomplete
+    with open(os.path.join(directory, name + '.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    if rotate:
+        rotate_backups(directory)
+    return manifest
+
+def list_backups(directory=None):
+    #Manifests of complete backups, newest first
+    directory = directory or backup_directory()
+    if not os.path.isdir(directory):
+        return []
+    manifests = []
+    for entry in os.listdir(directory):
+        if entry.endswith('.json'):
+            with open(os.path.join(directory, entry)) as f:
+                manifests.append(json.load(f))
+    return sorted(manifests, key=lambda manifest: manifest['created_at'], reverse=True)
+
+def rotate_backups(directory=None, keep_last=KEEP_LAST, keep_daily=KEEP_DAILY, now=None):
+    #Keep the newest keep_last backups plus the newest one of each of the last keep_daily days
+    directory = directory or backup_directory()
+    manifests = list_backups(directory)
+    keep = {manifest['name'] for manifest in manifests[:keep_last]}
+    cutoff = (now or datetime.now()).date() - timedelta(days=keep_daily)
+    days = set()
+    for manifest in manifests:
+        day = datetime.fromisoformat(manifest['created_at']).date()
+        if day > cutoff and day not in days:
+            days.add(day)
+            keep.add(manifest['name'])
+        # Safety copies taken before a restore are never rotated out
+        if manifest.get('label') == 'pre-restore':
+            keep.add(manifest['name'])
+
+    removed = []
+    for manifest in manifests:
+        if manifest['name'] not in keep:
+            os.remove(os.path.join(directory, manifest['name'] + '.json'))
+            backup_path = os.path.join(directory, manifest['file'])
+            if os.path.exists(backup_path):
+                os.remove(backup_path)
+            removed.append(manifest['name'])
+    return removed
+
+def find_backup(name=None, before=None, directory=None):
+    #Backup by name, or the newest taken at or before `before` (point in time), or the newest
+    directory = directory or backup_directory()
+    for manifest in list_backups(directory):
+        if name and manifest['name'] != name:
+            continue
+        if before and datetime.fromisoformat(manifest['created_at']) > before:
+            continue
+        return manifest
+    return None
+
+def verify_backup(manifest, directory=None, keep_copy=False):
+    #Check the checksum and integrity of a backup; returns the path of a verified plain copy if keep_copy
+    directory = directory or backup_directory()
+    path = os.path.join(directory, manifest['file'])
+    if not os.path.exists(path):
+        raise ValueError(f"Backup file {manifest['file']} is missing")
+    if checksum(path) != manifest['sha256']:
+        raise ValueError(f"Checksum mismatch for {manifest['file']}")
+
+    if manifest['compressed']:
+        plain = os.path.join(directory, manifest['name'] + '.verify.db')
+        with gzip.open(path, 'rb') as src, open(plain, 'wb') as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    else:
+        plain = path
+
+    try:
+        result = integrity_check(plain)
+        if result != 'ok':
+            raise ValueError(f"Integrity check failed for {manifest['file']}: {result}")
+    except Exception:
+        if plain != path:
+            os.remove(plain)
+        raise
+
+    if not keep_copy and plain != path:
+        os.remove(plain)
+        return None
+    return plain
+
+def restore_backup(manifest, database=None, directory=None, pages=BACKUP_PAGES, progress=None):
+    #Verify a backup and copy it into the database; a safety backup of the current data is taken first
+    database = database or database_path()
+    directory = directory or backup_directory()
+    plain = verify_backup(manifest, directory, keep_copy=True)
+    try:
+        safety = create_backup(database, directory, label='pre-restore', rotate=False) \
+            if os.path.exists(database) else None
+
+        source = _connect_read_only(plain)
+        target = sqlite3.connect(database, timeout=30)
+        try:
+            online_copy(source, target, pages, progress)
+            result = [row[0] for row in target.execute('PRAGMA quick_check')]
+        finally:
+            target.close()
+            source.close()
+        if result != ['ok']:
+            raise ValueError(f"Restored database failed quick_check: {'; '.join(result)}")
+    finally:
+        if plain != os.path.join(directory, manifest['file']):
+            os.remove(plain)
+
+    # The reporting snapshot of the restored facility still holds the data from
+    # before the restore; a file that is no facility's database has none
+    restored = os.path.abspath(database)
+    for facility in facilities():
+        if os.path.abspath(database_path(facility)) == restored:
+            refresh_snapshot(max_age=0, facility=facility)
+    return safety
+
+def _print_progress(done, total):
+    print(f"\r  {done}/{total} pages ({done / total * 100 if total else 100:.0f}%)", end='', flush=True)
+    if done == total:
+        print()
+
+def main():
+    # Command line entry point: python -m app.backup
+    parser = argparse.ArgumentParser(description="Back up and restore a facility's database")
+    sub = parser.add_subparsers(dest='command', required=True)
+    create = sub.add_parser('create', help='take an online backup')
+    create.add_argument('--no-compress', action='store_true')
+    create.add_argument('--label')
+    sub.add_parser('list', help='list backups, newest first')
+    for command in ('verify', 'restore'):
+        action = sub.add_parser(command)
+        action.add_argument('name', nargs='?', help='backup name (default: newest)')
+        action.add_argument('--before', type=datetime.fromisoformat,
+                            help='use the newest backup taken at or before this time (YYYY-MM-DD[THH:MM])')
+    sub.add_parser('rotate', help=f'apply the retention policy ({KEEP_LAST} latest, one per day for {KEEP_DAILY} days)')
+    parser.add_argument('--facility', help='facility code (default: HOSPITAL_FACILITY or main)')
+    parser.add_argument('--database', help="database file (default: the facility's)")
+    parser.add_argument('--directory', help='backup directory (default: backups/, or backups/<facility>/)')
+    args = parser.parse_args()
+    if args.facility:
+        set_facility(args.facility)
+
+    if args.command == 'create':
+        manifest = create_backup(args.database, args.directory, not args.no_compress, args.label,
+                                 progress=_print_progress)
+        print(f"{manifest['file']}: {manifest['size']:,} bytes in {manifest['seconds']}s, sha256 {manifest['sha256'][:16]}")
+    elif args.command == 'list':
+        for manifest in list_backups(args.directory):
+            print(f"{manifest['name']:<40} {manifest['created_at']:<20} {manifest['size']:>15,}")
+    elif args.command == 'rotate':
+        for name in rotate_backups(args.directory):
+            print(f"removed {name}")
+    else:
+        manifest = find_backup(args.name, args.before, args.directory)
+        if manifest is None:
+            parser.error("no matching backup")
+        if args.command == 'verify':
+            verify_backup(manifest, args.directory)
+            print(f"{manifest['name']}: checksum and integrity ok")
+        else:
+            safety = restore_backup(manifest, args.database, args.directory, progress=_print_progress)
+            print(f"Restored {manifest['name']}" + (f"; previous data saved as {safety['name']}" if safety else ""))
+
+if __name__ == "__main__":
+    main()
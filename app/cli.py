@@ -1,24 +1,60 @@
 import sys
 import os
-from tabulate import tabulate
-from datetime import datetime
+import importlib
+from functools import cached_property
+from datetime import datetime, timedelta
+from decimal import Decimal
 
 # Add the parent directory to Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+class LazyImport:
+    # Stand-in for `from module import name` that imports on first use, so
+    # showing the main menu does not pay for SQLAlchemy, tabulate or services.
+
+    def __init__(self, module, name):
+        self._module = module
+        self._name = name
+        self._target = None
+
+    def _load(self):
+        if self._target is None:
+            self._target = getattr(importlib.import_module(self._module), self._name)
+        return self._target
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+    def __iter__(self):
+        return iter(self._load())
+
 # Now import your modules
-from app.database import get_db, init_db
-from app.services.patient_service import PatientService
-from app.services.staff_service import StaffService
-from app.services.appointment_service import AppointmentService
-from app.services.medical_record_service import MedicalRecordService
-from app.services.billing_service import BillingService
-from app.validators import validate_name, validate_email, validate_phone, validate_date, validate_datetime, validate_gender, validate_positive_number
+tabulate = LazyImport('tabulate', 'tabulate')
+PatientService = LazyImport('app.services.patient_service', 'PatientService')
+StaffService = LazyImport('app.services.staff_service', 'StaffService')
+AppointmentService = LazyImport('app.services.appointment_service', 'AppointmentService')
+MedicalRecordService = LazyImport('app.services.medical_record_service', 'MedicalRecordService')
+BillingService = LazyImport('app.services.billing_service', 'BillingService')
+StatsService = LazyImport('app.services.stats_service', 'StatsService')
+AnalyticsService = LazyImport('app.services.analytics_service', 'AnalyticsService')
+WorkloadService = LazyImport('app.services.workload_service', 'WorkloadService')
+SchedulingService = LazyImport('app.services.scheduling_service', 'SchedulingService')
+CoverageService = LazyImport('app.services.coverage_service', 'CoverageService')
+NotificationService = LazyImport('app.services.notification_service', 'NotificationService')
+TrashService = LazyImport('app.services.trash_service', 'TrashService')
+AppointmentStatus = LazyImport('app.models', 'AppointmentStatus')
+BillStatus = LazyImport('app.models', 'BillStatus')
+validate_date = LazyImport('app.validators', 'validate_date')
+validate_datetime = LazyImport('app.validators', 'validate_datetime')
+validate_positive_number = LazyImport('app.validators', 'validate_positive_number')
 
 class HospitalCLI:
     def __init__(self):
-        init_db()
-        self.db = next(get_db())
+        # The session (and with it the schema check) is opened on first use
+        self._db = None
         
         # Main menu options
         self.menu_options = {
@@ -27,52 +63,101 @@ class HospitalCLI:
             '3': {'name': 'Appointment Management', 'function': self.appointment_menu},
             '4': {'name': 'Medical Records Management', 'function': self.medical_record_menu},
             '5': {'name': 'Billing Management', 'function': self.billing_menu},
-            '6': {'name': 'Exit', 'function': self.exit_program}
+            '6': {'name': 'Dashboard', 'function': self.dashboard_menu},
+            '7': {'name': 'Reports', 'function': self.reports_menu},
+            '8': {'name': 'Maintenance', 'function': self.maintenance_menu},
+            '9': {'name': 'Switch Facility', 'function': self.switch_facility},
+            '10': {'name': 'Exit', 'function': self.exit_program}
         }
-        
-        # Patient menu options
-        self.patient_options = {
+
+    @property
+    def db(self):
+        #Open the database session on first use
+        if self._db is None:
+            from app.database import get_db
+            self.ensure_schema()
+            self._db = next(get_db())
+        return self._db
+
+    def ensure_schema(self):
+        #Create or upgrade the current facility's database, for work that opens its own connections
+        # A single PRAGMA read once the schema is current
+        from app.database import init_db
+        init_db()
+
+    def read_db(self, source=None):
+        #Short-lived session for listings and reports on a read-only source
+        from app.database import read_session, DEFAULT_READ_SOURCE
+        self.ensure_schema()
+        return read_session(source or DEFAULT_READ_SOURCE)
+
+    def names(self, db, service, ids):
+        #"First Last (ID)" for each id, fetched in one go with service.get_many; deleted people keep their names
+        people = service.get_many(db, ids, include_deleted=True)
+        return {person.id: f"{person.first_name} {person.last_name} ({person.id})" for person in people}
+
+    @cached_property
+    def patient_options(self):
+        #Patient menu options, built the first time the menu is opened
+        return {
             '1': {'name': 'Register New Patient', 'function': self.register_patient},
             '2': {'name': 'View All Patients', 'function': self.view_all_patients},
             '3': {'name': 'Search Patient', 'function': self.search_patient},
             '4': {'name': 'Update Patient', 'function': self.update_patient},
             '5': {'name': 'Delete Patient', 'function': self.delete_patient},
-            '6': {'name': 'Back to Main Menu', 'function': self.main_menu}
+            '6': {'name': 'Search All Facilities', 'function': self.search_all_facilities},
+            '7': {'name': 'Back to Main Menu', 'function': self.main_menu}
         }
-        
-        # Staff menu options
-        self.staff_options = {
+
+    @cached_property
+    def staff_options(self):
+        #Staff menu options, built the first time the menu is opened
+        return {
             '1': {'name': 'Register New Staff', 'function': self.register_staff},
             '2': {'name': 'View All Staff', 'function': self.view_all_staff},
             '3': {'name': 'Search Staff', 'function': self.search_staff},
             '4': {'name': 'Update Staff', 'function': self.update_staff},
             '5': {'name': 'Delete Staff', 'function': self.delete_staff},
-            '6': {'name': 'Back to Main Menu', 'function': self.main_menu}
+            '6': {'name': 'Working Hours', 'function': self.staff_working_hours},
+            '7': {'name': 'Shifts', 'function': self.staff_shifts},
+            '8': {'name': 'Back to Main Menu', 'function': self.main_menu}
         }
-        
-        # Appointment menu options
-        self.appointment_options = {
+
+    @cached_property
+    def appointment_options(self):
+        #Appointment menu options, built the first time the menu is opened
+        return {
             '1': {'name': 'Schedule New Appointment', 'function': self.schedule_appointment},
             '2': {'name': 'View All Appointments', 'function': self.view_all_appointments},
             '3': {'name': 'View Patient Appointments', 'function': self.view_patient_appointments},
             '4': {'name': 'View Staff Appointments', 'function': self.view_staff_appointments},
             '5': {'name': 'Update Appointment', 'function': self.update_appointment},
             '6': {'name': 'Delete Appointment', 'function': self.delete_appointment},
-            '7': {'name': 'Back to Main Menu', 'function': self.main_menu}
+            '7': {'name': 'Schedule Recurring Appointments', 'function': self.schedule_series},
+            '8': {'name': 'Update Appointment Series', 'function': self.update_series},
+            '9': {'name': 'Cancel Appointment Series', 'function': self.cancel_series},
+            '10': {'name': 'Find and Book Available Slot', 'function': self.book_available_slot},
+            '11': {'name': 'Back to Main Menu', 'function': self.main_menu}
         }
-        
-        # Medical record menu options
-        self.medical_record_options = {
+
+    @cached_property
+    def medical_record_options(self):
+        #Medical record menu options, built the first time the menu is opened
+        return {
             '1': {'name': 'Create New Medical Record', 'function': self.create_medical_record},
             '2': {'name': 'View All Medical Records', 'function': self.view_all_medical_records},
             '3': {'name': 'View Patient Medical Records', 'function': self.view_patient_medical_records},
             '4': {'name': 'Update Medical Record', 'function': self.update_medical_record},
             '5': {'name': 'Delete Medical Record', 'function': self.delete_medical_record},
-            '6': {'name': 'Back to Main Menu', 'function': self.main_menu}
+            '6': {'name': 'Find Patients on Medication', 'function': self.find_patients_on_drug},
+            '7': {'name': 'View Patient Active Medications', 'function': self.view_active_medications},
+            '8': {'name': 'Back to Main Menu', 'function': self.main_menu}
         }
-        
-        # Billing menu options
-        self.billing_options = {
+
+    @cached_property
+    def billing_options(self):
+        #Billing menu options, built the first time the menu is opened
+        return {
             '1': {'name': 'Create New Bill', 'function': self.create_bill},
             '2': {'name': 'View All Bills', 'function': self.view_all_bills},
             '3': {'name': 'View Patient Bills', 'function': self.view_patient_bills},
@@ -80,7 +165,51 @@ class HospitalCLI:
             '5': {'name': 'Mark Bill as Paid', 'function': self.mark_bill_paid},
             '6': {'name': 'Update Bill', 'function': self.update_bill},
             '7': {'name': 'Delete Bill', 'function': self.delete_bill},
-            '8': {'name': 'Back to Main Menu', 'function': self.main_menu}
+            '8': {'name': 'Revenue Report', 'function': self.revenue_report},
+            '9': {'name': 'Generate Patient Statements', 'function': self.generate_statements},
+            '10': {'name': 'Back to Main Menu', 'function': self.main_menu}
+        }
+
+    @cached_property
+    def dashboard_options(self):
+        #Dashboard menu options, built the first time the menu is opened
+        return {
+            '1': {'name': 'View Dashboard', 'function': self.view_dashboard},
+            '2': {'name': 'On-Call Board', 'function': self.on_call_board},
+            '3': {'name': 'Rebuild Statistics', 'function': self.rebuild_statistics},
+            '4': {'name': 'Back to Main Menu', 'function': self.main_menu}
+        }
+
+    @cached_property
+    def reports_options(self):
+        #Reports menu options, built the first time the menu is opened
+        return {
+            '1': {'name': 'Bed Census and Occupancy', 'function': self.census_report},
+            '2': {'name': 'Length of Stay by Diagnosis', 'function': self.length_of_stay_by_diagnosis},
+            '3': {'name': 'Length of Stay by Staff', 'function': self.length_of_stay_by_staff},
+            '4': {'name': 'Readmission Rate', 'function': self.readmission_report},
+            '5': {'name': 'Staff Workload', 'function': self.staff_workload_report},
+            '6': {'name': 'Department Coverage', 'function': self.department_coverage_report},
+            '7': {'name': 'Run Report in Background', 'function': self.run_background_report},
+            '8': {'name': 'View Generated Reports', 'function': self.view_generated_reports},
+            '9': {'name': 'Back to Main Menu', 'function': self.main_menu}
+        }
+
+    @cached_property
+    def maintenance_options(self):
+        #Maintenance menu options, built the first time the menu is opened
+        return {
+            '1': {'name': 'Create Backup', 'function': self.create_backup},
+            '2': {'name': 'List Backups', 'function': self.list_backups},
+            '3': {'name': 'Verify Backup', 'function': self.verify_backup},
+            '4': {'name': 'Restore Backup', 'function': self.restore_backup},
+            '5': {'name': 'Run Scheduled Jobs Now', 'function': self.run_scheduled_jobs},
+            '6': {'name': 'View Outbox Messages', 'function': self.view_outbox},
+            '7': {'name': 'View Deleted Records', 'function': self.view_deleted_records},
+            '8': {'name': 'Restore Deleted Record', 'function': self.restore_deleted_record},
+            '9': {'name': 'Purge Deleted Records', 'function': self.purge_deleted_records},
+            '10': {'name': 'View Audit Trail', 'function': self.view_audit_trail},
+            '11': {'name': 'Back to Main Menu', 'function': self.main_menu}
         }
 
     def display_menu(self, options):
@@ -102,9 +231,11 @@ class HospitalCLI:
     def main_menu(self):
         #Display the main menu
         while True:
+            if self._db is not None:
+                print(f"\nFacility: {self._db.info['facility']}")
             self.display_menu(self.menu_options)
             choice = self.get_user_choice(self.menu_options)
-            if choice == '6':
+            if choice == '10':
                 self.menu_options[choice]['function']()
             else:
                 self.menu_options[choice]['function']()
@@ -114,7 +245,7 @@ class HospitalCLI:
         while True:
             self.display_menu(self.patient_options)
             choice = self.get_user_choice(self.patient_options)
-            if choice == '6':
+            if choice == '7':
                 return
             else:
                 self.patient_options[choice]['function']()
@@ -124,7 +255,7 @@ class HospitalCLI:
         while True:
             self.display_menu(self.staff_options)
             choice = self.get_user_choice(self.staff_options)
-            if choice == '6':
+            if choice == '8':
                 return
             else:
                 self.staff_options[choice]['function']()
@@ -134,7 +265,7 @@ class HospitalCLI:
         while True:
             self.display_menu(self.appointment_options)
             choice = self.get_user_choice(self.appointment_options)
-            if choice == '7':
+            if choice == '11':
                 return
             else:
                 self.appointment_options[choice]['function']()
@@ -144,7 +275,7 @@ class HospitalCLI:
         while True:
             self.display_menu(self.medical_record_options)
             choice = self.get_user_choice(self.medical_record_options)
-            if choice == '6':
+            if choice == '8':
                 return
             else:
                 self.medical_record_options[choice]['function']()
@@ -154,11 +285,41 @@ class HospitalCLI:
         while True:
             self.display_menu(self.billing_options)
             choice = self.get_user_choice(self.billing_options)
-            if choice == '8':
+            if choice == '10':
                 return
             else:
                 self.billing_options[choice]['function']()
 
+    def dashboard_menu(self):
+        #Display the dashboard menu
+        while True:
+            self.display_menu(self.dashboard_options)
+            choice = self.get_user_choice(self.dashboard_options)
+            if choice == '4':
+                return
+            else:
+                self.dashboard_options[choice]['function']()
+
+    def reports_menu(self):
+        #Display the reports menu
+        while True:
+            self.display_menu(self.reports_options)
+            choice = self.get_user_choice(self.reports_options)
+            if choice == '9':
+                return
+            else:
+                self.reports_options[choice]['function']()
+
+    def maintenance_menu(self):
+        #Display the maintenance menu
+        while True:
+            self.display_menu(self.maintenance_options)
+            choice = self.get_user_choice(self.maintenance_options)
+            if choice == '11':
+                return
+            else:
+                self.maintenance_options[choice]['function']()
+
     # Patient management methods
     def register_patient(self):
         #Register a new patient
@@ -190,11 +351,13 @@ class HospitalCLI:
             patient = PatientService.create_patient(self.db, patient_dict)
             print(f"\nPatient registered successfully! Patient ID: {patient.id}")
         except Exception as e:
+            self.db.rollback()
             print(f"\nError: {e}")
 
     def view_all_patients(self):
         #View all patients
-        patients = PatientService.get_all_patients(self.db)
+        with self.read_db() as db:
+            patients = PatientService.list_patients(db)
         
         if not patients:
             print("\nNo patients found.")
@@ -216,27 +379,69 @@ class HospitalCLI:
         print("\n" + tabulate(table_data, headers=headers, tablefmt="grid"))
 
     def search_patient(self):
-        #Search for patients by name
-        search_term = input("\nEnter patient name to search: ").strip()
-        patients = PatientService.search_patients(self.db, search_term)
+        #Search for patients by name, tolerating misspellings, or by exact phone number or email
+        search_term = input("\nEnter patient name, phone number or email to search: ").strip()
+        is_contact = '@' in search_term or search_term.lstrip('+').isdigit()
+        date_of_birth = '' if is_contact else input("Date of birth (YYYY-MM-DD, optional): ").strip()
+        try:
+            with self.read_db() as db:
+                if is_contact:
+                    matches = [(patient, None) for patient in PatientService.find_by_contact(db, search_term)]
+                else:
+                    matches = PatientService.fuzzy_search_patients(db, search_term, date_of_birth or None)
+                if not matches and not date_of_birth and not is_contact:
+                    # Partial names ("Smi") are found by the plain substring search
+                    matches = [(patient, None) for patient in PatientService.search_patients(db, search_term)]
+        except ValueError as e:
+            print(f"\nError: {e}")
+            return
         
-        if not patients:
+        if not matches:
             print("\nNo patients found.")
             return
         
         # Prepare data for tabular display
         table_data = []
-        for patient in patients:
+        for patient, score in matches:
             table_data.append([
                 patient.id,
                 f"{patient.first_name} {patient.last_name}",
                 patient.date_of_birth,
                 patient.gender,
                 patient.contact_number,
-                patient.email
+                patient.email,
+                f"{score:.0%}" if score is not None else ''
             ])
         
-        headers = ["ID", "Name", "Date of Birth", "Gender", "Contact", "Email"]
+        headers = ["ID", "Name", "Date of Birth", "Gender", "Contact", "Email", "Match"]
+        print("\n" + tabulate(table_data, headers=headers, tablefmt="grid"))
+
+    def search_all_facilities(self):
+        #Search every facility's patients by name at once, e.g. for a patient transferred between clinics
+        search_term = input("\nEnter patient name to search: ").strip()
+        date_of_birth = input("Date of birth (YYYY-MM-DD, optional): ").strip()
+        try:
+            self.ensure_schema()
+            matches = PatientService.search_all_facilities(search_term, date_of_birth or None)
+        except ValueError as e:
+            print(f"\nError: {e}")
+            return
+        
+        if not matches:
+            print("\nNo patients found.")
+            return
+        
+        table_data = [[
+            facility,
+            patient.id,
+            f"{patient.first_name} {patient.last_name}",
+            patient.date_of_birth,
+            patient.gender,
+            patient.contact_number,
+            f"{score:.0%}" if score is not None else ''
+        ] for facility, patient, score in matches]
+        
+        headers = ["Facility", "ID", "Name", "Date of Birth", "Gender", "Contact", "Match"]
         print("\n" + tabulate(table_data, headers=headers, tablefmt="grid"))
 
     def update_patient(self):
@@ -274,13 +479,64 @@ class HospitalCLI:
                 update_data[field] = new_value
         
         if update_data:
+            self.save_with_merge("Patient", fields, patient, update_data,
+                                 lambda: PatientService.get_patient(self.db, patient_id),
+                                 lambda data, version: PatientService.update_patient(self.db, patient_id, data, version))
+        else:
+            print("No changes made.")
+
+    def save_with_merge(self, label, fields, record, update_data, load, save):
+        #Save edits made to record; if someone else saved it meanwhile, re-read, show both sides and merge
+        from app.validators import ConflictError
+        
+        # What the user saw when they started editing
+        expected_version = record.version
+        original = {field: getattr(record, field) for field, _ in fields}
+        while True:
             try:
-                updated_patient = PatientService.update_patient(self.db, patient_id, update_data)
-                print("Patient updated successfully!")
+                save(update_data, expected_version)
+                print(f"{label} updated successfully!")
+                return
+            except ConflictError:
+                self.db.rollback()
             except Exception as e:
+                self.db.rollback()
                 print(f"Error: {e}")
-        else:
-            print("No changes made.")
+                return
+            
+            current = load()
+            if not current:
+                print(f"\n{label} was deleted by someone else; your changes were not saved.")
+                return
+            
+            print(f"\n{label} was changed by someone else while you were editing:")
+            table_data = []
+            clashes = []
+            for field, prompt in fields:
+                theirs = getattr(current, field)
+                changed = str(theirs) != str(original[field])
+                mine = update_data.get(field)
+                table_data.append([prompt, original[field], theirs if changed else "", mine or ""])
+                if changed and mine is not None and mine != str(theirs):
+                    clashes.append((field, prompt, theirs, mine))
+            headers = ["Field", "When You Opened", "Changed To", "Your Change"]
+            print(tabulate(table_data, headers=headers, tablefmt="grid"))
+            
+            # Fields only one side touched merge cleanly; ask about the rest
+            for field, prompt, theirs, mine in clashes:
+                keep = input(f"{prompt}: keep yours ({mine}) or theirs ({theirs})? (mine/theirs): ").strip().lower()
+                if keep.startswith('t'):
+                    del update_data[field]
+            
+            if not update_data:
+                print("Nothing left to change; the current version was kept.")
+                return
+            confirm = input("Save your changes on top of the current version? (y/n): ").strip().lower()
+            if confirm != 'y':
+                print("Your changes were discarded.")
+                return
+            expected_version = current.version
+            original = {field: getattr(current, field) for field, _ in fields}
 
     def delete_patient(self):
         #Delete a patient
@@ -297,11 +553,17 @@ class HospitalCLI:
             print("Patient not found.")
             return
         
+        print("Their appointments, medical records and bills are deleted with them.")
         confirm = input(f"Are you sure you want to delete {patient.first_name} {patient.last_name}? (y/n): ").strip().lower()
         if confirm == 'y':
-            success = PatientService.delete_patient(self.db, patient_id)
+            try:
+                success = PatientService.delete_patient(self.db, patient_id)
+            except ValueError as e:
+                self.db.rollback()
+                print(f"Error: {e}")
+                return
             if success:
-                print("Patient deleted successfully!")
+                print("Patient deleted. It can be restored from the Maintenance menu.")
             else:
                 print("Error deleting patient.")
         else:
@@ -326,11 +588,13 @@ class HospitalCLI:
             staff = StaffService.create_staff(self.db, staff_data)
             print(f"\nStaff registered successfully! Staff ID: {staff.id}")
         except Exception as e:
+            self.db.rollback()
             print(f"\nError: {e}")
 
     def view_all_staff(self):
         #View all staff members
-        staff_members = StaffService.get_all_staff(self.db)
+        with self.read_db() as db:
+            staff_members = StaffService.list_staff(db)
         
         if not staff_members:
             print("\nNo staff members found.")
@@ -354,7 +618,8 @@ class HospitalCLI:
     def search_staff(self):
         #Search for staff by name or role
         search_term = input("\nEnter staff name or role to search: ").strip()
-        staff_members = StaffService.search_staff(self.db, search_term)
+        with self.read_db() as db:
+            staff_members = StaffService.search_staff(db, search_term)
         
         if not staff_members:
             print("\nNo staff members found.")
@@ -410,11 +675,9 @@ class HospitalCLI:
                 update_data[field] = new_value
         
         if update_data:
-            try:
-                updated_staff = StaffService.update_staff(self.db, staff_id, update_data)
-                print("Staff updated successfully!")
-            except Exception as e:
-                print(f"Error: {e}")
+            self.save_with_merge("Staff", fields, staff, update_data,
+                                 lambda: StaffService.get_staff(self.db, staff_id),
+                                 lambda data, version: StaffService.update_staff(self.db, staff_id, data, version))
         else:
             print("No changes made.")
 
@@ -435,36 +698,213 @@ class HospitalCLI:
         
         confirm = input(f"Are you sure you want to delete {staff.first_name} {staff.last_name}? (y/n): ").strip().lower()
         if confirm == 'y':
-            success = StaffService.delete_staff(self.db, staff_id)
+            try:
+                success = StaffService.delete_staff(self.db, staff_id)
+            except ValueError as e:
+                self.db.rollback()
+                print(f"Error: {e}")
+                return
             if success:
-                print("Staff deleted successfully!")
+                print("Staff deleted. It can be restored from the Maintenance menu.")
             else:
                 print("Error deleting staff.")
         else:
             print("Deletion cancelled.")
 
+    def staff_working_hours(self):
+        #Show a staff member's weekly hours and optionally replace them
+        staff_id = input("\nEnter staff ID: ").strip()
+        
+        try:
+            staff_id = int(staff_id)
+        except ValueError:
+            print("Invalid staff ID. Please enter a number.")
+            return
+        
+        staff = StaffService.get_staff(self.db, staff_id)
+        if not staff:
+            print("Staff not found.")
+            return
+        
+        days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+        hours = StaffService.get_working_hours(self.db, staff_id)
+        print(f"\nWorking hours of {staff.first_name} {staff.last_name}:")
+        table = [[day, ', '.join(f"{start:%H:%M}-{end:%H:%M}" for start, end in hours.get(weekday, [])) or 'Off']
+                 for weekday, day in enumerate(days)]
+        print(tabulate(table, headers=['Day', 'Hours'], tablefmt="grid"))
+        
+        if input("\nChange them? (y/n): ").strip().lower() != 'y':
+            return
+        print("For each day enter blocks as HH:MM-HH:MM separated by commas (e.g. 08:00-12:00, 13:00-17:00), blank for off;")
+        print("leaving every day blank restores the default hours (Monday to Friday, 08:00-17:00)")
+        new_hours = {}
+        try:
+            for weekday, day in enumerate(days):
+                entry = input(f"{day}: ").strip()
+                if entry:
+                    new_hours[weekday] = [tuple(part.split('-', 1)) if '-' in part else (part, '')
+                                          for part in (block.strip() for block in entry.split(','))]
+            StaffService.set_working_hours(self.db, staff_id, new_hours)
+            print("Working hours updated.")
+        except ValueError as e:
+            self.db.rollback()
+            print(f"Error: {e}")
+
+    def staff_shifts(self):
+        #Show a staff member's upcoming shifts and add or remove them
+        staff_id = input("\nEnter staff ID: ").strip()
+        
+        try:
+            staff_id = int(staff_id)
+        except ValueError:
+            print("Invalid staff ID. Please enter a number.")
+            return
+        
+        staff = StaffService.get_staff(self.db, staff_id)
+        if not staff:
+            print("Staff not found.")
+            return
+        
+        while True:
+            shifts = StaffService.get_shifts(self.db, staff_id)
+            print(f"\nUpcoming shifts of {staff.first_name} {staff.last_name}:")
+            if shifts:
+                table_data = [[shift.id, f"{shift.starts_at:%Y-%m-%d %H:%M}", f"{shift.ends_at:%Y-%m-%d %H:%M}",
+                               shift.department, shift.role, shift.kind.label] for shift in shifts]
+                print(tabulate(table_data, headers=["ID", "Starts", "Ends", "Department", "Role", "Kind"], tablefmt="grid"))
+            else:
+                print("None rostered.")
+            
+            action = input("\n(a)dd shift, (r)emove shift, roster from (w)orking hours, or Enter to return: ").strip().lower()
+            try:
+                if action == 'a':
+                    starts_at = input("Starts (YYYY-MM-DD HH:MM): ").strip()
+                    ends_at = input("Ends (YYYY-MM-DD HH:MM): ").strip()
+                    kind = input("Kind (Regular/On Call, default: Regular): ").strip() or 'Regular'
+                    department = input(f"Department (default: {staff.department}): ").strip()
+                    StaffService.add_shift(self.db, staff_id, starts_at, ends_at, kind, department or None)
+                    print("Shift added.")
+                elif action == 'r':
+                    shift_id = int(input("Shift ID to remove: ").strip())
+                    if StaffService.remove_shift(self.db, shift_id):
+                        print("Shift removed.")
+                    else:
+                        print("Shift not found.")
+                elif action == 'w':
+                    first_day = validate_date(input("First day (YYYY-MM-DD): ").strip())
+                    last_day = validate_date(input("Last day (YYYY-MM-DD): ").strip())
+                    added = StaffService.roster_working_hours(self.db, staff_id, first_day, last_day)
+                    print(f"{len(added)} shifts added.")
+                else:
+                    return
+            except ValueError as e:
+                self.db.rollback()
+                print(f"Error: {e}")
+
     # Appointment management methods
     def schedule_appointment(self):
         #Schedule a new appointment
         print("\n--- Schedule New Appointment ---")
         
+        patient_id = input("Patient ID: ")
+        appointment_date = input("Appointment Date (YYYY-MM-DD HH:MM): ")
+        staff_id = input("Staff ID (leave blank to suggest one by department): ").strip()
+        if not staff_id:
+            staff_id = self.suggest_staff(appointment_date)
+            if staff_id is None:
+                return
+        
         appointment_data = {
-            'patient_id': input("Patient ID: "),
-            'staff_id': input("Staff ID: "),
-            'appointment_date': input("Appointment Date (YYYY-MM-DD HH:MM): "),
+            'patient_id': patient_id,
+            'staff_id': staff_id,
+            'appointment_date': appointment_date,
+            'duration_minutes': input("Duration in minutes (default: 30): ").strip(),
             'purpose': input("Purpose: "),
-            'status': input("Status (Scheduled/Completed/Cancelled, default: Scheduled): ") or "Scheduled"
+            'status': input(f"Status ({'/'.join(s.label for s in AppointmentStatus)}, default: Scheduled): ") or "Scheduled"
         }
         
         try:
             appointment = AppointmentService.create_appointment(self.db, appointment_data)
             print(f"\nAppointment scheduled successfully! Appointment ID: {appointment.id}")
         except Exception as e:
+            self.db.rollback()
             print(f"\nError: {e}")
 
+    def book_available_slot(self):
+        #Find the earliest free slots in a department and book one of them
+        print("\n--- Find Available Slot ---")
+        patient_id = input("Patient ID: ").strip()
+        try:
+            patient_id = int(patient_id)
+        except ValueError:
+            print("Invalid patient ID. Please enter a number.")
+            return
+        department = input("Department: ").strip()
+        duration = input("Duration in minutes (default: 30): ").strip() or "30"
+        earliest = input("Earliest (YYYY-MM-DD HH:MM, default: now): ").strip()
+        latest = input("Latest (YYYY-MM-DD HH:MM, optional): ").strip()
+        
+        try:
+            # Read from the primary so bookings made moments ago are seen
+            slots = SchedulingService.find_slots(self.db, department, patient_id, duration,
+                                                 validate_datetime(earliest) if earliest else None,
+                                                 validate_datetime(latest) if latest else None)
+        except ValueError as e:
+            print(f"\nError: {e}")
+            return
+        
+        if not slots:
+            print("\nNo free slots in that window.")
+            return
+        
+        table_data = [[i, slot.start.strftime('%a %Y-%m-%d %H:%M'), slot.end.strftime('%H:%M'), slot.staff_name, slot.staff_id]
+                      for i, slot in enumerate(slots, 1)]
+        headers = ["#", "Start", "End", "Staff", "Staff ID"]
+        print("\n" + tabulate(table_data, headers=headers, tablefmt="grid"))
+        
+        choice = input("\nBook slot number (leave blank to cancel): ").strip()
+        if not choice:
+            return
+        try:
+            slot = slots[int(choice) - 1]
+            if int(choice) < 1:
+                raise IndexError
+        except (ValueError, IndexError):
+            print("Invalid choice.")
+            return
+        
+        try:
+            appointment = SchedulingService.book_slot(self.db, patient_id, slot.staff_id, slot.start, duration,
+                                                      input("Purpose: "))
+            print(f"\nAppointment scheduled successfully! Appointment ID: {appointment.id}")
+        except Exception as e:
+            self.db.rollback()
+            print(f"\nError: {e}")
+
+    def suggest_staff(self, appointment_date):
+        #Offer a department's least loaded doctors for the appointment day; returns the chosen staff ID
+        department = input("Department: ").strip()
+        try:
+            day = validate_datetime(appointment_date).date()
+            # Read from the primary: a snapshot could miss bookings made minutes ago
+            suggestions = WorkloadService.suggest_staff(self.db, department, day)
+        except ValueError as e:
+            print(f"\nError: {e}")
+            return None
+        
+        table_data = [[entry['staff_id'], entry['name'], entry['today'], entry['week'], entry['active_patients']]
+                      for entry in suggestions]
+        headers = ["Staff ID", "Name", f"Booked {day}", "This Week", "Active Patients"]
+        print("\nLeast loaded in " + department + ":")
+        print(tabulate(table_data, headers=headers, tablefmt="grid"))
+        return input(f"Staff ID (default: {suggestions[0]['staff_id']}): ").strip() or suggestions[0]['staff_id']
+
     def view_all_appointments(self):
         #View all appointments
-        appointments = AppointmentService.get_all_appointments(self.db)
+        with self.read_db() as db:
+            appointments = AppointmentService.list_appointments(db)
+            patients = self.names(db, PatientService, [appointment.patient_id for appointment in appointments])
+            staff = self.names(db, StaffService, [appointment.staff_id for appointment in appointments])
         
         if not appointments:
             print("\nNo appointments found.")
@@ -475,14 +915,14 @@ class HospitalCLI:
         for appointment in appointments:
             table_data.append([
                 appointment.id,
-                appointment.patient_id,
-                appointment.staff_id,
+                patients.get(appointment.patient_id, appointment.patient_id),
+                staff.get(appointment.staff_id, appointment.staff_id),
                 appointment.appointment_date,
                 appointment.purpose,
-                appointment.status
+                appointment.status.label
             ])
         
-        headers = ["ID", "Patient ID", "Staff ID", "Date", "Purpose", "Status"]
+        headers = ["ID", "Patient", "Staff", "Date", "Purpose", "Status"]
         print("\n" + tabulate(table_data, headers=headers, tablefmt="grid"))
 
     def view_patient_appointments(self):
@@ -495,7 +935,9 @@ class HospitalCLI:
             print("Invalid patient ID. Please enter a number.")
             return
         
-        appointments = AppointmentService.get_patient_appointments(self.db, patient_id)
+        with self.read_db() as db:
+            appointments = AppointmentService.list_appointments(db, patient_id=patient_id)
+            staff = self.names(db, StaffService, [appointment.staff_id for appointment in appointments])
         
         if not appointments:
             print("\nNo appointments found for this patient.")
@@ -506,13 +948,13 @@ class HospitalCLI:
         for appointment in appointments:
             table_data.append([
                 appointment.id,
-                appointment.staff_id,
+                staff.get(appointment.staff_id, appointment.staff_id),
                 appointment.appointment_date,
                 appointment.purpose,
-                appointment.status
+                appointment.status.label
             ])
         
-        headers = ["ID", "Staff ID", "Date", "Purpose", "Status"]
+        headers = ["ID", "Staff", "Date", "Purpose", "Status"]
         print(f"\nAppointments for Patient ID {patient_id}:")
         print(tabulate(table_data, headers=headers, tablefmt="grid"))
 
@@ -526,7 +968,9 @@ class HospitalCLI:
             print("Invalid staff ID. Please enter a number.")
             return
         
-        appointments = AppointmentService.get_staff_appointments(self.db, staff_id)
+        with self.read_db() as db:
+            appointments = AppointmentService.list_appointments(db, staff_id=staff_id)
+            patients = self.names(db, PatientService, [appointment.patient_id for appointment in appointments])
         
         if not appointments:
             print("\nNo appointments found for this staff member.")
@@ -537,13 +981,13 @@ class HospitalCLI:
         for appointment in appointments:
             table_data.append([
                 appointment.id,
-                appointment.patient_id,
+                patients.get(appointment.patient_id, appointment.patient_id),
                 appointment.appointment_date,
                 appointment.purpose,
-                appointment.status
+                appointment.status.label
             ])
         
-        headers = ["ID", "Patient ID", "Date", "Purpose", "Status"]
+        headers = ["ID", "Patient", "Date", "Purpose", "Status"]
         print(f"\nAppointments for Staff ID {staff_id}:")
         print(tabulate(table_data, headers=headers, tablefmt="grid"))
 
@@ -571,7 +1015,7 @@ class HospitalCLI:
             ('staff_id', 'Staff ID'),
             ('appointment_date', 'Appointment Date (YYYY-MM-DD HH:MM)'),
             ('purpose', 'Purpose'),
-            ('status', 'Status (Scheduled/Completed/Cancelled)')
+            ('status', f"Status ({'/'.join(s.label for s in AppointmentStatus)})")
         ]
         
         for field, prompt in fields:
@@ -580,11 +1024,9 @@ class HospitalCLI:
                 update_data[field] = new_value
         
         if update_data:
-            try:
-                updated_appointment = AppointmentService.update_appointment(self.db, appointment_id, update_data)
-                print("Appointment updated successfully!")
-            except Exception as e:
-                print(f"Error: {e}")
+            self.save_with_merge("Appointment", fields, appointment, update_data,
+                                 lambda: AppointmentService.get_appointment(self.db, appointment_id),
+                                 lambda data, version: AppointmentService.update_appointment(self.db, appointment_id, data, version))
         else:
             print("No changes made.")
 
@@ -605,14 +1047,121 @@ class HospitalCLI:
         
         confirm = input(f"Are you sure you want to delete appointment ID {appointment_id}? (y/n): ").strip().lower()
         if confirm == 'y':
-            success = AppointmentService.delete_appointment(self.db, appointment_id)
+            try:
+                success = AppointmentService.delete_appointment(self.db, appointment_id)
+            except ValueError as e:
+                self.db.rollback()
+                print(f"Error: {e}")
+                return
             if success:
-                print("Appointment deleted successfully!")
+                print("Appointment deleted. It can be restored from the Maintenance menu.")
             else:
                 print("Error deleting appointment.")
         else:
             print("Deletion cancelled.")
 
+    def schedule_series(self):
+        #Schedule a recurring series of appointments
+        print("\n--- Schedule Recurring Appointments ---")
+        
+        series_data = {
+            'patient_id': input("Patient ID: "),
+            'staff_id': input("Staff ID: "),
+            'start': input("First Appointment (YYYY-MM-DD HH:MM): "),
+            'purpose': input("Purpose: ")
+        }
+        frequency = input("Repeat (Daily/Weekly/Monthly, default: Weekly): ").strip() or "Weekly"
+        interval = input("Every how many days/weeks/months (default: 1): ").strip() or "1"
+        count = input("Number of appointments: ").strip()
+        
+        if frequency.capitalize() not in ('Daily', 'Weekly', 'Monthly'):
+            print("Repeat must be Daily, Weekly or Monthly.")
+            return
+        try:
+            interval = int(interval)
+            count = int(count)
+        except ValueError:
+            print("Interval and number of appointments must be numbers.")
+            return
+        series_data['rule'] = f"FREQ={frequency.upper()};INTERVAL={interval};COUNT={count}"
+        
+        try:
+            series = AppointmentService.create_series(self.db, series_data)
+            print(f"\nAppointment series scheduled successfully! Series ID: {series.id} ({len(series.appointments)} appointments)")
+        except Exception as e:
+            self.db.rollback()
+            print(f"\nError: {e}")
+
+    def update_series(self):
+        #Update the upcoming appointments of a series
+        series_id = input("\nEnter series ID to update: ").strip()
+        
+        try:
+            series_id = int(series_id)
+        except ValueError:
+            print("Invalid series ID. Please enter a number.")
+            return
+        
+        series = AppointmentService.get_series(self.db, series_id)
+        if not series:
+            print("Appointment series not found.")
+            return
+        
+        print(f"\nUpdating upcoming appointments of series ID: {series.id} ({series.rule})")
+        print("Leave field blank to keep current value.")
+        
+        update_data = {}
+        fields = [
+            ('staff_id', 'Staff ID', series.staff_id),
+            ('time', 'Time of Day (HH:MM)', series.start.strftime('%H:%M')),
+            ('purpose', 'Purpose', series.purpose)
+        ]
+        
+        for field, prompt, current in fields:
+            new_value = input(f"{prompt} [{current}]: ").strip()
+            if new_value:
+                update_data[field] = new_value
+        
+        if update_data:
+            try:
+                AppointmentService.update_series(self.db, series_id, update_data)
+                print("Appointment series updated successfully!")
+            except Exception as e:
+                self.db.rollback()
+                print(f"Error: {e}")
+        else:
+            print("No changes made.")
+
+    def cancel_series(self):
+        #Cancel the upcoming appointments of a series
+        series_id = input("\nEnter series ID to cancel: ").strip()
+        
+        try:
+            series_id = int(series_id)
+        except ValueError:
+            print("Invalid series ID. Please enter a number.")
+            return
+        
+        series = AppointmentService.get_series(self.db, series_id)
+        if not series:
+            print("Appointment series not found.")
+            return
+        
+        confirm = input(f"Are you sure you want to cancel all upcoming appointments of series ID {series_id}? (y/n): ").strip().lower()
+        if confirm == 'y':
+            from app.validators import ConflictError
+            try:
+                cancelled = AppointmentService.cancel_series(self.db, series_id)
+                print(f"{cancelled} appointments cancelled successfully!")
+            except ConflictError:
+                self.db.rollback()
+                print("Appointments of this series were changed by someone else meanwhile; nothing was cancelled. Please try again.")
+            except ValueError as e:
+                self.db.rollback()
+                print(f"Error: {e}")
+        else:
+            print("Cancellation aborted.")
+
     # Medical record management methods
     def create_medical_record(self):
         #Create a new medical record
@@ -633,11 +1182,15 @@ class HospitalCLI:
             record = MedicalRecordService.create_medical_record(self.db, record_data)
             print(f"\nMedical record created successfully! Record ID: {record.id}")
         except Exception as e:
+            self.db.rollback()
             print(f"\nError: {e}")
 
     def view_all_medical_records(self):
         #View all medical records
-        records = MedicalRecordService.get_all_medical_records(self.db)
+        with self.read_db() as db:
+            records = MedicalRecordService.list_medical_records(db)
+            patients = self.names(db, PatientService, [record.patient_id for record in records])
+            staff = self.names(db, StaffService, [record.staff_id for record in records])
         
         if not records:
             print("\nNo medical records found.")
@@ -648,15 +1201,15 @@ class HospitalCLI:
         for record in records:
             table_data.append([
                 record.id,
-                record.patient_id,
-                record.staff_id,
+                patients.get(record.patient_id, record.patient_id),
+                staff.get(record.staff_id, record.staff_id),
                 record.diagnosis,
                 record.admission_date,
                 record.discharge_date,
                 record.duration_of_stay
             ])
         
-        headers = ["ID", "Patient ID", "Staff ID", "Diagnosis", "Admission", "Discharge", "Days"]
+        headers = ["ID", "Patient", "Staff", "Diagnosis", "Admission", "Discharge", "Days"]
         print("\n" + tabulate(table_data, headers=headers, tablefmt="grid"))
 
     def view_patient_medical_records(self):
@@ -669,7 +1222,9 @@ class HospitalCLI:
             print("Invalid patient ID. Please enter a number.")
             return
         
-        records = MedicalRecordService.get_patient_medical_records(self.db, patient_id)
+        with self.read_db() as db:
+            records = MedicalRecordService.list_medical_records(db, patient_id)
+            staff = self.names(db, StaffService, [record.staff_id for record in records])
         
         if not records:
             print("\nNo medical records found for this patient.")
@@ -680,14 +1235,14 @@ class HospitalCLI:
         for record in records:
             table_data.append([
                 record.id,
-                record.staff_id,
+                staff.get(record.staff_id, record.staff_id),
                 record.diagnosis,
                 record.admission_date,
                 record.discharge_date,
                 record.duration_of_stay
             ])
         
-        headers = ["ID", "Staff ID", "Diagnosis", "Admission", "Discharge", "Days"]
+        headers = ["ID", "Staff", "Diagnosis", "Admission", "Discharge", "Days"]
         print(f"\nMedical Records for Patient ID {patient_id}:")
         print(tabulate(table_data, headers=headers, tablefmt="grid"))
 
@@ -725,11 +1280,9 @@ class HospitalCLI:
                 update_data[field] = new_value
         
         if update_data:
-            try:
-                updated_record = MedicalRecordService.update_medical_record(self.db, record_id, update_data)
-                print("Medical record updated successfully!")
-            except Exception as e:
-                print(f"Error: {e}")
+            self.save_with_merge("Medical record", fields, record, update_data,
+                                 lambda: MedicalRecordService.get_medical_record(self.db, record_id),
+                                 lambda data, version: MedicalRecordService.update_medical_record(self.db, record_id, data, version))
         else:
             print("No changes made.")
 
@@ -750,14 +1303,79 @@ class HospitalCLI:
         
         confirm = input(f"Are you sure you want to delete medical record ID {record_id}? (y/n): ").strip().lower()
         if confirm == 'y':
-            success = MedicalRecordService.delete_medical_record(self.db, record_id)
+            try:
+                success = MedicalRecordService.delete_medical_record(self.db, record_id)
+            except ValueError as e:
+                self.db.rollback()
+                print(f"Error: {e}")
+                return
             if success:
-                print("Medical record deleted successfully!")
+                print("Medical record deleted. It can be restored from the Maintenance menu.")
             else:
                 print("Error deleting medical record.")
         else:
             print("Deletion cancelled.")
 
+    def find_patients_on_drug(self):
+        #List patients with a prescription for a given drug
+        drug = input("\nEnter medication name: ").strip()
+        if not drug:
+            print("Medication name is required.")
+            return
+        
+        active_only = input("Only currently active prescriptions? (y/n): ").strip().lower() == 'y'
+        with self.read_db() as db:
+            patients = MedicalRecordService.get_patients_on_drug(db, drug, datetime.now().date() if active_only else None)
+        
+        if not patients:
+            print("\nNo patients found.")
+            return
+        
+        table_data = []
+        for patient in patients:
+            table_data.append([
+                patient.id,
+                f"{patient.first_name} {patient.last_name}",
+                patient.date_of_birth,
+                patient.contact_number
+            ])
+        
+        headers = ["ID", "Name", "Date of Birth", "Contact"]
+        print(f"\nPatients on {drug}:")
+        print(tabulate(table_data, headers=headers, tablefmt="grid"))
+
+    def view_active_medications(self):
+        #View a patient's currently active prescriptions
+        patient_id = input("\nEnter patient ID: ").strip()
+        
+        try:
+            patient_id = int(patient_id)
+        except ValueError:
+            print("Invalid patient ID. Please enter a number.")
+            return
+        
+        with self.read_db() as db:
+            prescriptions = MedicalRecordService.get_active_prescriptions(db, patient_id)
+        
+        if not prescriptions:
+            print("\nNo active medications found for this patient.")
+            return
+        
+        table_data = []
+        for prescription in prescriptions:
+            table_data.append([
+                prescription.drug,
+                prescription.dose,
+                prescription.frequency,
+                prescription.start_date,
+                prescription.end_date,
+                prescription.record_id
+            ])
+        
+        headers = ["Drug", "Dose", "Frequency", "Start", "End", "Record ID"]
+        print(f"\nActive Medications for Patient ID {patient_id}:")
+        print(tabulate(table_data, headers=headers, tablefmt="grid"))
+
     # Billing management methods
     def create_bill(self):
         #Create a new bill
@@ -768,18 +1386,21 @@ class HospitalCLI:
             'amount': input("Amount: "),
             'due_date': input("Due Date (YYYY-MM-DD, optional): "),
             'description': input("Description: "),
-            'status': input("Status (Paid/Unpaid, default: Unpaid): ") or "Unpaid"
+            'status': input(f"Status ({'/'.join(s.label for s in BillStatus)}, default: Unpaid): ") or "Unpaid"
         }
         
         try:
             bill = BillingService.create_bill(self.db, bill_data)
             print(f"\nBill created successfully! Bill ID: {bill.id}")
         except Exception as e:
+            self.db.rollback()
             print(f"\nError: {e}")
 
     def view_all_bills(self):
         #View all bills
-        bills = BillingService.get_all_bills(self.db)
+        with self.read_db() as db:
+            bills = BillingService.list_bills(db)
+            patients = self.names(db, PatientService, [bill.patient_id for bill in bills])
         
         if not bills:
             print("\nNo bills found.")
@@ -790,15 +1411,15 @@ class HospitalCLI:
         for bill in bills:
             table_data.append([
                 bill.id,
-                bill.patient_id,
+                patients.get(bill.patient_id, bill.patient_id),
                 bill.amount,
                 bill.date_issued,
                 bill.due_date,
-                bill.status
+                bill.status.label
             ])
         
-        headers = ["ID", "Patient ID", "Amount", "Issued", "Due", "Status"]
-        print("\n" + tabulate(table_data, headers=headers, tablefmt="grid"))
+        headers = ["ID", "Patient", "Amount", "Issued", "Due", "Status"]
+        print("\n" + tabulate(table_data, headers=headers, tablefmt="grid", floatfmt=",.2f"))
 
     def view_patient_bills(self):
         #View bills for a specific patient
@@ -810,7 +1431,8 @@ class HospitalCLI:
             print("Invalid patient ID. Please enter a number.")
             return
         
-        bills = BillingService.get_patient_bills(self.db, patient_id)
+        with self.read_db() as db:
+            bills = BillingService.list_bills(db, patient_id)
         
         if not bills:
             print("\nNo bills found for this patient.")
@@ -824,16 +1446,20 @@ class HospitalCLI:
                 bill.amount,
                 bill.date_issued,
                 bill.due_date,
-                bill.status
+                bill.status.label
             ])
         
         headers = ["ID", "Amount", "Issued", "Due", "Status"]
         print(f"\nBills for Patient ID {patient_id}:")
-        print(tabulate(table_data, headers=headers, tablefmt="grid"))
+        print(tabulate(table_data, headers=headers, tablefmt="grid", floatfmt=",.2f"))
 
     def view_unpaid_bills(self):
-        #View all unpaid bills
-        bills = BillingService.get_unpaid_bills(self.db)
+        #View all unpaid bills, overdue ones included
+        from app.models import OUTSTANDING_BILL_STATUSES
+        
+        with self.read_db() as db:
+            bills = BillingService.list_bills(db, statuses=OUTSTANDING_BILL_STATUSES)
+            patients = self.names(db, PatientService, [bill.patient_id for bill in bills])
         
         if not bills:
             print("\nNo unpaid bills found.")
@@ -844,15 +1470,16 @@ class HospitalCLI:
         for bill in bills:
             table_data.append([
                 bill.id,
-                bill.patient_id,
+                patients.get(bill.patient_id, bill.patient_id),
                 bill.amount,
                 bill.date_issued,
-                bill.due_date
+                bill.due_date,
+                bill.status.label
             ])
         
-        headers = ["ID", "Patient ID", "Amount", "Issued", "Due"]
+        headers = ["ID", "Patient", "Amount", "Issued", "Due", "Status"]
         print("\nUnpaid Bills:")
-        print(tabulate(table_data, headers=headers, tablefmt="grid"))
+        print(tabulate(table_data, headers=headers, tablefmt="grid", floatfmt=",.2f"))
 
     def mark_bill_paid(self):
         #Mark a bill as paid
@@ -864,7 +1491,11 @@ class HospitalCLI:
             print("Invalid bill ID. Please enter a number.")
             return
         
-        bill = BillingService.mark_as_paid(self.db, bill_id)
+        try:
+            bill = BillingService.mark_as_paid(self.db, bill_id)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
         if bill:
             print(f"Bill ID {bill_id} marked as paid successfully!")
         else:
@@ -893,7 +1524,7 @@ class HospitalCLI:
             ('amount', 'Amount'),
             ('due_date', 'Due Date (YYYY-MM-DD)'),
             ('description', 'Description'),
-            ('status', 'Status (Paid/Unpaid)')
+            ('status', f"Status ({'/'.join(s.label for s in BillStatus)})")
         ]
         
         for field, prompt in fields:
@@ -902,11 +1533,9 @@ class HospitalCLI:
                 update_data[field] = new_value
         
         if update_data:
-            try:
-                updated_bill = BillingService.update_bill(self.db, bill_id, update_data)
-                print("Bill updated successfully!")
-            except Exception as e:
-                print(f"Error: {e}")
+            self.save_with_merge("Bill", fields, bill, update_data,
+                                 lambda: BillingService.get_bill(self.db, bill_id),
+                                 lambda data, version: BillingService.update_bill(self.db, bill_id, data, version))
         else:
             print("No changes made.")
 
@@ -927,14 +1556,605 @@ class HospitalCLI:
         
         confirm = input(f"Are you sure you want to delete bill ID {bill_id}? (y/n): ").strip().lower()
         if confirm == 'y':
-            success = BillingService.delete_bill(self.db, bill_id)
+            try:
+                success = BillingService.delete_bill(self.db, bill_id)
+            except ValueError as e:
+                self.db.rollback()
+                print(f"Error: {e}")
+                return
             if success:
-                print("Bill deleted successfully!")
+                print("Bill deleted. It can be restored from the Maintenance menu.")
             else:
                 print("Error deleting bill.")
         else:
             print("Deletion cancelled.")
 
+    def revenue_report(self):
+        #Show billed amounts per month and status
+        try:
+            start = input("\nStart Date (YYYY-MM-DD, optional): ").strip()
+            end = input("End Date (YYYY-MM-DD, optional): ").strip()
+            start_date = validate_date(start) if start else None
+            end_date = validate_date(end) if end else None
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
+        
+        with self.read_db() as db:
+            summary = BillingService.get_revenue_summary(db, start_date, end_date)
+            outstanding = BillingService.get_total_outstanding(db)
+        
+        if not summary:
+            print("\nNo bills found.")
+            return
+        
+        table_data = [[month, status.label, count, total] for month, status, count, total in summary]
+        headers = ["Month", "Status", "Bills", "Amount"]
+        print("\n" + tabulate(table_data, headers=headers, tablefmt="grid", floatfmt=",.2f"))
+        print(f"Total outstanding: {outstanding:,.2f}")
+
+    def generate_statements(self):
+        #Write statements for every patient with unpaid or overdue bills
+        from app.statements import generate_statements, FORMATS
+        from app.database import read_engine
+        
+        fmt = input(f"\nFormat ({'/'.join(FORMATS)}, default: markdown): ").strip().lower() or 'markdown'
+        try:
+            as_of = input("Statement date (YYYY-MM-DD, default: today): ").strip()
+            as_of = validate_date(as_of) if as_of else None
+            workers = input(f"Worker processes (default: {os.cpu_count()}): ").strip()
+            workers = int(validate_positive_number(workers, "Workers")) if workers else None
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
+        
+        self.ensure_schema()
+        try:
+            summary = generate_statements(read_engine('replica'), fmt=fmt, workers=workers, as_of=as_of,
+                                          progress=lambda count: print(f"\r{count} statements written", end='', flush=True))
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
+        
+        print(f"\n\n{summary['statements']} statements covering {summary['bills']} bills written to {summary['directory']}")
+        print(f"Total outstanding: {Decimal(summary['balance']):,.2f} (overdue: {Decimal(summary['overdue']):,.2f})")
+        print(f"Manifest: {os.path.join(summary['directory'], 'manifest.csv')}")
+
+    # Dashboard methods
+    def view_dashboard(self):
+        #Show today's summary from the statistics counters
+        dashboard = StatsService.get_dashboard(self.db)
+        
+        print(f"\n--- Dashboard for {dashboard['day']} ---")
+        print(f"Registered patients: {dashboard['total_patients']}")
+        print(f"Staff members: {dashboard['total_staff']}")
+        
+        appointments = dashboard['appointments_today']
+        print(f"\nAppointments today: {sum(appointments.values())}")
+        if appointments:
+            print(tabulate(sorted(appointments.items()), headers=["Status", "Count"], tablefmt="grid"))
+        
+        admissions = dashboard['active_admissions']
+        print(f"\nActive admissions: {sum(admissions.values())}")
+        if admissions:
+            print(tabulate(sorted(admissions.items()), headers=["Department", "Count"], tablefmt="grid"))
+        
+        bills = dashboard['bills']
+        if bills:
+            table_data = [[status, count, total] for status, (count, total) in sorted(bills.items())]
+            print("\nBills:")
+            print(tabulate(table_data, headers=["Status", "Count", "Total"], tablefmt="grid", floatfmt=",.2f"))
+        else:
+            print("\nNo bills found.")
+
+    def on_call_board(self):
+        #Who is on duty and on call in each department right now, refreshed on Enter
+        while True:
+            now = datetime.now()
+            with self.read_db() as db:
+                board = StaffService.on_call_board(db, now)
+            
+            print(f"\n--- On-Call Board, {now:%Y-%m-%d %H:%M} ---")
+            if not board:
+                print("Nobody is rostered today.")
+            for entry in board:
+                coverage = entry['coverage']
+                print(f"\n{entry['department']}: {len(entry['on_duty'])} on duty, {len(entry['on_call'])} on call"
+                      + (f" (today: {coverage['staff']} rostered, {coverage['covered_minutes'] / 60:.1f}h covered,"
+                         f" at least {coverage['lowest']} on at any time)" if coverage else ""))
+                rows = entry['on_duty'] + entry['on_call']
+                if rows:
+                    table_data = [[row.staff_id, f"{row.first_name} {row.last_name}", row.role, row.kind.label,
+                                   f"{row.ends_at:%a %H:%M}"] for row in rows]
+                    print(tabulate(table_data, headers=["Staff ID", "Name", "Role", "Kind", "Until"], tablefmt="grid"))
+            
+            if input("\nPress Enter to refresh or q to return: ").strip().lower() == 'q':
+                return
+
+    def rebuild_statistics(self):
+        #Recompute all dashboard counters and department coverage from scratch
+        try:
+            count = StatsService.rebuild(self.db)
+            coverage = CoverageService.rebuild(self.db)
+            print(f"\nStatistics rebuilt successfully! {count} counters and {coverage} coverage rows recomputed.")
+        except Exception as e:
+            self.db.rollback()
+            print(f"\nError: {e}")
+
+    # Report methods
+    def census_report(self):
+        #Show the daily inpatient census for a date range
+        try:
+            start_date = validate_date(input("\nStart Date (YYYY-MM-DD): ").strip())
+            end_date = validate_date(input("End Date (YYYY-MM-DD): ").strip())
+            capacity = input("Bed capacity (optional): ").strip()
+            bed_capacity = int(validate_positive_number(capacity, "Bed capacity")) if capacity else None
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
+        
+        with self.read_db('snapshot') as db:
+            census = AnalyticsService.daily_census(db, start_date, end_date, bed_capacity)
+        table_data = [[row['day'], row['census'], row['occupancy']] for row in census]
+        headers = ["Day", "Inpatients", "Occupancy %"]
+        print("\n" + tabulate(table_data, headers=headers, tablefmt="grid"))
+
+    def length_of_stay_by_diagnosis(self):
+        #Show length of stay statistics grouped by diagnosis
+        with self.read_db('snapshot') as db:
+            stats = AnalyticsService.length_of_stay(db, group_by='diagnosis')
+        
+        if not stats:
+            print("\nNo discharged admissions found.")
+            return
+        
+        table_data = [[row['key'], row['records'], row['average'], row['p50'], row['p90']] for row in stats]
+        headers = ["Diagnosis", "Stays", "Average Days", "Median Days", "90th Percentile"]
+        print("\n" + tabulate(table_data, headers=headers, tablefmt="grid"))
+
+    def length_of_stay_by_staff(self):
+        #Show length of stay statistics grouped by attending staff
+        with self.read_db('snapshot') as db:
+            stats = AnalyticsService.length_of_stay(db, group_by='staff')
+        
+        if not stats:
+            print("\nNo discharged admissions found.")
+            return
+        
+        table_data = [[row['key'], row['name'], row['records'], row['average'], row['p50'], row['p90']] for row in stats]
+        headers = ["Staff ID", "Name", "Stays", "Average Days", "Median Days", "90th Percentile"]
+        print("\n" + tabulate(table_data, headers=headers, tablefmt="grid"))
+
+    def readmission_report(self):
+        #Show the readmission rate within a number of days
+        days = input("\nReadmission window in days (default: 30): ").strip() or "30"
+        
+        try:
+            days = int(days)
+        except ValueError:
+            print("Invalid number of days. Please enter a number.")
+            return
+        
+        with self.read_db('snapshot') as db:
+            result = AnalyticsService.readmission_rate(db, days)
+        print(f"\nDischarges: {result['discharges']}")
+        print(f"Readmitted within {days} days: {result['readmissions']}")
+        print(f"Readmission rate: {result['rate']}%")
+
+    def staff_workload_report(self):
+        #Show appointments, no-show and cancellation rates and active patients per staff member
+        department = input("\nDepartment (optional): ").strip()
+        day = input("Day (YYYY-MM-DD, default: today): ").strip()
+        
+        try:
+            day = validate_date(day) if day else None
+            with self.read_db() as db:
+                workload = WorkloadService.staff_workload(db, day, department or None)
+        except ValueError as e:
+            print(f"\nError: {e}")
+            return
+        
+        if not workload:
+            print("\nNo staff found.")
+            return
+        
+        table_data = [[entry['staff_id'], entry['name'], entry['department'], entry['today'], entry['week'],
+                       entry['per_day'], entry['no_show_rate'], entry['cancellation_rate'], entry['active_patients']]
+                      for entry in workload]
+        headers = ["Staff ID", "Name", "Department", "Today", "This Week", "Per Day", "No-show %",
+                   "Cancelled %", "Active Patients"]
+        print("\n" + tabulate(table_data, headers=headers, tablefmt="grid"))
+
+    def department_coverage_report(self):
+        #Show a department's shift coverage day by day
+        department = input("\nDepartment: ").strip()
+        role = input("Role (optional, default: all): ").strip()
+        
+        try:
+            start_date = validate_date(input("Start Date (YYYY-MM-DD): ").strip())
+            end_date = validate_date(input("End Date (YYYY-MM-DD): ").strip())
+            with self.read_db() as db:
+                coverage = StaffService.department_coverage(db, department, start_date, end_date, role or None)
+        except ValueError as e:
+            print(f"\nError: {e}")
+            return
+        
+        table_data = [[day['day'], day['staff'], day['on_call'], f"{day['covered_minutes'] / 60:.1f}",
+                       f"{day['staff_minutes'] / 60:.1f}", day['peak'], day['lowest']] for day in coverage]
+        headers = ["Day", "Rostered", "On Call", "Hours Covered", "Staff Hours", "Most On", "Fewest On"]
+        print("\n" + tabulate(table_data, headers=headers, tablefmt="grid"))
+        gaps = [day['day'] for day in coverage if day['covered_minutes'] < 24 * 60]
+        if gaps:
+            print(f"{len(gaps)} of {len(coverage)} days are not covered around the clock.")
+
+    def run_background_report(self):
+        #Launch a sharded report in a separate process pool and return to the menu
+        from app.report_runner import REPORTS, start_background_report
+        
+        names = list(REPORTS)
+        print("\nAvailable reports:")
+        for i, name in enumerate(names, 1):
+            print(f"{i}. {REPORTS[name].title}")
+        
+        try:
+            choice = int(input("Select report: ").strip())
+            if not 1 <= choice <= len(names):
+                raise ValueError
+        except ValueError:
+            print("Invalid choice.")
+            return
+        
+        try:
+            workers = input(f"Worker processes (default: {os.cpu_count()}): ").strip()
+            workers = int(validate_positive_number(workers, "Workers")) if workers else None
+            start = input("Start Date (YYYY-MM-DD, optional): ").strip()
+            end = input("End Date (YYYY-MM-DD, optional): ").strip()
+            start_date = validate_date(start) if start else None
+            end_date = validate_date(end) if end else None
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
+        
+        process, output, log_path = start_background_report(names[choice - 1], workers, start_date, end_date)
+        print(f"\nReport started in the background (process {process.pid}).")
+        print(f"Results will be written to {output}; progress and errors to {log_path}")
+
+    def view_generated_reports(self):
+        #List report files written by background runs
+        from app.report_runner import reports_directory
+        directory = reports_directory()
+        
+        if not os.path.isdir(directory):
+            print("\nNo reports generated yet.")
+            return
+        
+        table_data = []
+        for log_name in sorted(os.listdir(directory), reverse=True):
+            if not log_name.endswith('.log'):
+                continue
+            log_path = os.path.join(directory, log_name)
+            output = log_path[:-len('.log')] + '.csv'
+            with open(log_path) as f:
+                log = f.read()
+            if os.path.exists(output):
+                status = "Ready"
+            elif 'Traceback' in log or 'error' in log:
+                status = "Failed"
+            else:
+                status = "Running"
+            started = datetime.fromtimestamp(os.path.getctime(log_path)).strftime('%Y-%m-%d %H:%M')
+            table_data.append([output if status == "Ready" else log_path, status, started])
+        
+        if not table_data:
+            print("\nNo reports generated yet.")
+            return
+        
+        headers = ["File", "Status", "Started"]
+        print("\n" + tabulate(table_data, headers=headers, tablefmt="grid"))
+
+    # Maintenance methods
+    def create_backup(self):
+        #Take an online backup of the database
+        from app.backup import create_backup
+        
+        compress = input("\nCompress the backup? (y/n, default: y): ").strip().lower() != 'n'
+        self.ensure_schema()
+        
+        try:
+            manifest = create_backup(compress=compress)
+            print(f"\nBackup {manifest['file']} created ({manifest['size']:,} bytes in {manifest['seconds']}s).")
+            print(f"SHA-256: {manifest['sha256']}")
+        except Exception as e:
+            print(f"Error creating backup: {e}")
+
+    def list_backups(self):
+        #List available backups, newest first
+        from app.backup import list_backups
+        
+        backups = list_backups()
+        if not backups:
+            print("\nNo backups found.")
+            return
+        
+        table_data = []
+        for manifest in backups:
+            table_data.append([
+                manifest['name'],
+                manifest['created_at'].replace('T', ' '),
+                f"{manifest['size']:,}",
+                "Yes" if manifest['compressed'] else "No",
+                manifest['label'] or ""
+            ])
+        
+        headers = ["Name", "Created", "Size (bytes)", "Compressed", "Label"]
+        print("\n" + tabulate(table_data, headers=headers, tablefmt="grid"))
+
+    def choose_backup(self):
+        #Ask for a backup name or a point in time; returns its manifest or None
+        from app.backup import find_backup
+        
+        answer = input("\nBackup name, or a date/time to use the newest backup before it (YYYY-MM-DD HH:MM, blank for latest): ").strip()
+        try:
+            before = datetime.fromisoformat(answer) if answer and answer[0].isdigit() else None
+        except ValueError:
+            print("Invalid date/time. Please use YYYY-MM-DD HH:MM.")
+            return None
+        
+        manifest = find_backup(None if before else answer or None, before)
+        if not manifest:
+            print("No matching backup found.")
+        return manifest
+
+    def verify_backup(self):
+        #Check a backup's checksum and integrity
+        from app.backup import verify_backup
+        
+        manifest = self.choose_backup()
+        if not manifest:
+            return
+        
+        try:
+            verify_backup(manifest)
+            print(f"\nBackup {manifest['name']}: checksum and integrity check passed.")
+        except ValueError as e:
+            print(f"\nError: {e}")
+
+    def restore_backup(self):
+        #Restore the database from a verified backup
+        from app.backup import restore_backup
+        from app.database import init_db
+        
+        manifest = self.choose_backup()
+        if not manifest:
+            return
+        
+        confirm = input(f"Replace all current data with backup {manifest['name']} from {manifest['created_at']}? (y/n): ").strip().lower()
+        if confirm != 'y':
+            return
+        
+        try:
+            self.db.rollback()
+            safety = restore_backup(manifest)
+            # The restored file may predate the latest migrations
+            init_db()
+            self.db.expire_all()
+            print(f"\nDatabase restored from {manifest['name']}.")
+            if safety:
+                print(f"The previous data was saved as backup {safety['name']}.")
+        except Exception as e:
+            print(f"Error restoring backup: {e}")
+
+    def run_scheduled_jobs(self):
+        #Run the overdue, reminder and delivery jobs once, as the scheduler would
+        from app.scheduler import mark_overdue, queue_reminders, deliver, LocalDelivery, DELIVERY_LOG
+        
+        self.ensure_schema()
+        try:
+            overdue = mark_overdue()
+            reminders = queue_reminders()
+            delivered = deliver(LocalDelivery())
+        except Exception as e:
+            print(f"Error running scheduled jobs: {e}")
+            return
+        
+        print(f"\nBills marked overdue: {overdue}")
+        print(f"Appointment reminders queued: {reminders}")
+        print(f"Messages delivered to {DELIVERY_LOG}: {delivered}")
+        # Bills changed in another session
+        self.db.expire_all()
+
+    def view_outbox(self):
+        #Show recent outbox messages
+        status = input("\nStatus (Pending/Sent/Failed, blank for all): ").strip()
+        
+        try:
+            with self.read_db() as db:
+                messages = NotificationService.get_messages(db, status or None)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
+        
+        if not messages:
+            print("\nNo messages found.")
+            return
+        
+        table_data = []
+        for message in messages:
+            table_data.append([
+                message.id,
+                message.kind,
+                message.recipient,
+                message.subject,
+                message.status.label,
+                message.attempts,
+                message.created_at.strftime('%Y-%m-%d %H:%M') if message.created_at else ""
+            ])
+        
+        headers = ["ID", "Kind", "Recipient", "Subject", "Status", "Attempts", "Created"]
+        print("\n" + tabulate(table_data, headers=headers, tablefmt="grid"))
+
+    @cached_property
+    def deleted_kinds(self):
+        #Soft-deleted record types: (label, model, restore function, description of a row)
+        from app.models import Patient, Staff, Appointment, MedicalRecord, Bill
+        return {
+            '1': ('Patients', Patient, PatientService.restore_patient,
+                  lambda p: f"{p.first_name} {p.last_name}"),
+            '2': ('Staff', Staff, StaffService.restore_staff,
+                  lambda s: f"{s.first_name} {s.last_name} ({s.role})"),
+            '3': ('Appointments', Appointment, AppointmentService.restore_appointment,
+                  lambda a: f"Patient {a.patient_id}, {a.appointment_date.strftime('%Y-%m-%d %H:%M')}"),
+            '4': ('Medical Records', MedicalRecord, MedicalRecordService.restore_medical_record,
+                  lambda r: f"Patient {r.patient_id}, {r.diagnosis}"),
+            '5': ('Bills', Bill, BillingService.restore_bill,
+                  lambda b: f"Patient {b.patient_id}, {b.amount:,.2f}")
+        }
+
+    def choose_deleted_kind(self):
+        #Ask which type of deleted record to work with
+        print()
+        for key, (label, *_) in self.deleted_kinds.items():
+            print(f"{key}. {label}")
+        choice = input("Record type: ").strip()
+        if choice not in self.deleted_kinds:
+            print("Invalid choice.")
+            return None
+        return self.deleted_kinds[choice]
+
+    def view_deleted_records(self):
+        #List recently deleted records of one type
+        from app.services.trash_service import PURGE_AFTER
+        
+        kind = self.choose_deleted_kind()
+        if not kind:
+            return
+        label, model, _, describe = kind
+        
+        with self.read_db() as db:
+            rows = TrashService.get_deleted(db, model)
+            table_data = [[row.id, describe(row), row.deleted_at.strftime('%Y-%m-%d %H:%M'),
+                           (row.deleted_at + PURGE_AFTER).strftime('%Y-%m-%d')] for row in rows]
+        
+        if not table_data:
+            print(f"\nNo deleted {label.lower()}.")
+            return
+        
+        headers = ["ID", "Record", "Deleted (UTC)", "Purged After"]
+        print(f"\nDeleted {label}:")
+        print(tabulate(table_data, headers=headers, tablefmt="grid"))
+
+    def restore_deleted_record(self):
+        #Bring back a deleted record
+        kind = self.choose_deleted_kind()
+        if not kind:
+            return
+        label, _, restore, describe = kind
+        
+        try:
+            record_id = int(input("ID to restore: ").strip())
+        except ValueError:
+            print("Invalid ID. Please enter a number.")
+            return
+        
+        try:
+            row = restore(self.db, record_id)
+        except ValueError as e:
+            self.db.rollback()
+            print(f"Error: {e}")
+            return
+        if row:
+            print(f"Restored: {describe(row)}")
+        else:
+            print(f"No deleted record with ID {record_id} in {label}.")
+
+    def purge_deleted_records(self):
+        #Permanently remove records deleted more than PURGE_AFTER ago
+        from app.services.trash_service import PURGE_AFTER
+        
+        confirm = input(f"\nPermanently remove records deleted more than {PURGE_AFTER.days} days ago? (y/n): ").strip().lower()
+        if confirm != 'y':
+            print("Purge cancelled.")
+            return
+        
+        try:
+            purged = TrashService.purge(self.db)
+        except Exception as e:
+            self.db.rollback()
+            print(f"Error purging records: {e}")
+            return
+        
+        table_data = [[table, count] for table, count in purged.items()]
+        print("\n" + tabulate(table_data, headers=["Table", "Rows Removed"], tablefmt="grid"))
+
+    def view_audit_trail(self):
+        #Show who read or changed this facility's records, filtered by patient, actor and time range
+        from app.audit import query_events, format_changes
+        from app.facilities import current_facility
+        
+        print("\nLeave a filter blank to skip it.")
+        patient_id = input("Patient ID: ").strip()
+        actor = input("Actor (user name): ").strip()
+        since = input("From (YYYY-MM-DD, UTC): ").strip()
+        until = input("To (YYYY-MM-DD, UTC, inclusive): ").strip()
+        action = input("Action (read/create/update/delete/restore/purge): ").strip().lower()
+        
+        try:
+            rows = query_events(
+                patient_id=int(patient_id) if patient_id else None,
+                actor=actor or None,
+                start=validate_date(since) if since else None,
+                end=validate_date(until) + timedelta(days=1) if until else None,
+                action=action or None,
+                facility=current_facility()
+            )
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
+        
+        if not rows:
+            print("\nNo audit events found.")
+            return
+        
+        table_data = [[row.at.strftime('%Y-%m-%d %H:%M:%S'), row.actor, row.action, row.entity, row.entity_id,
+                       row.patient_id, format_changes(row.changes)] for row in rows]
+        headers = ["At (UTC)", "Actor", "Action", "Entity", "ID", "Patient", "Changes"]
+        print("\n" + tabulate(table_data, headers=headers, tablefmt="grid"))
+
+    def switch_facility(self):
+        #Work on another facility's database, or add a new facility
+        from app.database import add_facility, facilities
+        from app.facilities import current_facility, set_facility
+        
+        current = current_facility()
+        codes = facilities()
+        if current not in codes:
+            codes.append(current)
+        table_data = [[i, code, "Current" if code == current else ""] for i, code in enumerate(codes, 1)]
+        print("\n" + tabulate(table_data, headers=["#", "Facility", ""], tablefmt="grid"))
+        
+        choice = input("\nFacility number, or a new facility code to add it: ").strip()
+        if not choice:
+            return
+        try:
+            if choice.isdigit():
+                if not 1 <= int(choice) <= len(codes):
+                    print("Invalid choice.")
+                    return
+                code = codes[int(choice) - 1]
+            else:
+                code = add_facility(choice)
+                print(f"\nFacility '{code}' created.")
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
+        
+        # The open session belongs to the old facility's database
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+        set_facility(code)
+        print(f"Now working on facility '{code}'.")
+
     def exit_program(self):
         #Exit the program
         print("\nThank you for using Hospital Management System. Goodbye!")
@@ -0,0 +1,268 @@
+import argparse
+import sys
+import os
+import time
+from datetime import datetime, date
+
+# Add the parent directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select, func, insert, exists, update, delete, bindparam, type_coerce, Text
+from app.encryption import PREFIX, blind_index, decrypt, is_current, keyring
+from app.models import (DataMigrationState, MedicalRecord, OutboxMessage, Prescription, Patient, PatientSearchKey,
+                        EncryptedString, blind_indexed)
+
+# Data migrations are backfills that run outside Alembic's single schema
+# transaction: rows are processed in id order, one short transaction per
+# batch, and the last processed id is saved with each batch so an interrupted
+# run resumes where it stopped. Between batches the runner sleeps briefly so
+# CLI writers waiting on the SQLite lock get their turn.
+
+DATA_MIGRATIONS = {}
+
+class DataMigration:
+    def __init__(self, name, model, apply_batch, description=''):
+        self.name = name
+        self.model = model
+        self.apply_batch = apply_batch
+        self.description = description
+
+def data_migration(name, model, description=''):
+    #Register apply_batch(connection, first_id, last_id) as a named data migration
+    def register(apply_batch):
+        DATA_MIGRATIONS[name] = DataMigration(name, model, apply_batch, description)
+        return apply_batch
+    return register
+
+def get_state(connection, name):
+    state = DataMigrationState.__table__
+    return connection.execute(select(state).where(state.c.name == name)).first()
+
+def run_data_migration(engine, name, batch_size=500, pause=0.05, progress=print):
+    #Run (or resume) a data migration; returns the number of rows processed in this run
+    migration = DATA_MIGRATIONS[name]
+    state = DataMigrationState.__table__
+    ids = migration.model.__table__.c.id
+
+    with engine.begin() as connection:
+        row = get_state(connection, name)
+        if row is None:
+            connection.execute(insert(state).values(name=name, last_id=0, processed=0, started_at=datetime.utcnow()))
+            row = get_state(connection, name)
+        if row.completed_at:
+            progress(f"{name}: already completed")
+            return 0
+        last_id = row.last_id
+        remaining = connection.execute(
+            select(func.count()).select_from(migration.model.__table__).where(ids > last_id)
+        ).scalar()
+
+    processed = 0
+    started = time.perf_counter()
+    while True:
+        with engine.begin() as connection:
+            batch_ids = connection.execute(
+                select(ids).where(ids > last_id).order_by(ids).limit(batch_size)
+            ).scalars().all()
+            if not batch_ids:
+                connection.execute(state.update().where(state.c.name == name).values(completed_at=datetime.utcnow()))
+                break
+            migration.apply_batch(connection, batch_ids[0], batch_ids[-1])
+            last_id = batch_ids[-1]
+            processed += len(batch_ids)
+            # Saved in the same transaction as the batch, so progress is never ahead of the data
+            connection.execute(state.update().where(state.c.name == name).values(
+                last_id=last_id, processed=state.c.processed + len(batch_ids)
+            ))
+
+        elapsed = time.perf_counter() - started
+        rate = processed / elapsed if elapsed else 0
+        eta = (remaining - processed) / rate if rate else 0
+        progress(f"{name}: {processed}/{remaining} rows ({rate:.0f} rows/s, ~{eta:.0f}s left)")
+        if pause:
+            time.sleep(pause)
+
+    progress(f"{name}: completed, {processed} rows in {time.perf_counter() - started:.1f}s")
+    return processed
+
+def reset_data_migration(connection, name):
+    #Forget a data migration's progress, so the next run starts again from the first row
+    state = DataMigrationState.__table__
+    connection.execute(delete(state).where(state.c.name == name))
+
+def pending_data_migrations(engine):
+    #Names of registered data migrations that have not completed yet
+    with engine.connect() as connection:
+        state = DataMigrationState.__table__
+        completed = set(connection.execute(
+            select(state.c.name).where(state.c.completed_at.isnot(None))
+        ).scalars())
+    return [name for name in DATA_MIGRATIONS if name not in completed]
+
+# Registered data migrations
+
+@data_migration('backfill_prescriptions', MedicalRecord,
+                'Parse medical_records.medications into the prescriptions table')
+def backfill_prescriptions(connection, first_id, last_id):
+    from app.services.medical_record_service import parse_medications
+    records = MedicalRecord.__table__
+    prescriptions = Prescription.__table__
+    rows = connection.execute(select(
+        records.c.id, records.c.medications, records.c.admission_date,
+        records.c.discharge_date, records.c.created_at
+    ).where(
+        records.c.id.between(first_id, last_id),
+        records.c.medications.isnot(None),
+        records.c.medications != '',
+        # Records already synced by the service are left alone, so reruns are safe
+        ~exists().where(prescriptions.c.record_id == records.c.id)
+    )).all()
+
+    values = []
+    for row in rows:
+        start_date = row.admission_date or (row.created_at.date() if row.created_at else date.today())
+        for entry in parse_medications(row.medications):
+            values.append(dict(entry, record_id=row.id, start_date=start_date, end_date=row.discharge_date))
+    if values:
+        connection.execute(insert(prescriptions), values)
+
+@data_migration('backfill_patient_search_keys', Patient,
+                'Compute phonetic codes and trigrams of patient names for fuzzy search')
+def backfill_patient_search_keys(connection, first_id, last_id):
+    from app.services.patient_service import name_keys
+    patients = Patient.__table__
+    keys = PatientSearchKey.__table__
+    # Deleted patients get keys too, so they are searchable again once restored
+    rows = connection.execute(select(
+        patients.c.id, patients.c.first_name, patients.c.last_name, patients.c.date_of_birth
+    ).where(
+        patients.c.id.between(first_id, last_id),
+        ~exists().where(keys.c.patient_id == patients.c.id)
+    )).all()
+    if rows:
+        connection.execute(insert(keys), [
+            dict(name_keys(row.first_name, row.last_name), patient_id=row.id, date_of_birth=row.date_of_birth)
+            for row in rows
+        ])
+
+# Encrypted columns are rewritten by one data migration per table: values not
+# under the current key are re-encrypted (plain text ones encrypted) and the
+# blind indexes recomputed, rows that are already current are left alone.
+# Rotating keys runs them again from the start (reencrypt below, called by
+# the scheduler's rekey job and `python -m app.encryption rotate`).
+
+def encrypted_columns(model):
+    return [column for column in model.__table__.columns if isinstance(column.type, EncryptedString)]
+
+def encryption_migration(name, model):
+    #Register the data migration that encrypts model's columns with the current key
+    table = model.__table__
+    columns = encrypted_columns(model)
+    indexes = blind_indexed(model)
+    # Plain text goes in through the columns' type, which encrypts it
+    targets = {column.name: bindparam(f'new_{column.name}', type_=column.type) for column in columns}
+    targets.update({index: bindparam(f'new_{index}') for _, index, _ in indexes})
+    rewrite = update(table).where(table.c.id == bindparam('row_id')).values(targets)
+
+    def apply_batch(connection, first_id, last_id):
+        # type_coerce reads the stored text as it is, without decrypting it
+        rows = connection.execute(select(
+            table.c.id, *(type_coerce(column, Text).label(column.name) for column in columns),
+            *(table.c[index] for _, index, _ in indexes)
+        ).where(table.c.id.between(first_id, last_id))).all()
+        changed = []
+        for row in rows:
+            stored = row._mapping
+            plain = {column.name: decrypt(stored[column.name]) for column in columns}
+            hashes = {index: blind_index(plain[name], normalise) for name, index, normalise in indexes}
+            if all(is_current(stored[column.name]) for column in columns) and \
+                    all(stored[index] == value for index, value in hashes.items()):
+                continue
+            values = {f'new_{name}': value for name, value in plain.items()}
+            values.update({f'new_{index}': value for index, value in hashes.items()})
+            changed.append(dict(values, row_id=row.id))
+        if changed:
+            connection.execute(rewrite, changed)
+
+    data_migration(name, model, f"Encrypt {table.name} ({', '.join(column.name for column in columns)}) "
+                                f"with the current key")(apply_batch)
+
+ENCRYPTION_MIGRATIONS = {'encrypt_patients': Patient, 'encrypt_medical_records': MedicalRecord,
+                         'encrypt_outbox': OutboxMessage}
+for name, model in ENCRYPTION_MIGRATIONS.items():
+    encryption_migration(name, model)
+
+def stale_values(engine):
+    #Per encrypted column, the number of values not under the current key
+    ring = keyring()
+    counts = {}
+    with engine.connect() as connection:
+        for model in ENCRYPTION_MIGRATIONS.values():
+            for column in encrypted_columns(model):
+                stored = type_coerce(column, Text)
+                if ring is None:
+                    stale = func.substr(stored, 1, len(PREFIX)) == PREFIX
+                else:
+                    stale = func.substr(stored, 1, len(ring.prefix)) != ring.prefix
+                counts[f'{column.table.name}.{column.name}'] = connection.execute(
+                    select(func.count()).where(stored.isnot(None), stale)
+                ).scalar()
+    return counts
+
+def reencrypt(engine, names=None, batch_size=500, pause=0.05, force=False, progress=print):
+    #Run the encryption migrations again for tables holding values not under the current key (all of them with
+    # force, e.g. after changing the blind index key); returns the number of rows processed
+    if keyring() is None and not force:
+        return 0
+    stale = stale_values(engine)
+    processed = 0
+    for name in names or ENCRYPTION_MIGRATIONS:
+        model = DATA_MIGRATIONS[name].model
+        if not force and not any(stale[f'{model.__tablename__}.{column.name}'] for column in encrypted_columns(model)):
+            continue
+        with engine.begin() as connection:
+            row = get_state(connection, name)
+            # An unfinished run resumes; a finished one (under an older key) starts over
+            if row is not None and (force or row.completed_at):
+                reset_data_migration(connection, name)
+        processed += run_data_migration(engine, name, batch_size, pause, progress)
+    return processed
+
+def main():
+    # Command line entry point: python -m app.data_migrations
+    parser = argparse.ArgumentParser(description='Run batched data migrations')
+    parser.add_argument('command', choices=['status', 'run', 'run-all'])
+    parser.add_argument('name', nargs='?', help='data migration to run (for "run")')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--pause', type=float, default=0.05, help='seconds to yield between batches')
+    parser.add_argument('--facility', help='facility code (default: HOSPITAL_FACILITY or main)')
+    args = parser.parse_args()
+
+    from app.database import facility_engine, init_db
+    from app.facilities import set_facility
+    if args.facility:
+        set_facility(args.facility)
+    init_db()
+    engine = facility_engine()
+
+    if args.command == 'status':
+        with engine.connect() as connection:
+            for name, migration in DATA_MIGRATIONS.items():
+                row = get_state(connection, name)
+                if row is None:
+                    status = 'pending'
+                elif row.completed_at:
+                    status = f'completed {row.completed_at:%Y-%m-%d %H:%M}'
+                else:
+                    status = f'in progress (last id {row.last_id}, {row.processed} rows)'
+                print(f"{name:<30} {status:<40} {migration.description}")
+    elif args.command == 'run':
+        if args.name not in DATA_MIGRATIONS:
+            parser.error(f"unknown data migration: {args.name}")
+        run_data_migration(engine, args.name, args.batch_size, args.pause)
+    else:
+        for name in pending_data_migrations(engine):
+            run_data_migration(engine, name, args.batch_size, args.pause)
+
+if __name__ == "__main__":
+    main()
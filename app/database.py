@@ -1,20 +1,239 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from app.models import Base
+import glob
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import copy_context
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.orm import Session, sessionmaker
+from app.audit import install as install_audit
+from app.facilities import MAIN_FACILITY, current_facility, using_facility
+from app.validators import validate_facility
 
-# Create SQLite database engine
-engine = create_engine('sqlite:///hospital.db', echo=False)
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'alembic.ini')
 
-# Create session factory
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Bump together with every migration in migrations/versions, so existing
+# databases are upgraded once on the next launch.
+SCHEMA_VERSION = 16
 
-# create database tables
-def init_db():
-    Base.metadata.create_all(bind=engine)
+# Databases created by create_all before Alembic was wired in, keyed by the
+# PRAGMA user_version they carry, and the revision their schema matches.
+LEGACY_REVISIONS = {0: '3a9113e75e34', 6: 'f1b8d4e6a925'}
+
+# The main facility keeps hospital.db; every other facility of the group has
+# its own database, facilities/<code>.db, created on first use with the same
+# schema. Engines are picked per facility (facility_engine) and sessions are
+# bound to the facility current when they are opened.
+DATABASE_PATH = 'hospital.db'
+FACILITY_DIR = 'facilities'
+
+# Read-only service calls (listings, searches, reports) can run on a separate
+# source, chosen per call with read_session():
+#   'primary'  - the read-write engine below
+#   'replica'  - a read-only URI connection to hospital.db; under WAL it reads
+#                the last committed state without blocking or waiting for writers
+#   'snapshot' - a copy made with SQLite's online backup API, refreshed when
+#                older than SNAPSHOT_MAX_AGE seconds; long scans never touch
+#                the live file
+READ_SOURCES = ('primary', 'replica', 'snapshot')
+DEFAULT_READ_SOURCE = 'replica'
+SNAPSHOT_PATH = 'hospital_snapshot.db'
+SNAPSHOT_MAX_AGE = 300
+SNAPSHOT_BACKUP_PAGES = 1024
+
+# Compiled SQL is cached per engine, keyed by statement structure (not parameter
+# values). The services, reports and CLI use a few hundred distinct statements,
+# so the cache is sized to hold all of them without evictions.
+STATEMENT_CACHE_SIZE = 1000
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # Wait for a lock (e.g. a data migration batch) instead of failing at once
+    dbapi_connection.execute('PRAGMA busy_timeout = 5000')
+    # WAL lets read-only connections and the snapshot backup run alongside writes
+    dbapi_connection.execute('PRAGMA journal_mode = WAL')
+
+def database_path(facility=None):
+    #Database file of a facility (the current one by default)
+    facility = validate_facility(facility or current_facility())
+    if facility == MAIN_FACILITY:
+        return DATABASE_PATH
+    return os.path.join(FACILITY_DIR, f'{facility}.db')
+
+def snapshot_path(facility=None):
+    facility = validate_facility(facility or current_facility())
+    if facility == MAIN_FACILITY:
+        return SNAPSHOT_PATH
+    return os.path.join(FACILITY_DIR, f'{facility}_snapshot.db')
+
+def facilities():
+    #Codes of the facilities with a database, main first
+    codes = [os.path.basename(path)[:-3] for path in glob.glob(os.path.join(FACILITY_DIR, '*.db'))]
+    return [MAIN_FACILITY] + sorted(code for code in codes if not code.endswith('_snapshot') and code != MAIN_FACILITY)
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+def facility_engine(facility=None):
+    #Read-write engine of a facility (the current one by default), created on first use
+    facility = validate_facility(facility or current_facility())
+    if facility not in _engines:
+        with _engines_lock:
+            if facility not in _engines:
+                path = database_path(facility)
+                if os.path.dirname(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                created = create_engine(f'sqlite:///{path}', echo=False, query_cache_size=STATEMENT_CACHE_SIZE)
+                event.listen(created, 'connect', _set_sqlite_pragmas)
+                _engines[facility] = created
+    return _engines[facility]
+
+# The main facility's engine, for code that only ever deals with hospital.db;
+# anything facility-aware goes through facility_engine()
+engine = facility_engine(MAIN_FACILITY)
+
+class FacilitySession(Session):
+    # Bound to the current facility's database unless given a bind; the code is kept in info['facility']
+    def __init__(self, bind=None, **kwargs):
+        facility = current_facility()
+        super().__init__(bind=bind or facility_engine(facility), **kwargs)
+        self.info.setdefault('facility', facility)
+
+# Every session in the process reports reads and committed writes to the audit log
+install_audit()
+
+SessionLocal = sessionmaker(class_=FacilitySession, autocommit=False, autoflush=False)
+ReadSessionLocal = sessionmaker(class_=FacilitySession, autocommit=False, autoflush=False)
+
+_read_engines = {}
+
+def init_db(facility=None):
+    #Create or upgrade a facility's database (the current one by default)
+    facility = validate_facility(facility or current_facility())
+    target = facility_engine(facility)
+    # Only touch Alembic (slow to import) when the marker is out of date
+    with target.connect() as connection:
+        version = connection.exec_driver_sql('PRAGMA user_version').scalar()
+    if version == SCHEMA_VERSION:
+        return
+    existing = bool(inspect(target).get_table_names())
+    with using_facility(facility):
+        upgrade_schema(version)
+    with target.begin() as connection:
+        connection.exec_driver_sql(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    if existing:
+        warn_pending_data_migrations(facility)
+
+def warn_pending_data_migrations(facility):
+    #Tell whoever upgraded an existing database which backfills its rows still need
+    # Data migrations rewrite every row in batches, which can take a while on a
+    # large database, so they are left to an explicit run rather than the launch
+    from app.data_migrations import pending_data_migrations
+    pending = pending_data_migrations(facility_engine(facility))
+    if pending:
+        command = 'python -m app.data_migrations run-all'
+        if facility != MAIN_FACILITY:
+            command += f' --facility {facility}'
+        print(f"Database of facility '{facility}' upgraded; data migrations still to run: {', '.join(pending)}. "
+              f"Until they finish, existing rows may be missing from prescription, patient search and "
+              f"encrypted lookups. Run: {command}", file=sys.stderr)
+
+def upgrade_schema(version=0):
+    #Bring the current facility's database to the latest migration
+    from alembic import command
+    from alembic.config import Config
+
+    config = Config(ALEMBIC_INI)
+    tables = inspect(facility_engine()).get_table_names()
+    if tables and 'alembic_version' not in tables:
+        command.stamp(config, LEGACY_REVISIONS.get(version, LEGACY_REVISIONS[0]))
+    command.upgrade(config, 'head')
+
+def add_facility(code):
+    #Create a new facility's database with the current schema; returns its code
+    code = validate_facility(code)
+    if code in facilities():
+        raise ValueError(f"Facility '{code}' already exists")
+    init_db(code)
+    return code
 
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def read_engine(source=DEFAULT_READ_SOURCE, facility=None):
+    #Engine for one of READ_SOURCES of a facility (the current one by default), created on first use
+    facility = validate_facility(facility or current_facility())
+    if source == 'primary':
+        return facility_engine(facility)
+    key = (facility, source)
+    if key not in _read_engines:
+        if source == 'replica':
+            url = f'sqlite:///file:{os.path.abspath(database_path(facility))}?mode=ro&uri=true'
+        elif source == 'snapshot':
+            # The snapshot file is only ever replaced, never written in place
+            url = f'sqlite:///file:{os.path.abspath(snapshot_path(facility))}?mode=ro&immutable=1&uri=true'
+        else:
+            raise ValueError(f"Unknown read source: {source}. Choose from {', '.join(READ_SOURCES)}")
+        with _engines_lock:
+            _read_engines.setdefault(key, create_engine(url, echo=False, query_cache_size=STATEMENT_CACHE_SIZE))
+    return _read_engines[key]
+
+def refresh_snapshot(max_age=SNAPSHOT_MAX_AGE, facility=None):
+    #Copy a facility's database to its snapshot file if that is missing or older than max_age seconds
+    facility = validate_facility(facility or current_facility())
+    snapshot = snapshot_path(facility)
+    if os.path.exists(snapshot) and time.time() - os.path.getmtime(snapshot) < max_age:
+        return False
+
+    partial = f'{snapshot}.{os.getpid()}.part'
+    source = sqlite3.connect(f'file:{os.path.abspath(database_path(facility))}?mode=ro', uri=True)
+    target = sqlite3.connect(partial)
+    try:
+        # Copied a few pages per step so writers can commit in between
+        source.backup(target, pages=SNAPSHOT_BACKUP_PAGES)
+        target.execute('PRAGMA journal_mode = DELETE')
+    finally:
+        target.close()
+        source.close()
+    os.replace(partial, snapshot)
+
+    # Pooled connections still point at the replaced file
+    if (facility, 'snapshot') in _read_engines:
+        _read_engines[(facility, 'snapshot')].dispose()
+    return True
+
+@contextmanager
+def read_session(source=DEFAULT_READ_SOURCE):
+    #Short-lived session for read-only service calls on the current facility; closing it ends the read transaction
+    if source == 'snapshot':
+        refresh_snapshot()
+    db = ReadSessionLocal(bind=read_engine(source))
+    try:
+        yield db
+    finally:
+        db.close()
+
+def fan_out(function, codes=None, source=DEFAULT_READ_SOURCE, workers=None):
+    #Run function(db) against every facility (or those in codes) at once, each in a thread with its own read
+    # session and the facility as the current one; returns {code: result} in facility order.
+    # SQLite releases the GIL while it runs a query, so the facilities are searched in parallel.
+    codes = [validate_facility(code) for code in codes] if codes else facilities()
+
+    def run(code):
+        with using_facility(code):
+            init_db(code)
+            with read_session(source) as db:
+                return function(db)
+
+    if len(codes) == 1:
+        return {codes[0]: run(codes[0])}
+    with ThreadPoolExecutor(max_workers=workers or len(codes), thread_name_prefix='facility') as pool:
+        # Each thread runs in a copy of the caller's context, so the audit actor carries over
+        futures = [pool.submit(copy_context().run, run, code) for code in codes]
+        return {code: future.result() for code, future in zip(codes, futures)}
\ No newline at end of file
@@ -0,0 +1,174 @@
+import argparse
+import base64
+import hashlib
+import hmac
+import os
+import re
+import sys
+from functools import lru_cache
+
+# Add the parent directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Field-level encryption of sensitive columns: patients' contact number, email
+# and address, medical records' diagnosis, treatment and notes, and the
+# recipients of outbox messages. Columns typed models.EncryptedString are
+# encrypted with AES-256-GCM on their way into the database and decrypted on
+# the way out, for ORM and Core statements alike, so services, listings and
+# reports see plain text.
+#
+# Keys come from HOSPITAL_ENCRYPTION_KEYS, comma separated "id:key" pairs (a
+# key is 32 url-safe base64 encoded bytes, see `python -m app.encryption
+# generate-key`). The first key encrypts; all of them decrypt. A stored value
+# reads "enc:<id>:<nonce + ciphertext>", so it names the key it needs, and
+# values written before encryption was turned on are read as they are. To
+# rotate, put the new key first and keep the old ones until the scheduler's
+# rekey job (or `python -m app.encryption rotate`) has re-encrypted every
+# value in batches; `status` shows what is left. Without keys nothing is
+# encrypted and the cryptography package is not needed.
+#
+# Ciphertext differs every time a value is written, so equality lookups and
+# grouping go through a blind index instead: an HMAC-SHA256 of the normalised
+# value (the digits of a phone number, a lower-cased email, a diagnosis as
+# written) under HOSPITAL_BLIND_INDEX_KEY, kept in an indexed column beside
+# the encrypted one. The blind index key must be set once encryption is on,
+# since phone numbers are too few to hide behind an unkeyed hash.
+PREFIX = 'enc:'
+NONCE_BYTES = 12
+INDEX_HEX_DIGITS = 32           # 128 bits of the HMAC
+DECRYPT_CACHE_SIZE = 20000      # decrypted values kept, so rereading a listing costs a dict lookup
+DEFAULT_INDEX_KEY = b'valy-hospital-blind-index'
+
+NORMALISERS = {
+    'phone': lambda value: re.sub(r'\D', '', value),
+    'email': lambda value: value.strip().lower(),
+    'text': lambda value: value,
+}
+
+class KeyRing:
+    def __init__(self, keys):
+        # keys: [(id, 32 byte key), ...], the first one current
+        try:
+            from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+        except ImportError:
+            raise RuntimeError("HOSPITAL_ENCRYPTION_KEYS is set but the cryptography package is not installed "
+                               "(pipenv install)") from None
+        self.current = keys[0][0]
+        self.ciphers = {key_id: AESGCM(key) for key_id, key in keys}
+        self.prefix = f'{PREFIX}{self.current}:'
+
+def _parse_keys(text):
+    keys = []
+    for item in filter(None, (part.strip() for part in text.split(','))):
+        key_id, _, encoded = item.partition(':')
+        if not re.match(r'^[A-Za-z0-9_-]{1,16}$', key_id) or not encoded:
+            raise ValueError("HOSPITAL_ENCRYPTION_KEYS must be comma separated id:key pairs")
+        try:
+            key = base64.urlsafe_b64decode(encoded)
+        except ValueError:
+            key = b''
+        if len(key) != 32:
+            raise ValueError(f"Encryption key '{key_id}' must be 32 url-safe base64 encoded bytes")
+        keys.append((key_id, key))
+    return keys
+
+@lru_cache(maxsize=None)
+def keyring():
+    #The configured keys, or None when encryption is off
+    keys = _parse_keys(os.environ.get('HOSPITAL_ENCRYPTION_KEYS', ''))
+    if not keys:
+        return None
+    if not os.environ.get('HOSPITAL_BLIND_INDEX_KEY'):
+        raise ValueError("HOSPITAL_BLIND_INDEX_KEY must be set when HOSPITAL_ENCRYPTION_KEYS is")
+    return KeyRing(keys)
+
+def enabled():
+    return keyring() is not None
+
+@lru_cache(maxsize=None)
+def _index_key():
+    secret = os.environ.get('HOSPITAL_BLIND_INDEX_KEY')
+    return secret.encode() if secret else DEFAULT_INDEX_KEY
+
+def reset():
+    #Forget the loaded keys and cached values, after changing the environment
+    keyring.cache_clear()
+    _index_key.cache_clear()
+    _decrypt.cache_clear()
+
+def generate_key():
+    return base64.urlsafe_b64encode(os.urandom(32)).decode()
+
+def encrypt(value):
+    #Stored form of a str under the current key (the value itself when encryption is off)
+    ring = keyring()
+    if ring is None or value is None:
+        return value
+    nonce = os.urandom(NONCE_BYTES)
+    sealed = ring.ciphers[ring.current].encrypt(nonce, value.encode(), None)
+    return ring.prefix + base64.urlsafe_b64encode(nonce + sealed).decode()
+
+def decrypt(value):
+    #Plain text of a stored value; values without the prefix were never encrypted
+    if value is None or not value.startswith(PREFIX):
+        return value
+    return _decrypt(value)
+
+@lru_cache(maxsize=DECRYPT_CACHE_SIZE)
+def _decrypt(value):
+    key_id, _, encoded = value[len(PREFIX):].partition(':')
+    ring = keyring()
+    if ring is None or key_id not in ring.ciphers:
+        raise ValueError(f"Value encrypted with key '{key_id}', which is not in HOSPITAL_ENCRYPTION_KEYS")
+    data = base64.urlsafe_b64decode(encoded)
+    return ring.ciphers[key_id].decrypt(data[:NONCE_BYTES], data[NONCE_BYTES:], None).decode()
+
+def is_current(value):
+    #True if a stored value needs no re-encryption under the current keys
+    ring = keyring()
+    if value is None:
+        return True
+    if ring is None:
+        return not value.startswith(PREFIX)
+    return value.startswith(ring.prefix)
+
+def blind_index(value, normalise='text'):
+    #Keyed hash of a plain value for equality lookups; None for None or a value that normalises to ''
+    if value is None:
+        return None
+    value = NORMALISERS[normalise](value)
+    if not value:
+        return None
+    return hmac.new(_index_key(), value.encode(), hashlib.sha256).hexdigest()[:INDEX_HEX_DIGITS]
+
+def main():
+    # Command line entry point: python -m app.encryption
+    parser = argparse.ArgumentParser(description='Manage field-level encryption keys')
+    parser.add_argument('command', choices=['generate-key', 'status', 'rotate'])
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--pause', type=float, default=0.05, help='seconds to yield between batches')
+    parser.add_argument('--facility', help='facility code (default: HOSPITAL_FACILITY or main)')
+    args = parser.parse_args()
+
+    if args.command == 'generate-key':
+        print(generate_key())
+        return
+
+    from app.data_migrations import reencrypt, stale_values
+    from app.database import facility_engine, init_db
+    from app.facilities import set_facility
+    if args.facility:
+        set_facility(args.facility)
+    init_db()
+    engine = facility_engine()
+    ring = keyring()
+    print(f"Current key: {ring.current if ring else 'none (encryption off)'}")
+    if args.command == 'status':
+        for column, count in stale_values(engine).items():
+            print(f"{column:<30} {count} values not under the current key")
+    else:
+        # Every row is checked, so a changed blind index key is picked up too
+        reencrypt(engine, batch_size=args.batch_size, pause=args.pause, force=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from app.validators import validate_facility
+
+# The group's clinics each keep their data in their own database (see
+# app.database for the file layout and routing). The facility a piece of work
+# is for travels in a context variable, like the audit actor: sessions opened
+# in a context are bound to that facility's database, audit events are tagged
+# with it, and threads or tasks started from the context carry it along.
+# HOSPITAL_FACILITY picks the facility a process starts in.
+MAIN_FACILITY = 'main'
+
+_facility = ContextVar('facility', default=None)
+
+@lru_cache(maxsize=None)
+def default_facility():
+    return validate_facility(os.environ.get('HOSPITAL_FACILITY') or MAIN_FACILITY)
+
+def current_facility():
+    return _facility.get() or default_facility()
+
+def set_facility(code):
+    #Work on facility code in this context (thread or task) from now on
+    _facility.set(validate_facility(code))
+
+@contextmanager
+def using_facility(code):
+    token = _facility.set(validate_facility(code))
+    try:
+        yield
+    finally:
+        _facility.reset(token)
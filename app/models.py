@@ -1,11 +1,233 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean, Date
+import enum
+from decimal import Decimal, ROUND_HALF_UP
+from sqlalchemy import Column, Integer, String, Text, DateTime, Time, ForeignKey, Boolean, Date, UniqueConstraint, CheckConstraint, Index, SmallInteger, bindparam, event, inspect, literal, select, text
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
-from datetime import datetime
+from sqlalchemy.orm import Session, relationship, with_loader_criteria
+from sqlalchemy.orm.util import identity_key
+from sqlalchemy.types import TypeDecorator
+from datetime import datetime, time
+from app.encryption import blind_index, decrypt, encrypt
 
 Base = declarative_base()
 
-class Patient(Base):
+class LabeledIntEnum(enum.IntEnum):
+    # Stored as a small integer, shown and entered as a label ("No Show")
+
+    @property
+    def label(self):
+        return self.name.replace('_', ' ').title()
+
+    def __str__(self):
+        return self.label
+
+    def __format__(self, format_spec):
+        return format(self.label, format_spec)
+
+    @classmethod
+    def parse(cls, value):
+        #Accept a member, its integer code or its label (case/spacing insensitive)
+        if isinstance(value, cls):
+            return value
+        if isinstance(value, int):
+            return cls(value)
+        key = str(value).strip().replace('-', ' ').replace('_', ' ').upper()
+        for member in cls:
+            if member.name.replace('_', ' ') == key or member.name.replace('_', '') == key.replace(' ', ''):
+                return member
+        raise ValueError(f"Status must be one of: {', '.join(member.label for member in cls)}")
+
+    @classmethod
+    def check_sql(cls, column='status'):
+        return f"{column} IN ({', '.join(str(int(member)) for member in cls)})"
+
+class AppointmentStatus(LabeledIntEnum):
+    SCHEDULED = 0
+    COMPLETED = 1
+    CANCELLED = 2
+    NO_SHOW = 3
+
+class BillStatus(LabeledIntEnum):
+    UNPAID = 0
+    PAID = 1
+    OVERDUE = 2
+
+class ShiftKind(LabeledIntEnum):
+    REGULAR = 0
+    ON_CALL = 1
+
+class OutboxStatus(LabeledIntEnum):
+    PENDING = 0
+    SENT = 1
+    FAILED = 2
+
+class IntEnumType(TypeDecorator):
+    #Persist a LabeledIntEnum as its integer code
+    impl = SmallInteger
+    cache_ok = True
+
+    def __init__(self, enum_class):
+        super().__init__()
+        self.enum_class = enum_class
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return int(self.enum_class.parse(value))
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return self.enum_class(value)
+
+CENT = Decimal('0.01')
+
+class Cents(TypeDecorator):
+    #Persist money as an integer number of cents, exposed as a 2-place Decimal
+    impl = Integer
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return int((Decimal(str(value)) * 100).to_integral_value(rounding=ROUND_HALF_UP))
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return (Decimal(value) / 100).quantize(CENT)
+
+class EncryptedString(TypeDecorator):
+    #Persist text encrypted under the current key (see app.encryption), exposed as plain text.
+    # Comparing the column with a value in SQL never matches (the ciphertext changes on every
+    # write); blind_index names the column holding the value's keyed hash, for equality lookups
+    impl = Text
+    cache_ok = True
+
+    def __init__(self, blind_index=None, normalise='text'):
+        super().__init__()
+        self.blind_index = blind_index
+        self.normalise = normalise
+
+    def process_bind_param(self, value, dialect):
+        return encrypt(value)
+
+    def process_result_value(self, value, dialect):
+        return decrypt(value)
+
+def blind_indexed(model):
+    #(column name, index column name, normaliser) of the model's encrypted columns with a blind index
+    return [(column.name, column.type.blind_index, column.type.normalise) for column in model.__table__.columns
+            if isinstance(column.type, EncryptedString) and column.type.blind_index]
+
+def _fill_blind_indexes(mapper, connection, target):
+    # Inserts hash every value; updates only those that changed
+    state = inspect(target)
+    for name, index, normalise in BLIND_INDEXES[mapper.class_]:
+        if state.key is None or state.attrs[name].history.has_changes():
+            setattr(target, index, blind_index(getattr(target, name), normalise))
+
+def status_equals(column, status):
+    #Compare with the status code rendered inline, so SQLite can match partial indexes on it
+    return column == literal(status, column.type, literal_execute=True)
+
+def status_in(column, statuses):
+    #Like status_equals for several codes, rendered as `status IN (0, 2)`
+    return column.in_([literal(status, column.type, literal_execute=True) for status in statuses])
+
+# Bills that still have to be paid, as listed on patient statements
+OUTSTANDING_BILL_STATUSES = (BillStatus.UNPAID, BillStatus.OVERDUE)
+
+class SoftDelete:
+    # Deleting a record sets deleted_at (a tombstone) instead of removing the
+    # row, so it can be restored; TrashService.purge removes old tombstones.
+    # ORM queries skip tombstoned rows unless run with
+    # .execution_options(include_deleted=True). Core queries on a plain
+    # connection are not filtered and must add deleted_at IS NULL themselves.
+    deleted_at = Column(DateTime)
+
+def tombstone_index(table):
+    #Partial index over deleted rows only: small, and what purge and the recycle bin scan
+    return Index(f'ix_{table}_deleted_at', 'deleted_at', sqlite_where=text('deleted_at IS NOT NULL'))
+
+# Partial indexes over live rows repeat this condition; queries match them
+# through the deleted_at IS NULL filter added below (or written explicitly)
+LIVE = 'deleted_at IS NULL'
+
+# Built once: constructing the option is a good part of a simple lookup's cost
+LIVE_ROWS = with_loader_criteria(SoftDelete, lambda cls: cls.deleted_at.is_(None), include_aliases=True)
+
+@event.listens_for(Session, 'do_orm_execute')
+def _skip_deleted_rows(execute_state):
+    # Attribute refreshes and relationship loads of objects already loaded
+    # are left alone (the criteria propagates to lazy loads by itself)
+    if (execute_state.is_select and not execute_state.is_column_load
+            and not execute_state.is_relationship_load
+            and not execute_state.execution_options.get('include_deleted', False)):
+        execute_state.statement = execute_state.statement.options(LIVE_ROWS)
+
+# Ids per IN query in get_many, well below SQLite's limit on bound parameters
+GET_MANY_CHUNK = 500
+
+def _is_deleted(instance):
+    return getattr(instance, 'deleted_at', None) is not None
+
+def get_live(db: Session, model, id, include_deleted: bool = False):
+    #Session.get that skips tombstoned rows: no SELECT when the object is already in the session
+    instance = db.get(model, id, execution_options={'include_deleted': include_deleted})
+    if instance is not None and not include_deleted and _is_deleted(instance):
+        return None
+    return instance
+
+_get_many_statements = {}
+
+def get_many(db: Session, model, ids, include_deleted: bool = False, chunk_size: int = GET_MANY_CHUNK):
+    #Objects for ids in input order (missing or deleted ids left out): identity map first, then one IN query per chunk
+    ids = list(dict.fromkeys(id for id in ids if id is not None))
+    found = {}
+    missing = []
+    for id in ids:
+        instance = db.identity_map.get(identity_key(model, id))
+        # Expired objects would each refresh with their own SELECT; reload them with the rest
+        if instance is not None and not inspect(instance).expired_attributes:
+            found[id] = instance
+        else:
+            missing.append(id)
+    
+    if missing:
+        if model not in _get_many_statements:
+            _get_many_statements[model] = select(model).where(model.id.in_(bindparam('ids', expanding=True)))
+        for start in range(0, len(missing), chunk_size):
+            for instance in db.execute(_get_many_statements[model], {'ids': missing[start:start + chunk_size]},
+                                       execution_options={'include_deleted': include_deleted}).scalars():
+                found[instance.id] = instance
+    
+    return [found[id] for id in ids if id in found and (include_deleted or not _is_deleted(found[id]))]
+
+# Listings that show a few columns read them as plain tuples through Core:
+# no ORM objects, identity map entries or load events. Row types are
+# NamedTuples (no per-row __dict__), defined next to the service that lists them.
+
+# Called with (session, model, rows) after every read_rows; the audit trail
+# registers here, since tuples raise no load events
+row_read_listeners = []
+
+def live_columns(model, row_type):
+    #select() of the model columns named by row_type's fields, live rows only (Core gets no deleted-row filter)
+    return select(*(getattr(model, name) for name in row_type._fields)).where(model.deleted_at.is_(None))
+
+def read_rows(db: Session, model, row_type, statement, params=None):
+    #Run a column select on the session's connection and return row_type tuples
+    rows = list(map(row_type._make, db.connection().execute(statement, params or {})))
+    for listener in row_read_listeners:
+        listener(db, model, rows)
+    return rows
+
+# Editable records carry a version number that SQLAlchemy checks and bumps on
+# every UPDATE/DELETE (WHERE id = ? AND version = ?), so two desks editing
+# the same row cannot silently overwrite each other. Bulk Core updates must
+# bump it themselves (version = version + 1).
+
+class Patient(SoftDelete, Base):
     __tablename__ = 'patients'
     
     id = Column(Integer, primary_key=True)
@@ -13,20 +235,57 @@ class Patient(Base):
     last_name = Column(String(50), nullable=False)
     date_of_birth = Column(Date, nullable=False)
     gender = Column(String(10), nullable=False)
-    contact_number = Column(String(15), nullable=False)
-    email = Column(String(100))
-    address = Column(String(200))
+    contact_number = Column(EncryptedString(blind_index='contact_number_index', normalise='phone'), nullable=False)
+    email = Column(EncryptedString(blind_index='email_index', normalise='email'))
+    address = Column(EncryptedString())
+    # Blind indexes of contact_number and email, filled on every insert and update
+    contact_number_index = Column(String(32), index=True)
+    email_index = Column(String(32), index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    version = Column(Integer, nullable=False, server_default='1')
     
     # Relationships between different tables 
     appointments = relationship("Appointment", back_populates="patient")
     medical_records = relationship("MedicalRecord", back_populates="patient")
     bills = relationship("Bill", back_populates="patient")
+    search_key = relationship("PatientSearchKey", back_populates="patient", uselist=False, cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        tombstone_index('patients'),
+    )
+    __mapper_args__ = {'version_id_col': version}
     
     def __repr__(self):
         return f"<Patient(id={self.id}, name={self.first_name} {self.last_name})>"
 
-class Staff(Base):
+class PatientSearchKey(Base):
+    __tablename__ = 'patient_search_keys'
+    
+    # Kept in step with the patient's name by PatientService.sync_search_key
+    patient_id = Column(Integer, ForeignKey('patients.id'), primary_key=True)
+    date_of_birth = Column(Date, nullable=False, index=True)
+    first_soundex = Column(String(4), nullable=False)
+    first_metaphone = Column(String(12), nullable=False)
+    last_soundex = Column(String(4), nullable=False)
+    last_metaphone = Column(String(12), nullable=False)
+    trigrams = Column(String(500), nullable=False)  # sorted, '|' separated: '|  j| jo|joh|...|'
+    
+    # Relationships between different tables 
+    patient = relationship("Patient", back_populates="search_key")
+    
+    __table_args__ = (
+        # Each index pairs one name's code with the other name's Soundex code, so a code
+        # plus the other name's initial (a range on the second column) is one index range
+        Index('ix_patient_search_keys_soundex', 'last_soundex', 'first_soundex'),
+        Index('ix_patient_search_keys_metaphone', 'last_metaphone', 'first_soundex'),
+        Index('ix_patient_search_keys_first_soundex', 'first_soundex', 'last_soundex'),
+        Index('ix_patient_search_keys_first_metaphone', 'first_metaphone', 'last_soundex'),
+    )
+    
+    def __repr__(self):
+        return f"<PatientSearchKey(patient_id={self.patient_id}, last={self.last_metaphone}, first={self.first_metaphone})>"
+
+class Staff(SoftDelete, Base):
     __tablename__ = 'staff'
     
     id = Column(Integer, primary_key=True)
@@ -37,66 +296,300 @@ class Staff(Base):
     contact_number = Column(String(15), nullable=False)
     email = Column(String(100))
     hire_date = Column(Date, default=datetime.utcnow)
+    version = Column(Integer, nullable=False, server_default='1')
     
     # Relationships between different tables 
     appointments = relationship("Appointment", back_populates="staff")
     medical_records = relationship("MedicalRecord", back_populates="staff")
+    working_hours = relationship("StaffWorkingHours", back_populates="staff", cascade="all, delete-orphan",
+                                 order_by="(StaffWorkingHours.weekday, StaffWorkingHours.start_time)")
+    shifts = relationship("StaffShift", back_populates="staff", order_by="StaffShift.starts_at")
+    
+    __table_args__ = (
+        tombstone_index('staff'),
+    )
+    __mapper_args__ = {'version_id_col': version}
     
     def __repr__(self):
         return f"<Staff(id={self.id}, name={self.first_name} {self.last_name}, role={self.role})>"
 
-class Appointment(Base):
+# Weekly working pattern used by the scheduling engine for staff without rows
+# in staff_working_hours: weekday (0 = Monday) -> blocks of (start, end)
+DEFAULT_WORKING_HOURS = {weekday: [(time(8, 0), time(17, 0))] for weekday in range(5)}
+
+class StaffWorkingHours(Base):
+    # One block of a staff member's weekly hours; a split day has two rows
+    __tablename__ = 'staff_working_hours'
+    
+    id = Column(Integer, primary_key=True)
+    staff_id = Column(Integer, ForeignKey('staff.id'), nullable=False)
+    weekday = Column(SmallInteger, nullable=False)  # 0 = Monday
+    start_time = Column(Time, nullable=False)
+    end_time = Column(Time, nullable=False)
+    
+    staff = relationship("Staff", back_populates="working_hours")
+    
+    __table_args__ = (
+        CheckConstraint('weekday BETWEEN 0 AND 6', name='ck_staff_working_hours_weekday'),
+        CheckConstraint('start_time < end_time', name='ck_staff_working_hours_order'),
+        Index('ix_staff_working_hours_staff', 'staff_id', 'weekday'),
+    )
+    
+    def __repr__(self):
+        return f"<StaffWorkingHours(staff_id={self.staff_id}, weekday={self.weekday}, {self.start_time}-{self.end_time})>"
+
+# Shifts are stored as they are worked (a night shift crosses midnight) but no
+# longer than this, so "on duty at t" only scans shifts starting in
+# (t - MAX_SHIFT_HOURS, t] of the starts_at index
+MAX_SHIFT_HOURS = 24
+
+class StaffShift(Base):
+    # One rostered shift. Department and role are those it is worked in (for
+    # most staff their own), kept on the shift so coverage depends on nothing else
+    __tablename__ = 'staff_shifts'
+    
+    id = Column(Integer, primary_key=True)
+    staff_id = Column(Integer, ForeignKey('staff.id'), nullable=False)
+    department = Column(String(50), nullable=False)
+    role = Column(String(50), nullable=False)
+    starts_at = Column(DateTime, nullable=False)
+    ends_at = Column(DateTime, nullable=False)
+    kind = Column(IntEnumType(ShiftKind), nullable=False, default=ShiftKind.REGULAR)
+    
+    staff = relationship("Staff", back_populates="shifts")
+    
+    __table_args__ = (
+        CheckConstraint('starts_at < ends_at', name='ck_staff_shifts_order'),
+        CheckConstraint(ShiftKind.check_sql('kind'), name='ck_staff_shifts_kind'),
+        # Covers on-duty lookups: a range on starts_at, the rest read from the index
+        Index('ix_staff_shifts_starts_at', 'starts_at', 'ends_at', 'department', 'role', 'staff_id', 'kind'),
+        Index('ix_staff_shifts_staff', 'staff_id', 'starts_at'),
+    )
+    
+    def __repr__(self):
+        return f"<StaffShift(staff_id={self.staff_id}, department={self.department}, {self.starts_at}-{self.ends_at}, kind={self.kind})>"
+
+class DepartmentCoverage(Base):
+    # Per department, day and role (COVERAGE_ALL_ROLES for everyone), computed
+    # from staff_shifts and kept up to date by CoverageService whenever shifts
+    # change; days without shifts have no rows
+    __tablename__ = 'department_coverage'
+    
+    department = Column(String(50), primary_key=True)
+    day = Column(Date, primary_key=True)
+    role = Column(String(50), primary_key=True)
+    staff = Column(Integer, nullable=False)           # distinct staff with a shift that day
+    on_call = Column(Integer, nullable=False)         # of whom on call
+    covered_minutes = Column(Integer, nullable=False)  # minutes of the day with someone on duty
+    staff_minutes = Column(Integer, nullable=False)   # shift minutes falling in the day
+    peak = Column(Integer, nullable=False)            # most on duty at once
+    lowest = Column(Integer, nullable=False)          # fewest on duty at once (0 if the day has a gap)
+    
+    __table_args__ = (
+        Index('ix_department_coverage_day', 'day', 'department'),
+    )
+    
+    def __repr__(self):
+        return f"<DepartmentCoverage(department={self.department}, day={self.day}, role={self.role}, staff={self.staff})>"
+
+COVERAGE_ALL_ROLES = 'All'
+
+DEFAULT_APPOINTMENT_MINUTES = 30
+
+class Appointment(SoftDelete, Base):
     __tablename__ = 'appointments'
     
     id = Column(Integer, primary_key=True)
     patient_id = Column(Integer, ForeignKey('patients.id'), nullable=False)
     staff_id = Column(Integer, ForeignKey('staff.id'), nullable=False)
-    appointment_date = Column(DateTime, nullable=False)
+    appointment_date = Column(DateTime, nullable=False, index=True)
+    duration_minutes = Column(SmallInteger, nullable=False, default=DEFAULT_APPOINTMENT_MINUTES,
+                              server_default=str(DEFAULT_APPOINTMENT_MINUTES))
     purpose = Column(String(200))
-    status = Column(String(20), default="Scheduled")  # Scheduled, Completed, Cancelled
+    status = Column(IntEnumType(AppointmentStatus), nullable=False, default=AppointmentStatus.SCHEDULED)
+    series_id = Column(Integer, ForeignKey('appointment_series.id'), index=True)
+    version = Column(Integer, nullable=False, server_default='1')
     
     # Relationships between different tables 
     patient = relationship("Patient", back_populates="appointments")
     staff = relationship("Staff", back_populates="appointments")
+    series = relationship("AppointmentSeries", back_populates="appointments")
+    
+    __table_args__ = (
+        CheckConstraint(AppointmentStatus.check_sql(), name='ck_appointments_status'),
+        # Only open appointments are indexed; history does not slow down scheduling lookups
+        Index('ix_appointments_scheduled_date', 'appointment_date',
+              sqlite_where=text(f'status = {int(AppointmentStatus.SCHEDULED)} AND {LIVE}')),
+        # Covers the slot search's reads of who is busy when, without visiting the table
+        Index('ix_appointments_busy', 'appointment_date', 'staff_id', 'patient_id', 'duration_minutes', 'status',
+              sqlite_where=text(LIVE)),
+        tombstone_index('appointments'),
+    )
+    
+    __mapper_args__ = {'version_id_col': version}
     
     def __repr__(self):
         return f"<Appointment(id={self.id}, patient_id={self.patient_id}, date={self.appointment_date})>"
 
-class MedicalRecord(Base):
-    __tablename__ = 'medical_records'
+class AppointmentSeries(SoftDelete, Base):
+    __tablename__ = 'appointment_series'
     
     id = Column(Integer, primary_key=True)
     patient_id = Column(Integer, ForeignKey('patients.id'), nullable=False)
     staff_id = Column(Integer, ForeignKey('staff.id'), nullable=False)
-    diagnosis = Column(String(200), nullable=False)
-    treatment = Column(String(500))
+    start = Column(DateTime, nullable=False)
+    rule = Column(String(200), nullable=False)  # RFC 5545 RRULE, e.g. FREQ=WEEKLY;COUNT=12
+    purpose = Column(String(200))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    version = Column(Integer, nullable=False, server_default='1')
+    
+    # Relationships between different tables 
+    appointments = relationship("Appointment", back_populates="series")
+    
+    __table_args__ = (
+        tombstone_index('appointment_series'),
+    )
+    __mapper_args__ = {'version_id_col': version}
+    
+    def __repr__(self):
+        return f"<AppointmentSeries(id={self.id}, patient_id={self.patient_id}, rule={self.rule})>"
+
+class MedicalRecord(SoftDelete, Base):
+    __tablename__ = 'medical_records'
+    
+    id = Column(Integer, primary_key=True)
+    patient_id = Column(Integer, ForeignKey('patients.id'), nullable=False, index=True)
+    staff_id = Column(Integer, ForeignKey('staff.id'), nullable=False)
+    diagnosis = Column(EncryptedString(blind_index='diagnosis_index'), nullable=False)
+    treatment = Column(EncryptedString())
     admission_date = Column(Date)
     discharge_date = Column(Date)
     duration_of_stay = Column(Integer)  
     medications = Column(String(500))
-    notes = Column(String(1000))
+    notes = Column(EncryptedString())
+    # Blind index of diagnosis: reports group on it
+    diagnosis_index = Column(String(32), index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    version = Column(Integer, nullable=False, server_default='1')
     
     # Relationships between different tables 
     patient = relationship("Patient", back_populates="medical_records")
     staff = relationship("Staff", back_populates="medical_records")
+    prescriptions = relationship("Prescription", back_populates="record", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        tombstone_index('medical_records'),
+    )
+    __mapper_args__ = {'version_id_col': version}
     
     def __repr__(self):
         return f"<MedicalRecord(id={self.id}, patient_id={self.patient_id}, diagnosis={self.diagnosis})>"
 
-class Bill(Base):
+class Prescription(Base):
+    __tablename__ = 'prescriptions'
+    
+    id = Column(Integer, primary_key=True)
+    record_id = Column(Integer, ForeignKey('medical_records.id'), nullable=False, index=True)
+    drug = Column(String(100), nullable=False, index=True)  # normalized lower-case name
+    dose = Column(String(50))
+    frequency = Column(String(50))
+    start_date = Column(Date)
+    end_date = Column(Date)
+    
+    # Relationships between different tables 
+    record = relationship("MedicalRecord", back_populates="prescriptions")
+    
+    def __repr__(self):
+        return f"<Prescription(id={self.id}, record_id={self.record_id}, drug={self.drug})>"
+
+class Bill(SoftDelete, Base):
     __tablename__ = 'bills'
     
     id = Column(Integer, primary_key=True)
     patient_id = Column(Integer, ForeignKey('patients.id'), nullable=False)
-    amount = Column(Float, nullable=False)
-    date_issued = Column(Date, default=datetime.utcnow)
+    amount = Column(Cents, nullable=False)
+    date_issued = Column(Date, default=datetime.utcnow, index=True)
     due_date = Column(Date)
-    status = Column(String(20), default="Unpaid")  
+    status = Column(IntEnumType(BillStatus), nullable=False, default=BillStatus.UNPAID)
     description = Column(String(500))
+    version = Column(Integer, nullable=False, server_default='1')
     
     # Relationships between different tables 
     patient = relationship("Patient", back_populates="bills")
     
+    __table_args__ = (
+        CheckConstraint(BillStatus.check_sql(), name='ck_bills_status'),
+        Index('ix_bills_unpaid_due_date', 'due_date', sqlite_where=text(f'status = {int(BillStatus.UNPAID)} AND {LIVE}')),
+        Index('ix_bills_outstanding_patient', 'patient_id', 'due_date',
+              sqlite_where=text(f"status IN ({', '.join(str(int(status)) for status in OUTSTANDING_BILL_STATUSES)}) AND {LIVE}")),
+        tombstone_index('bills'),
+    )
+    
+    __mapper_args__ = {'version_id_col': version}
+    
     def __repr__(self):
-        return f"<Bill(id={self.id}, patient_id={self.patient_id}, amount={self.amount}, status={self.status})>"
\ No newline at end of file
+        return f"<Bill(id={self.id}, patient_id={self.patient_id}, amount={self.amount}, status={self.status})>"
+
+class StatCounter(Base):
+    __tablename__ = 'stat_counters'
+    
+    id = Column(Integer, primary_key=True)
+    metric = Column(String(50), nullable=False)  # patients, staff, appointments, active_admissions, bills
+    # Key columns use '' instead of NULL so the unique constraint holds for "all" buckets
+    day = Column(String(10), nullable=False, default='')
+    department = Column(String(50), nullable=False, default='')
+    status = Column(String(20), nullable=False, default='')
+    count = Column(Integer, nullable=False, default=0)
+    total = Column(Cents, nullable=False, default=0)
+    
+    __table_args__ = (
+        UniqueConstraint('metric', 'day', 'department', 'status', name='uq_stat_counters_key'),
+    )
+    
+    def __repr__(self):
+        return f"<StatCounter(metric={self.metric}, day={self.day}, department={self.department}, status={self.status}, count={self.count})>"
+
+class DataMigrationState(Base):
+    __tablename__ = 'data_migrations'
+    
+    name = Column(String(100), primary_key=True)
+    last_id = Column(Integer, nullable=False, default=0)  # highest id already processed
+    processed = Column(Integer, nullable=False, default=0)
+    started_at = Column(DateTime, default=datetime.utcnow)
+    completed_at = Column(DateTime)
+    
+    def __repr__(self):
+        return f"<DataMigrationState(name={self.name}, last_id={self.last_id}, completed_at={self.completed_at})>"
+
+class OutboxMessage(Base):
+    __tablename__ = 'outbox'
+    
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(30), nullable=False)  # appointment_reminder, bill_overdue
+    # One message per event, e.g. 'appointment_reminder:12:2025-10-20T09:00:00'
+    dedupe_key = Column(String(100), nullable=False, unique=True)
+    patient_id = Column(Integer, ForeignKey('patients.id'), nullable=False)
+    recipient = Column(EncryptedString(), nullable=False)
+    subject = Column(String(200), nullable=False)
+    body = Column(String(1000), nullable=False)
+    status = Column(IntEnumType(OutboxStatus), nullable=False, default=OutboxStatus.PENDING)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(String(500))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime)
+    
+    __table_args__ = (
+        CheckConstraint(OutboxStatus.check_sql(), name='ck_outbox_status'),
+        Index('ix_outbox_pending', 'id', sqlite_where=text(f'status = {int(OutboxStatus.PENDING)}')),
+    )
+    
+    def __repr__(self):
+        return f"<OutboxMessage(id={self.id}, kind={self.kind}, recipient={self.recipient}, status={self.status})>"
+
+# Models with encrypted columns, whose blind indexes the ORM keeps current
+# (Core inserts and updates must fill them with encryption.blind_index)
+ENCRYPTED_MODELS = (Patient, MedicalRecord)
+BLIND_INDEXES = {model: blind_indexed(model) for model in ENCRYPTED_MODELS}
+for model in ENCRYPTED_MODELS:
+    event.listen(model, 'before_insert', _fill_blind_indexes)
+    event.listen(model, 'before_update', _fill_blind_indexes)
@@ -0,0 +1,237 @@
+import argparse
+import csv
+import math
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from itertools import repeat
+
+# Add the parent directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, select, func, DateTime
+from app.database import database_path
+from app.facilities import MAIN_FACILITY, current_facility, set_facility
+from app.models import Appointment, Bill, MedicalRecord, Patient, Staff
+
+# Heavy reports are split into shards (date ranges or patient id ranges) that
+# run in a process pool, each worker on its own read-only SQLite connection,
+# so they never share the CLI's session. Shards return partial aggregates
+# that merge with sum/min/max, which is why the length-of-stay report gives
+# averages and extremes rather than percentiles.
+
+REPORTS_DIR = 'reports'
+
+def reports_directory(facility=None):
+    # The main facility's reports stay in reports/, the others get reports/<code>/
+    facility = facility or current_facility()
+    return REPORTS_DIR if facility == MAIN_FACILITY else os.path.join(REPORTS_DIR, facility)
+
+_engines = {}
+
+def read_only_engine(database):
+    # mode=ro makes SQLite refuse writes; one engine per process and file
+    key = (os.getpid(), database)
+    if key not in _engines:
+        _engines[key] = create_engine(f'sqlite:///file:{os.path.abspath(database)}?mode=ro&uri=true')
+    return _engines[key]
+
+class Report:
+    def __init__(self, name, title, headers, shard_by, query, merge, finish):
+        self.name = name
+        self.title = title
+        self.headers = headers
+        self.shard_by = shard_by    # a date column, or Patient.id for id ranges
+        self.query = query          # query(low, high) -> select of (*key, *values)
+        self.merge = merge          # how each value combines: 'sum', 'min' or 'max'
+        self.finish = finish        # finish(key, values) -> output row
+
+REPORTS = {}
+
+def register(report):
+    REPORTS[report.name] = report
+    return report
+
+def _as_bound(day, midnight=True):
+    # Date shards are half-open [low, high); DateTime columns compare at midnight
+    return datetime.combine(day, datetime.min.time()) if midnight else day
+
+def _monthly_billing(low, high):
+    month = func.strftime('%Y-%m', Bill.date_issued)
+    return select(month, Bill.status, func.count(Bill.id), func.sum(Bill.amount)).where(
+        Bill.date_issued >= low, Bill.date_issued < high, Bill.deleted_at.is_(None)
+    ).group_by(month, Bill.status)
+
+def _department_appointments(low, high):
+    low, high = _as_bound(low), _as_bound(high)
+    month = func.strftime('%Y-%m', Appointment.appointment_date)
+    return select(month, Staff.department, Appointment.status, func.count(Appointment.id)).join(
+        Staff, Appointment.staff_id == Staff.id
+    ).where(
+        # Appointments of deleted staff still count under their department
+        Appointment.appointment_date >= low, Appointment.appointment_date < high,
+        Appointment.deleted_at.is_(None)
+    ).group_by(month, Staff.department, Appointment.status)
+
+def _length_of_stay(low, high):
+    stay = func.julianday(MedicalRecord.discharge_date) - func.julianday(MedicalRecord.admission_date)
+    # Grouped on the diagnosis' blind index, since the text is encrypted (see AnalyticsService.length_of_stay)
+    return select(
+        func.min(MedicalRecord.diagnosis), func.count(MedicalRecord.id), func.sum(stay), func.min(stay), func.max(stay)
+    ).where(
+        MedicalRecord.patient_id >= low, MedicalRecord.patient_id < high,
+        MedicalRecord.admission_date.isnot(None),
+        MedicalRecord.discharge_date.isnot(None),
+        MedicalRecord.deleted_at.is_(None)
+    ).group_by(func.coalesce(MedicalRecord.diagnosis_index, MedicalRecord.diagnosis))
+
+register(Report(
+    'monthly_billing', 'Monthly Billing',
+    ["Month", "Status", "Bills", "Amount"],
+    Bill.date_issued, _monthly_billing, ('sum', 'sum'),
+    lambda key, values: [key[0], key[1].label, values[0], values[1]]
+))
+register(Report(
+    'department_appointments', 'Appointments per Department',
+    ["Month", "Department", "Status", "Appointments"],
+    Appointment.appointment_date, _department_appointments, ('sum',),
+    lambda key, values: [key[0], key[1], key[2].label, values[0]]
+))
+register(Report(
+    'length_of_stay', 'Length of Stay by Diagnosis',
+    ["Diagnosis", "Stays", "Average Days", "Shortest", "Longest"],
+    Patient.id, _length_of_stay, ('sum', 'sum', 'min', 'max'),
+    lambda key, values: [key[0], values[0], round(values[1] / values[0], 1), values[2], values[3]]
+))
+
+def plan_shards(database, report, count, start_date=None, end_date=None):
+    #Split the report's date or id range into `count` contiguous half-open shards
+    column = report.shard_by
+    query = select(func.min(column), func.max(column))
+    if column is not Patient.id:
+        # The range is narrowed here; the shards then only cover the requested days
+        midnight = isinstance(column.type, DateTime)
+        if start_date:
+            query = query.where(column >= _as_bound(start_date, midnight))
+        if end_date:
+            query = query.where(column < _as_bound(end_date + timedelta(days=1), midnight))
+    with read_only_engine(database).connect() as connection:
+        low, high = connection.execute(query).one()
+    if low is None:
+        return []
+
+    if column is Patient.id:
+        step = math.ceil((high - low + 1) / count)
+        return [(start, min(start + step, high + 1)) for start in range(low, high + 1, step)]
+
+    low = low.date() if isinstance(low, datetime) else low
+    high = (high.date() if isinstance(high, datetime) else high) + timedelta(days=1)
+    step = max(1, math.ceil((high - low).days / count))
+    shards = []
+    while low < high:
+        shards.append((low, min(low + timedelta(days=step), high)))
+        low += timedelta(days=step)
+    return shards
+
+def run_shard(name, database, shard):
+    #Worker: aggregate one shard on this process's read-only connection
+    with read_only_engine(database).connect() as connection:
+        return [tuple(row) for row in connection.execute(REPORTS[name].query(*shard))]
+
+def merge(report, partials):
+    #Combine partial rows from all shards by key
+    size = len(report.merge)
+    merged = {}
+    for rows in partials:
+        for row in rows:
+            key, values = row[:-size], row[-size:]
+            if key not in merged:
+                merged[key] = list(values)
+                continue
+            current = merged[key]
+            for i, (how, value) in enumerate(zip(report.merge, values)):
+                if how == 'sum':
+                    current[i] += value
+                elif how == 'min':
+                    current[i] = min(current[i], value)
+                else:
+                    current[i] = max(current[i], value)
+    return [report.finish(key, values)
+            for key, values in sorted(merged.items(), key=lambda item: [str(part) for part in item[0]])]
+
+def run_report(name, workers=None, database=None, start_date=None, end_date=None, shards_per_worker=2):
+    #Run a report across a process pool; workers=1 runs the shards in this process
+    report = REPORTS[name]
+    database = database or database_path()
+    workers = workers or os.cpu_count() or 1
+    shards = plan_shards(database, report, workers * shards_per_worker, start_date, end_date)
+
+    if workers == 1 or len(shards) <= 1:
+        partials = [run_shard(name, database, shard) for shard in shards]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            partials = list(pool.map(run_shard, repeat(name), repeat(database), shards))
+    return merge(report, partials)
+
+def write_report(report, rows, path):
+    #Write report rows to a CSV file
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    # Written beside the target and renamed, so a CSV that exists is complete
+    partial = path + '.part'
+    with open(partial, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(report.headers)
+        writer.writerows(rows)
+    os.replace(partial, path)
+
+def report_path(name, directory=None):
+    directory = directory or reports_directory()
+    return os.path.join(directory, f"{name}_{datetime.now():%Y%m%d_%H%M%S}.csv")
+
+def start_background_report(name, workers=None, start_date=None, end_date=None, directory=None):
+    #Launch the runner as a detached process for the current facility; returns (process, output path, log path)
+    directory = directory or reports_directory()
+    output = report_path(name, directory)
+    log_path = output[:-len('.csv')] + '.log'
+    os.makedirs(directory, exist_ok=True)
+
+    command = [sys.executable, '-m', 'app.report_runner', name, '--output', output, '--facility', current_facility()]
+    if workers:
+        command += ['--workers', str(workers)]
+    if start_date:
+        command += ['--start', start_date.isoformat()]
+    if end_date:
+        command += ['--end', end_date.isoformat()]
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')])))
+    with open(log_path, 'w') as log:
+        process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                                   env=env, start_new_session=True)
+    return process, output, log_path
+
+def main():
+    # Command line entry point: python -m app.report_runner
+    parser = argparse.ArgumentParser(description='Generate reports with a process pool')
+    parser.add_argument('report', choices=list(REPORTS))
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--start', type=date.fromisoformat, help='first day, for date-sharded reports')
+    parser.add_argument('--end', type=date.fromisoformat, help='last day, for date-sharded reports')
+    parser.add_argument('--facility', help='facility code (default: HOSPITAL_FACILITY or main)')
+    parser.add_argument('--database', help="SQLite file (default: the facility's database)")
+    parser.add_argument('--output', help='CSV path (default: reports/<report>_<timestamp>.csv)')
+    args = parser.parse_args()
+    if args.facility:
+        set_facility(args.facility)
+
+    started = time.perf_counter()
+    rows = run_report(args.report, args.workers, args.database, args.start, args.end)
+    output = args.output or report_path(args.report)
+    write_report(REPORTS[args.report], rows, output)
+    print(f"{args.report}: {len(rows)} rows in {time.perf_counter() - started:.1f}s -> {output}")
+
+if __name__ == "__main__":
+    main()
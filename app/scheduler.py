@@ -0,0 +1,190 @@
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import signal
+import sys
+import time
+from datetime import datetime
+
+# Add the parent directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.audit import set_actor
+from app.facilities import current_facility, set_facility
+from app.data_migrations import reencrypt
+from app.database import SessionLocal, facility_engine, init_db
+from app.services.billing_service import BillingService
+from app.services.notification_service import NotificationService
+from app.services.trash_service import TrashService
+
+# Time-driven jobs, run as their own process: python -m app.scheduler
+#   overdue    - unpaid bills past their due date become Overdue, with a notice
+#   reminders  - a reminder for each scheduled appointment in the next 24 hours
+#   delivery   - pending outbox messages are handed to the delivery backend
+#   purge      - soft-deleted rows older than 30 days are removed in batches
+#   rekey      - after a key rotation, values under an older encryption key
+#                are re-encrypted with the current one in batches
+# Each job runs its (blocking) database work in a worker thread with its own
+# session, so the event loop keeps timing the other jobs and handles signals.
+
+DELIVERY_LOG = os.path.join('outbox', 'delivered.log')
+
+class LocalDelivery:
+    # Delivery stub: appends each message as a JSON line to a local file
+
+    def __init__(self, path=DELIVERY_LOG):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def __call__(self, message):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps({
+                'facility': current_facility(), 'id': message.id, 'kind': message.kind, 'to': message.recipient,
+                'subject': message.subject, 'body': message.body,
+                'delivered_at': datetime.now().isoformat(timespec='seconds')
+            }) + '\n')
+
+class JobMetrics:
+    def __init__(self, name):
+        self.name = name
+        self.runs = 0
+        self.items = 0
+        self.seconds = 0.0
+        self.errors = 0
+        self.last_run = None
+
+    def record(self, items, seconds):
+        self.runs += 1
+        self.items += items
+        self.seconds += seconds
+        self.last_run = datetime.now()
+
+    def summary(self):
+        rate = self.items / self.seconds if self.seconds else 0
+        return (f"{self.name:<10} runs={self.runs} items={self.items} errors={self.errors} "
+                f"busy={self.seconds:.2f}s rate={rate:,.0f}/s")
+
+def mark_overdue():
+    with SessionLocal() as db:
+        return BillingService.mark_overdue_bills(db, on_batch=NotificationService.queue_overdue_notices)
+
+def queue_reminders():
+    with SessionLocal() as db:
+        return NotificationService.queue_appointment_reminders(db)
+
+def purge_deleted():
+    with SessionLocal() as db:
+        return sum(TrashService.purge(db).values())
+
+def rekey():
+    # Nothing to do (one counting query per column) unless the current key changed
+    return reencrypt(facility_engine(), progress=lambda message: None)
+
+def deliver(backend, batch_size=500):
+    # Failed messages stay pending and are retried on the next run
+    with SessionLocal() as db:
+        sent, failed = NotificationService.deliver_pending(db, backend, batch_size)
+        return sent
+
+class Scheduler:
+    def __init__(self, intervals, backend=None):
+        backend = backend or LocalDelivery()
+        self.jobs = {
+            'overdue': (mark_overdue, intervals['overdue']),
+            'reminders': (queue_reminders, intervals['reminders']),
+            'delivery': (lambda: deliver(backend), intervals['delivery']),
+            'purge': (purge_deleted, intervals['purge']),
+            'rekey': (rekey, intervals['rekey']),
+        }
+        self.metrics = {name: JobMetrics(name) for name in self.jobs}
+        self.stopping = asyncio.Event()
+
+    async def run_job(self, name):
+        #Run one job in a worker thread and record its throughput
+        function, _ = self.jobs[name]
+        metrics = self.metrics[name]
+        started = time.perf_counter()
+        try:
+            # run_in_executor rather than asyncio.to_thread (3.9+); the copied context carries the
+            # facility and audit actor into the worker thread, as to_thread would
+            context = contextvars.copy_context()
+            items = await asyncio.get_running_loop().run_in_executor(None, context.run, function)
+        except Exception as e:
+            metrics.errors += 1
+            print(f"[{datetime.now():%H:%M:%S}] {name} failed: {e}", flush=True)
+            return
+        seconds = time.perf_counter() - started
+        metrics.record(items, seconds)
+        if items:
+            print(f"[{datetime.now():%H:%M:%S}] {name}: {items} in {seconds:.2f}s", flush=True)
+
+    async def every(self, name):
+        _, interval = self.jobs[name]
+        while not self.stopping.is_set():
+            await self.run_job(name)
+            try:
+                await asyncio.wait_for(self.stopping.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def report(self, interval):
+        while not self.stopping.is_set():
+            try:
+                await asyncio.wait_for(self.stopping.wait(), interval)
+            except asyncio.TimeoutError:
+                self.print_metrics()
+
+    def print_metrics(self):
+        print(f"[{datetime.now():%H:%M:%S}] metrics", flush=True)
+        for metrics in self.metrics.values():
+            print(f"  {metrics.summary()}", flush=True)
+
+    async def run(self, metrics_interval=60):
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self.stopping.set)
+        await asyncio.gather(*(self.every(name) for name in self.jobs), self.report(metrics_interval))
+        self.print_metrics()
+
+    async def run_once(self):
+        # Overdue notices and reminders are queued before delivery runs
+        for name in self.jobs:
+            await self.run_job(name)
+        self.print_metrics()
+
+def main():
+    # Command line entry point: python -m app.scheduler
+    parser = argparse.ArgumentParser(description='Run the overdue-bill and reminder jobs')
+    parser.add_argument('--once', action='store_true', help='run every job once and exit')
+    parser.add_argument('--overdue-interval', type=float, default=300, help='seconds between overdue checks')
+    parser.add_argument('--reminder-interval', type=float, default=300, help='seconds between reminder checks')
+    parser.add_argument('--delivery-interval', type=float, default=10, help='seconds between outbox deliveries')
+    parser.add_argument('--purge-interval', type=float, default=86400, help='seconds between purges of deleted rows')
+    parser.add_argument('--rekey-interval', type=float, default=3600,
+                        help='seconds between checks for values under an old encryption key')
+    parser.add_argument('--metrics-interval', type=float, default=60)
+    parser.add_argument('--facility', help='facility code (default: HOSPITAL_FACILITY or main); run one scheduler per facility')
+    args = parser.parse_args()
+
+    if args.facility:
+        set_facility(args.facility)
+    init_db()
+    # Job threads inherit this context, so their changes are audited as the scheduler
+    set_actor('scheduler')
+    scheduler = Scheduler({
+        'overdue': args.overdue_interval,
+        'reminders': args.reminder_interval,
+        'delivery': args.delivery_interval,
+        'purge': args.purge_interval,
+        'rekey': args.rekey_interval,
+    })
+    if args.once:
+        asyncio.run(scheduler.run_once())
+    else:
+        print("Scheduler running; press Ctrl+C to stop.", flush=True)
+        asyncio.run(scheduler.run(args.metrics_interval))
+
+if __name__ == "__main__":
+    main()
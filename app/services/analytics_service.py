@@ -0,0 +1,136 @@
+from sqlalchemy import select, func, case, literal, union_all, and_, or_
+from sqlalchemy.orm import Session
+from app.models import MedicalRecord, Staff
+from datetime import date, timedelta
+
+class AnalyticsService:
+    # All aggregation happens in SQLite (window functions need SQLite 3.25+);
+    # Python only walks the per-day or per-group results.
+
+    @staticmethod
+    def daily_census(db: Session, start_date: date, end_date: date, bed_capacity: int = None):
+        #Inpatient count at the end of each day in the range, with occupancy if capacity is given
+        # A record occupies a bed from admission_date until the day before discharge_date
+        relevant = and_(
+            MedicalRecord.admission_date.isnot(None),
+            MedicalRecord.admission_date <= end_date,
+            or_(MedicalRecord.discharge_date.is_(None), MedicalRecord.discharge_date > start_date)
+        )
+        admissions = select(
+            MedicalRecord.admission_date.label('day'), literal(1).label('delta')
+        ).where(relevant)
+        discharges = select(
+            MedicalRecord.discharge_date.label('day'), literal(-1).label('delta')
+        ).where(relevant, MedicalRecord.discharge_date.isnot(None), MedicalRecord.discharge_date <= end_date)
+        events = union_all(admissions, discharges).subquery()
+
+        daily = select(events.c.day, func.sum(events.c.delta).label('delta')).group_by(events.c.day).subquery()
+        running = select(
+            daily.c.day,
+            func.sum(daily.c.delta).over(order_by=daily.c.day).label('census')
+        ).order_by(daily.c.day)
+
+        changes = [(day if isinstance(day, date) else date.fromisoformat(day), census)
+                   for day, census in db.execute(running)]
+
+        results = []
+        census = 0
+        index = 0
+        day = start_date
+        while day <= end_date:
+            while index < len(changes) and changes[index][0] <= day:
+                census = changes[index][1]
+                index += 1
+            occupancy = round(census / bed_capacity * 100, 1) if bed_capacity else None
+            results.append({'day': day, 'census': census, 'occupancy': occupancy})
+            day += timedelta(days=1)
+        return results
+
+    @staticmethod
+    def length_of_stay(db: Session, group_by: str = 'diagnosis', percentiles=(50, 90)):
+        #Average and nearest-rank percentile length of stay per diagnosis or attending staff
+        if group_by == 'diagnosis':
+            # Diagnoses are encrypted: records group on the blind index (the text itself for rows
+            # the encryption data migration has not reached yet) and one of them names the group
+            key = func.coalesce(MedicalRecord.diagnosis_index, MedicalRecord.diagnosis)
+            name = MedicalRecord.diagnosis
+        elif group_by == 'staff':
+            key = name = MedicalRecord.staff_id
+        else:
+            raise ValueError("group_by must be 'diagnosis' or 'staff'")
+
+        stay = (func.julianday(MedicalRecord.discharge_date) - func.julianday(MedicalRecord.admission_date))
+        ranked = select(
+            key.label('key'),
+            name.label('name'),
+            stay.label('stay'),
+            func.row_number().over(partition_by=key, order_by=stay).label('rn'),
+            func.count().over(partition_by=key).label('cnt')
+        ).where(
+            MedicalRecord.admission_date.isnot(None),
+            MedicalRecord.discharge_date.isnot(None)
+        ).subquery()
+
+        # Nearest rank: ceil(p * n / 100) using integer arithmetic
+        percentile_columns = [
+            func.max(case(
+                (ranked.c.rn == (ranked.c.cnt * p + 99) // 100, ranked.c.stay)
+            )).label(f'p{p}')
+            for p in percentiles
+        ]
+        query = select(
+            func.min(ranked.c.name).label('key'),
+            func.count().label('records'),
+            func.avg(ranked.c.stay).label('average'),
+            *percentile_columns
+        ).group_by(ranked.c.key)
+
+        results = []
+        for row in db.execute(query):
+            entry = {
+                'key': row.key,
+                'records': row.records,
+                'average': round(row.average, 1)
+            }
+            for p in percentiles:
+                entry[f'p{p}'] = getattr(row, f'p{p}')
+            results.append(entry)
+        results.sort(key=lambda entry: entry['key'])
+
+        if group_by == 'staff' and results:
+            # Deleted staff keep their name in historical figures
+            names = dict(db.execute(
+                select(Staff.id, Staff.first_name + ' ' + Staff.last_name).where(
+                    Staff.id.in_([entry['key'] for entry in results])
+                ).execution_options(include_deleted=True)
+            ).all())
+            for entry in results:
+                entry['name'] = names.get(entry['key'])
+        return results
+
+    @staticmethod
+    def readmission_rate(db: Session, days: int = 30, start_date: date = None, end_date: date = None):
+        #Share of discharges followed by another admission of the same patient within `days`
+        next_admission = func.lead(MedicalRecord.admission_date).over(
+            partition_by=MedicalRecord.patient_id,
+            order_by=(MedicalRecord.admission_date, MedicalRecord.id)
+        )
+        stays = select(
+            MedicalRecord.discharge_date.label('discharge_date'),
+            next_admission.label('next_admission')
+        ).where(MedicalRecord.admission_date.isnot(None)).subquery()
+
+        gap = func.julianday(stays.c.next_admission) - func.julianday(stays.c.discharge_date)
+        readmitted = case((and_(stays.c.next_admission.isnot(None), gap >= 0, gap <= days), 1), else_=0)
+        query = select(
+            func.count().label('discharges'),
+            func.coalesce(func.sum(readmitted), 0).label('readmissions')
+        ).where(stays.c.discharge_date.isnot(None))
+        if start_date:
+            query = query.where(stays.c.discharge_date >= start_date)
+        if end_date:
+            query = query.where(stays.c.discharge_date <= end_date)
+
+        row = db.execute(query).one()
+        rate = round(row.readmissions / row.discharges * 100, 1) if row.discharges else 0.0
+        return {'days': days, 'discharges': row.discharges, 'readmissions': row.readmissions, 'rate': rate}
@@ -1,6 +1,37 @@
+from typing import NamedTuple
+from calendar import timegm
+from sqlalchemy import bindparam, and_, func, or_, select, Integer
 from sqlalchemy.orm import Session
-from app.models import Appointment
-from app.validators import validate_datetime
+from dateutil.rrule import rrulestr
+from app.models import (Appointment, AppointmentSeries, AppointmentStatus, Patient, status_equals, get_live, get_many,
+                        live_columns, read_rows, DEFAULT_APPOINTMENT_MINUTES)
+from app.validators import validate_datetime, validate_duration, validate_appointment_status, validate_version, commit_or_conflict
+from app.services.stats_service import StatsService
+from datetime import datetime, timedelta
+
+# Hot lookups are built once at import; a call only binds its parameters and the
+# compiled SQL comes from the engine's statement cache (STATEMENT_CACHE_SIZE)
+APPOINTMENTS_BY_PATIENT = select(Appointment).where(Appointment.patient_id == bindparam('patient_id'))
+APPOINTMENTS_BY_STAFF = select(Appointment).where(Appointment.staff_id == bindparam('staff_id'))
+PATIENT_ID_BY_ID = select(Patient.id).where(Patient.id == bindparam('id'))
+
+class AppointmentRow(NamedTuple):
+    # An appointment as the listings show one
+    id: int
+    patient_id: int
+    staff_id: int
+    appointment_date: datetime
+    purpose: str
+    status: AppointmentStatus
+
+APPOINTMENT_ROWS = live_columns(Appointment, AppointmentRow)
+
+# Upper bound on occurrences generated for one series, so open-ended rules stay finite
+MAX_SERIES_OCCURRENCES = 366
+
+# Longest appointment validate_duration allows; an appointment overlapping a
+# time can begin up to this long before it
+LONGEST_APPOINTMENT = timedelta(minutes=480)
 
 class AppointmentService:
     @staticmethod
@@ -14,65 +45,294 @@ class AppointmentService:
             patient_id=appointment_data['patient_id'],
             staff_id=appointment_data['staff_id'],
             appointment_date=appointment_date,
+            duration_minutes=validate_duration(appointment_data.get('duration_minutes') or DEFAULT_APPOINTMENT_MINUTES),
             purpose=appointment_data.get('purpose', ''),
-            status=appointment_data.get('status', 'Scheduled')
+            status=validate_appointment_status(appointment_data.get('status') or AppointmentStatus.SCHEDULED)
         )
+        AppointmentService.check_overlaps(db, appointment)
         
         # Add to database
         db.add(appointment)
+        StatsService.track_appointment(db, appointment, 1)
         db.commit()
         db.refresh(appointment)
         return appointment
 
     @staticmethod
-    def get_appointment(db: Session, appointment_id: int):
+    def get_appointment(db: Session, appointment_id: int, include_deleted: bool = False):
         #Get appointment by ID
-        return db.query(Appointment).filter(Appointment.id == appointment_id).first()
+        return get_live(db, Appointment, appointment_id, include_deleted)
+
+    @staticmethod
+    def get_many(db: Session, appointment_ids, include_deleted: bool = False):
+        #Get several appointments by ID in the given order, with one query for those not already loaded
+        return get_many(db, Appointment, appointment_ids, include_deleted)
 
     @staticmethod
     def get_all_appointments(db: Session):
         #Get all appointments
         return db.query(Appointment).all()
 
+    @staticmethod
+    def get_open_appointments(db: Session, from_date: datetime = None):
+        #Get scheduled appointments from a date onwards (default: now), served by the partial index
+        return db.query(Appointment).filter(
+            status_equals(Appointment.status, AppointmentStatus.SCHEDULED),
+            Appointment.appointment_date >= (from_date or datetime.now())
+        ).order_by(Appointment.appointment_date).all()
+
     @staticmethod
     def get_patient_appointments(db: Session, patient_id: int):
         #Get all appointments for a specific patient
-        return db.query(Appointment).filter(Appointment.patient_id == patient_id).all()
+        return db.execute(APPOINTMENTS_BY_PATIENT, {'patient_id': patient_id}).scalars().all()
 
     @staticmethod
     def get_staff_appointments(db: Session, staff_id: int):
         #Get all appointments for a specific staff member
-        return db.query(Appointment).filter(Appointment.staff_id == staff_id).all()
+        return db.execute(APPOINTMENTS_BY_STAFF, {'staff_id': staff_id}).scalars().all()
+
+    @staticmethod
+    def list_appointments(db: Session, patient_id: int = None, staff_id: int = None):
+        #Appointments as AppointmentRow tuples, for listings; all of them or one patient's or staff member's
+        statement = APPOINTMENT_ROWS
+        if patient_id is not None:
+            statement = statement.where(Appointment.patient_id == patient_id)
+        if staff_id is not None:
+            statement = statement.where(Appointment.staff_id == staff_id)
+        return read_rows(db, Appointment, AppointmentRow, statement)
 
     @staticmethod
-    def update_appointment(db: Session, appointment_id: int, update_data: dict):
-        #Update appointment information
-        appointment = db.query(Appointment).filter(Appointment.id == appointment_id).first()
+    def update_appointment(db: Session, appointment_id: int, update_data: dict, expected_version: int = None):
+        #Update appointment information; expected_version is the version the caller read
+        appointment = get_live(db, Appointment, appointment_id)
         if not appointment:
             return None
+        validate_version(appointment, expected_version, f"Appointment {appointment_id}")
+        
+        # Move the appointment out of its old counter bucket before changing it
+        StatsService.track_appointment(db, appointment, -1)
         
         # Update fields
         if 'appointment_date' in update_data:
             appointment.appointment_date = validate_datetime(update_data['appointment_date'])
+        if 'duration_minutes' in update_data:
+            appointment.duration_minutes = validate_duration(update_data['duration_minutes'])
         if 'purpose' in update_data:
             appointment.purpose = update_data['purpose']
         if 'status' in update_data:
-            appointment.status = update_data['status']
+            appointment.status = validate_appointment_status(update_data['status'])
         if 'patient_id' in update_data:
             appointment.patient_id = update_data['patient_id']
         if 'staff_id' in update_data:
             appointment.staff_id = update_data['staff_id']
+        if update_data.keys() & {'appointment_date', 'duration_minutes', 'status', 'patient_id', 'staff_id'}:
+            AppointmentService.check_overlaps(db, appointment)
         
-        db.commit()
+        StatsService.track_appointment(db, appointment, 1)
+        commit_or_conflict(db, f"Appointment {appointment_id}")
         db.refresh(appointment)
         return appointment
 
+    @staticmethod
+    def check_overlaps(db: Session, appointment: Appointment):
+        #Reject an appointment (not cancelled) overlapping another of its staff member or patient
+        if appointment.status == AppointmentStatus.CANCELLED:
+            return
+        conflicts = AppointmentService.find_conflicts(
+            db, [appointment.appointment_date], staff_id=appointment.staff_id, patient_id=appointment.patient_id,
+            duration=appointment.duration_minutes, exclude_id=appointment.id
+        )
+        if conflicts:
+            times = ', '.join(f"{a.appointment_date:%Y-%m-%d %H:%M} ({a.duration_minutes} min)" for a in conflicts)
+            raise ValueError(f"Appointment overlaps existing appointments of the staff member or patient at: {times}")
+
     @staticmethod
     def delete_appointment(db: Session, appointment_id: int):
         #Delete an appointment
-        appointment = db.query(Appointment).filter(Appointment.id == appointment_id).first()
+        appointment = get_live(db, Appointment, appointment_id)
         if appointment:
-            db.delete(appointment)
-            db.commit()
+            StatsService.track_appointment(db, appointment, -1)
+            appointment.deleted_at = datetime.utcnow()
+            commit_or_conflict(db, f"Appointment {appointment_id}")
             return True
-        return False
\ No newline at end of file
+        return False
+
+    @staticmethod
+    def restore_appointment(db: Session, appointment_id: int):
+        #Undo delete_appointment
+        appointment = AppointmentService.get_appointment(db, appointment_id, include_deleted=True)
+        if not appointment or not appointment.deleted_at:
+            return None
+        if not db.execute(PATIENT_ID_BY_ID, {'id': appointment.patient_id}).first():
+            raise ValueError(f"Patient {appointment.patient_id} is deleted; restore the patient instead")
+        appointment.deleted_at = None
+        StatsService.track_appointment(db, appointment, 1)
+        commit_or_conflict(db, f"Appointment {appointment_id}")
+        db.refresh(appointment)
+        return appointment
+
+    @staticmethod
+    def expand_series(start: datetime, rule: str):
+        #Expand an RRULE (e.g. FREQ=WEEKLY;COUNT=12) into its occurrence datetimes
+        try:
+            recurrence = rrulestr(rule, dtstart=start)
+        except (ValueError, TypeError):
+            raise ValueError("Recurrence rule must be a valid RRULE, e.g. FREQ=WEEKLY;COUNT=12")
+        occurrences = []
+        for occurrence in recurrence:
+            if len(occurrences) == MAX_SERIES_OCCURRENCES:
+                raise ValueError(f"Recurrence rule produces more than {MAX_SERIES_OCCURRENCES} appointments; add COUNT or UNTIL")
+            occurrences.append(occurrence)
+        return occurrences
+
+    @staticmethod
+    def find_conflicts(db: Session, occurrences, staff_id=None, patient_id=None, exclude_series_id=None,
+                       duration: int = DEFAULT_APPOINTMENT_MINUTES, exclude_id: int = None, durations=None):
+        #Find appointments (not cancelled) of the staff member or patient overlapping any of the given times,
+        # each lasting duration minutes (or its own entry of durations), in one query
+        if not occurrences:
+            return []
+        spans = [(occurrence, occurrence + timedelta(minutes=minutes))
+                 for occurrence, minutes in zip(occurrences, durations or [duration] * len(occurrences))]
+        # Overlap is start < other end and other start < end; an appointment's end is worked out
+        # in epoch seconds by SQLite, as in SchedulingService.busy_intervals
+        finishes = func.cast(func.strftime('%s', Appointment.appointment_date), Integer) + Appointment.duration_minutes * 60
+        query = db.query(Appointment).filter(
+            # The date range keeps the read on the indexed start times
+            Appointment.appointment_date >= min(occurrences) - LONGEST_APPOINTMENT,
+            Appointment.appointment_date < max(end for _, end in spans),
+            or_(*(and_(Appointment.appointment_date < end, finishes > timegm(begin.timetuple()))
+                  for begin, end in spans)),
+            Appointment.deleted_at.is_(None),
+            ~status_equals(Appointment.status, AppointmentStatus.CANCELLED),
+            or_(Appointment.staff_id == staff_id, Appointment.patient_id == patient_id)
+        )
+        if exclude_series_id is not None:
+            query = query.filter(or_(Appointment.series_id.is_(None), Appointment.series_id != exclude_series_id))
+        if exclude_id is not None:
+            query = query.filter(Appointment.id != exclude_id)
+        return query.order_by(Appointment.appointment_date).all()
+
+    @staticmethod
+    def create_series(db: Session, series_data: dict):
+        #Create a recurring appointment series and all of its occurrences in one transaction
+        start = validate_datetime(series_data['start'])
+        rule = series_data['rule'].strip().upper()
+        occurrences = AppointmentService.expand_series(start, rule)
+        if not occurrences:
+            raise ValueError("Recurrence rule produces no appointments")
+        # Occurrences take the default length, so closer ones would overlap each other
+        if any(later - earlier < timedelta(minutes=DEFAULT_APPOINTMENT_MINUTES)
+               for earlier, later in zip(occurrences, occurrences[1:])):
+            raise ValueError(f"Recurrence rule puts appointments less than {DEFAULT_APPOINTMENT_MINUTES} minutes apart")
+        
+        conflicts = AppointmentService.find_conflicts(
+            db, occurrences, staff_id=series_data['staff_id'], patient_id=series_data['patient_id']
+        )
+        if conflicts:
+            times = ', '.join(a.appointment_date.strftime('%Y-%m-%d %H:%M') for a in conflicts)
+            raise ValueError(f"Series conflicts with existing appointments at: {times}")
+        
+        series = AppointmentSeries(
+            patient_id=series_data['patient_id'],
+            staff_id=series_data['staff_id'],
+            start=start,
+            rule=rule,
+            purpose=series_data.get('purpose', '')
+        )
+        appointments = [
+            Appointment(
+                patient_id=series_data['patient_id'],
+                staff_id=series_data['staff_id'],
+                appointment_date=occurrence,
+                purpose=series_data.get('purpose', ''),
+                status=AppointmentStatus.SCHEDULED,
+                series=series
+            )
+            for occurrence in occurrences
+        ]
+        
+        # Add to database
+        db.add(series)
+        db.add_all(appointments)
+        StatsService.track_appointments(db, appointments, 1)
+        db.commit()
+        db.refresh(series)
+        return series
+
+    @staticmethod
+    def get_series(db: Session, series_id: int):
+        #Get appointment series by ID
+        return get_live(db, AppointmentSeries, series_id)
+
+    @staticmethod
+    def get_series_appointments(db: Session, series_id: int, from_date: datetime = None, status: AppointmentStatus = None):
+        #Get the occurrences of a series, optionally only from a date onwards and with a status
+        query = db.query(Appointment).filter(Appointment.series_id == series_id)
+        if from_date:
+            query = query.filter(Appointment.appointment_date >= from_date)
+        if status is not None:
+            query = query.filter(Appointment.status == validate_appointment_status(status))
+        return query.order_by(Appointment.appointment_date).all()
+
+    @staticmethod
+    def update_series(db: Session, series_id: int, update_data: dict, from_date: datetime = None):
+        #Update the scheduled occurrences of a series from a date onwards (default: now)
+        series = AppointmentService.get_series(db, series_id)
+        if not series:
+            return None
+        
+        appointments = AppointmentService.get_series_appointments(db, series_id, from_date or datetime.now(), AppointmentStatus.SCHEDULED)
+        staff_id = update_data.get('staff_id', series.staff_id)
+        new_time = None
+        if update_data.get('time'):
+            try:
+                new_time = datetime.strptime(update_data['time'], '%H:%M').time()
+            except ValueError:
+                raise ValueError("Time must be in HH:MM format")
+        
+        new_dates = [datetime.combine(a.appointment_date.date(), new_time) if new_time else a.appointment_date
+                     for a in appointments]
+        if 'staff_id' in update_data or new_time:
+            conflicts = AppointmentService.find_conflicts(
+                db, new_dates, staff_id=staff_id, patient_id=series.patient_id, exclude_series_id=series_id,
+                durations=[a.duration_minutes for a in appointments]
+            )
+            if conflicts:
+                times = ', '.join(a.appointment_date.strftime('%Y-%m-%d %H:%M') for a in conflicts)
+                raise ValueError(f"Series conflicts with existing appointments at: {times}")
+        
+        StatsService.track_appointments(db, appointments, -1)
+        for appointment, new_date in zip(appointments, new_dates):
+            appointment.appointment_date = new_date
+            appointment.staff_id = staff_id
+            if 'purpose' in update_data:
+                appointment.purpose = update_data['purpose']
+        StatsService.track_appointments(db, appointments, 1)
+        
+        series.staff_id = staff_id
+        if new_time:
+            series.start = datetime.combine(series.start.date(), new_time)
+        if 'purpose' in update_data:
+            series.purpose = update_data['purpose']
+        
+        # Any occurrence edited elsewhere meanwhile fails the whole series update
+        commit_or_conflict(db, f"Series {series_id}")
+        db.refresh(series)
+        return series
+
+    @staticmethod
+    def cancel_series(db: Session, series_id: int, from_date: datetime = None):
+        #Cancel the scheduled occurrences of a series from a date onwards (default: now)
+        series = AppointmentService.get_series(db, series_id)
+        if not series:
+            return None
+        
+        appointments = AppointmentService.get_series_appointments(db, series_id, from_date or datetime.now(), AppointmentStatus.SCHEDULED)
+        StatsService.track_appointments(db, appointments, -1)
+        for appointment in appointments:
+            appointment.status = AppointmentStatus.CANCELLED
+        StatsService.track_appointments(db, appointments, 1)
+        
+        commit_or_conflict(db, f"Series {series_id}")
+        return len(appointments)
@@ -1,14 +1,34 @@
+from typing import NamedTuple
+from sqlalchemy import bindparam, func, select, update
 from sqlalchemy.orm import Session
-from app.models import Bill
-from app.validators import validate_date, validate_positive_number
-from datetime import date, timedelta
+from app.models import Bill, BillStatus, Patient, OUTSTANDING_BILL_STATUSES, status_equals, status_in, get_live, get_many, live_columns, read_rows
+from app.validators import validate_date, validate_amount, validate_bill_status, validate_version, commit_or_conflict
+from app.services.stats_service import StatsService
+from datetime import date, datetime
+from decimal import Decimal
+
+# Hot lookups are built once at import; a call only binds its parameters and the
+# compiled SQL comes from the engine's statement cache (STATEMENT_CACHE_SIZE)
+BILLS_BY_PATIENT = select(Bill).where(Bill.patient_id == bindparam('patient_id'))
+PATIENT_ID_BY_ID = select(Patient.id).where(Patient.id == bindparam('id'))
+
+class BillRow(NamedTuple):
+    # A bill as the listings show one
+    id: int
+    patient_id: int
+    amount: Decimal
+    date_issued: date
+    due_date: date
+    status: BillStatus
+
+BILL_ROWS = live_columns(Bill, BillRow)
 
 class BillingService:
     @staticmethod
     def create_bill(db: Session, bill_data: dict):
         #Create a new bill
         # Validate input data
-        amount = validate_positive_number(bill_data['amount'], "Amount")
+        amount = validate_amount(bill_data['amount'], "Amount")
         due_date = validate_date(bill_data['due_date']) if bill_data.get('due_date') else None
         
         # Create bill instance
@@ -17,19 +37,25 @@ class BillingService:
             amount=amount,
             due_date=due_date,
             description=bill_data.get('description', ''),
-            status=bill_data.get('status', 'Unpaid')
+            status=validate_bill_status(bill_data.get('status') or BillStatus.UNPAID)
         )
         
         # Add to database
         db.add(bill)
+        StatsService.track_bill(db, bill, 1)
         db.commit()
         db.refresh(bill)
         return bill
 
     @staticmethod
-    def get_bill(db: Session, bill_id: int):
+    def get_bill(db: Session, bill_id: int, include_deleted: bool = False):
         #Get bill by ID
-        return db.query(Bill).filter(Bill.id == bill_id).first()
+        return get_live(db, Bill, bill_id, include_deleted)
+
+    @staticmethod
+    def get_many(db: Session, bill_ids, include_deleted: bool = False):
+        #Get several bills by ID in the given order, with one query for those not already loaded
+        return get_many(db, Bill, bill_ids, include_deleted)
 
     @staticmethod
     def get_all_bills(db: Session):
@@ -39,41 +65,107 @@ class BillingService:
     @staticmethod
     def get_patient_bills(db: Session, patient_id: int):
         #Get all bills for a specific patient
-        return db.query(Bill).filter(Bill.patient_id == patient_id).all()
+        return db.execute(BILLS_BY_PATIENT, {'patient_id': patient_id}).scalars().all()
 
     @staticmethod
     def get_unpaid_bills(db: Session):
-        #Get all unpaid bills
-        return db.query(Bill).filter(Bill.status == 'Unpaid').all()
+        #Get all bills still to be paid, unpaid or overdue
+        return db.query(Bill).filter(status_in(Bill.status, OUTSTANDING_BILL_STATUSES)).all()
+
+    @staticmethod
+    def list_bills(db: Session, patient_id: int = None, status: BillStatus = None, statuses=None):
+        #Bills as BillRow tuples, for listings; all of them, or one patient's and/or those in one status
+        # or any of several (e.g. OUTSTANDING_BILL_STATUSES)
+        statement = BILL_ROWS
+        if patient_id is not None:
+            statement = statement.where(Bill.patient_id == patient_id)
+        if status is not None:
+            statement = statement.where(status_equals(Bill.status, status))
+        if statuses is not None:
+            statement = statement.where(status_in(Bill.status, statuses))
+        return read_rows(db, Bill, BillRow, statement)
+
+    @staticmethod
+    def mark_overdue_bills(db: Session, as_of: date = None, batch_size: int = 500, on_batch=None):
+        #Move unpaid bills due before as_of (default: today) to Overdue, one committed batch at a time
+        # Each batch is a single UPDATE ... RETURNING over the partial index on
+        # unpaid due dates, so a bill paid meanwhile is never counted twice.
+        as_of = as_of or date.today()
+        due = select(Bill.id).where(
+            status_equals(Bill.status, BillStatus.UNPAID), Bill.due_date < as_of, Bill.deleted_at.is_(None)
+        ).order_by(Bill.due_date).limit(batch_size)
+        marked = 0
+        while True:
+            rows = db.execute(
+                update(Bill).where(Bill.id.in_(due.scalar_subquery()), status_equals(Bill.status, BillStatus.UNPAID))
+                .values(status=BillStatus.OVERDUE, version=Bill.version + 1)
+                .returning(Bill.id, Bill.patient_id, Bill.amount, Bill.due_date)
+                .execution_options(synchronize_session=False)
+            ).all()
+            if not rows:
+                break
+            StatsService.move_bills(db, BillStatus.UNPAID, BillStatus.OVERDUE, len(rows),
+                                    sum((row.amount for row in rows), Decimal(0)))
+            if on_batch:
+                on_batch(db, rows)
+            db.commit()
+            marked += len(rows)
+        return marked
+
+    @staticmethod
+    def get_total_outstanding(db: Session):
+        #Sum of unpaid and overdue bill amounts, added up in SQL over integer cents
+        return db.query(func.coalesce(func.sum(Bill.amount), 0)).filter(
+            status_in(Bill.status, OUTSTANDING_BILL_STATUSES)
+        ).scalar()
+
+    @staticmethod
+    def get_revenue_summary(db: Session, start_date: date = None, end_date: date = None):
+        #Billed amounts per month and status, summed exactly in SQL
+        month = func.strftime('%Y-%m', Bill.date_issued)
+        query = db.query(month, Bill.status, func.count(Bill.id), func.sum(Bill.amount))
+        if start_date:
+            query = query.filter(Bill.date_issued >= start_date)
+        if end_date:
+            query = query.filter(Bill.date_issued <= end_date)
+        return query.group_by(month, Bill.status).order_by(month, Bill.status).all()
 
     @staticmethod
-    def update_bill(db: Session, bill_id: int, update_data: dict):
-        #Update bill information
-        bill = db.query(Bill).filter(Bill.id == bill_id).first()
+    def update_bill(db: Session, bill_id: int, update_data: dict, expected_version: int = None):
+        #Update bill information; expected_version is the version the caller read
+        bill = get_live(db, Bill, bill_id)
         if not bill:
             return None
+        validate_version(bill, expected_version, f"Bill {bill_id}")
+        
+        # Move the bill out of its old counter bucket before changing it
+        StatsService.track_bill(db, bill, -1)
         
         # Update fields
         if 'amount' in update_data:
-            bill.amount = validate_positive_number(update_data['amount'], "Amount")
+            bill.amount = validate_amount(update_data['amount'], "Amount")
         if 'due_date' in update_data:
             bill.due_date = validate_date(update_data['due_date']) if update_data['due_date'] else None
         if 'description' in update_data:
             bill.description = update_data['description']
         if 'status' in update_data:
-            bill.status = update_data['status']
+            bill.status = validate_bill_status(update_data['status'])
         
-        db.commit()
+        StatsService.track_bill(db, bill, 1)
+        commit_or_conflict(db, f"Bill {bill_id}")
         db.refresh(bill)
         return bill
 
     @staticmethod
-    def mark_as_paid(db: Session, bill_id: int):
+    def mark_as_paid(db: Session, bill_id: int, expected_version: int = None):
         #Mark a bill as paid
-        bill = db.query(Bill).filter(Bill.id == bill_id).first()
+        bill = get_live(db, Bill, bill_id)
         if bill:
-            bill.status = 'Paid'
-            db.commit()
+            validate_version(bill, expected_version, f"Bill {bill_id}")
+            StatsService.track_bill(db, bill, -1)
+            bill.status = BillStatus.PAID
+            StatsService.track_bill(db, bill, 1)
+            commit_or_conflict(db, f"Bill {bill_id}")
             db.refresh(bill)
             return bill
         return None
@@ -81,9 +173,24 @@ class BillingService:
     @staticmethod
     def delete_bill(db: Session, bill_id: int):
         #Delete a bill
-        bill = db.query(Bill).filter(Bill.id == bill_id).first()
+        bill = get_live(db, Bill, bill_id)
         if bill:
-            db.delete(bill)
-            db.commit()
+            StatsService.track_bill(db, bill, -1)
+            bill.deleted_at = datetime.utcnow()
+            commit_or_conflict(db, f"Bill {bill_id}")
             return True
-        return False
\ No newline at end of file
+        return False
+
+    @staticmethod
+    def restore_bill(db: Session, bill_id: int):
+        #Undo delete_bill
+        bill = BillingService.get_bill(db, bill_id, include_deleted=True)
+        if not bill or not bill.deleted_at:
+            return None
+        if not db.execute(PATIENT_ID_BY_ID, {'id': bill.patient_id}).first():
+            raise ValueError(f"Patient {bill.patient_id} is deleted; restore the patient instead")
+        bill.deleted_at = None
+        StatsService.track_bill(db, bill, 1)
+        commit_or_conflict(db, f"Bill {bill_id}")
+        db.refresh(bill)
+        return bill
\ No newline at end of file
@@ -0,0 +1,109 @@
+from collections import defaultdict
+from sqlalchemy import select, delete, insert, func
+from sqlalchemy.orm import Session
+from app.models import StaffShift, ShiftKind, DepartmentCoverage, COVERAGE_ALL_ROLES, MAX_SHIFT_HOURS
+from datetime import date, datetime, timedelta
+
+# department_coverage is derived from staff_shifts: one row per department,
+# day and role with the staff rostered, how much of the day is covered and
+# the most and fewest on duty at once. Like the stat counters it is updated
+# inside the caller's transaction, so it commits (or rolls back) together
+# with the shift change; rebuild recomputes it from scratch.
+MAX_SHIFT = timedelta(hours=MAX_SHIFT_HOURS)
+
+def _midnight(day):
+    return datetime.combine(day, datetime.min.time())
+
+def _days(start: datetime, end: datetime):
+    # Days touched by [start, end)
+    day, last = start.date(), (end - timedelta(microseconds=1)).date()
+    while day <= last:
+        yield day
+        day += timedelta(days=1)
+
+def _minutes(delta):
+    return round(delta.total_seconds() / 60)
+
+def _summarise(day, intervals):
+    # Coverage figures of one day from (start, end, staff_id, kind) intervals clipped to it
+    day_start, day_end = _midnight(day), _midnight(day + timedelta(days=1))
+    # At equal times shifts ending (-1) sort before those starting, so a handover is not counted twice
+    events = sorted([(start, 1) for start, _, _, _ in intervals] + [(end, -1) for _, end, _, _ in intervals])
+    on_duty = peak = covered = 0
+    lowest = None
+    cursor = day_start
+    for moment, change in events:
+        if moment > cursor:
+            lowest = on_duty if lowest is None else min(lowest, on_duty)
+            if on_duty:
+                covered += _minutes(moment - cursor)
+            cursor = moment
+        on_duty += change
+        peak = max(peak, on_duty)
+    if cursor < day_end:
+        lowest = 0
+    return {
+        'staff': len({staff_id for _, _, staff_id, _ in intervals}),
+        'on_call': len({staff_id for _, _, staff_id, kind in intervals if kind == ShiftKind.ON_CALL}),
+        'covered_minutes': covered,
+        'staff_minutes': sum(_minutes(end - start) for start, end, _, _ in intervals),
+        'peak': peak,
+        'lowest': lowest or 0
+    }
+
+class CoverageService:
+    @staticmethod
+    def compute(db: Session, department: str, first_day: date, last_day: date):
+        #Coverage rows of a department for the days from first_day to last_day, straight from the shifts
+        range_start, range_end = _midnight(first_day), _midnight(last_day + timedelta(days=1))
+        # Indexed on starts_at: a shift overlapping the range starts at most MAX_SHIFT before it
+        shifts = db.execute(select(
+            StaffShift.staff_id, StaffShift.role, StaffShift.kind, StaffShift.starts_at, StaffShift.ends_at
+        ).where(
+            StaffShift.starts_at > range_start - MAX_SHIFT,
+            StaffShift.starts_at < range_end,
+            StaffShift.ends_at > range_start,
+            StaffShift.department == department
+        ))
+        intervals = defaultdict(list)
+        for staff_id, role, kind, starts_at, ends_at in shifts:
+            for day in _days(max(starts_at, range_start), min(ends_at, range_end)):
+                clipped = (max(starts_at, _midnight(day)), min(ends_at, _midnight(day + timedelta(days=1))), staff_id, kind)
+                intervals[(day, role)].append(clipped)
+                intervals[(day, COVERAGE_ALL_ROLES)].append(clipped)
+        return [dict(department=department, day=day, role=role, **_summarise(day, day_intervals))
+                for (day, role), day_intervals in sorted(intervals.items())]
+
+    @staticmethod
+    def refresh(db: Session, department: str, days):
+        #Recompute a department's rows for the given days, e.g. those a changed shift touches
+        days = sorted(set(days))
+        if not days:
+            return
+        db.execute(delete(DepartmentCoverage).where(
+            DepartmentCoverage.department == department, DepartmentCoverage.day.in_(days)
+        ))
+        wanted = set(days)
+        rows = [row for row in CoverageService.compute(db, department, days[0], days[-1]) if row['day'] in wanted]
+        if rows:
+            db.execute(insert(DepartmentCoverage), rows)
+
+    @staticmethod
+    def refresh_shift(db: Session, shift: StaffShift):
+        #Recompute the rows a shift counts towards
+        CoverageService.refresh(db, shift.department, _days(shift.starts_at, shift.ends_at))
+
+    @staticmethod
+    def rebuild(db: Session):
+        #Recompute the whole table from staff_shifts, one department at a time
+        db.execute(delete(DepartmentCoverage))
+        count = 0
+        for department, first, last in db.execute(select(
+            StaffShift.department, func.min(StaffShift.starts_at), func.max(StaffShift.ends_at)
+        ).group_by(StaffShift.department)).all():
+            rows = CoverageService.compute(db, department, first.date(), (last - timedelta(microseconds=1)).date())
+            if rows:
+                db.execute(insert(DepartmentCoverage), rows)
+            count += len(rows)
+        db.commit()
+        return count
@@ -1,7 +1,59 @@
+import re
+from typing import NamedTuple
+from sqlalchemy import bindparam, or_, select
 from sqlalchemy.orm import Session
-from app.models import MedicalRecord
-from app.validators import validate_date
-from datetime import date, timedelta
+from app.models import MedicalRecord, Prescription, Patient, get_live, get_many, live_columns, read_rows
+from app.validators import validate_date, validate_version, commit_or_conflict
+from app.services.stats_service import StatsService
+from datetime import date, datetime
+
+# Hot lookups are built once at import; a call only binds its parameters and the
+# compiled SQL comes from the engine's statement cache (STATEMENT_CACHE_SIZE)
+RECORDS_BY_PATIENT = select(MedicalRecord).where(MedicalRecord.patient_id == bindparam('patient_id'))
+PATIENT_ID_BY_ID = select(Patient.id).where(Patient.id == bindparam('id'))
+
+class MedicalRecordRow(NamedTuple):
+    # A medical record as the listings show one
+    id: int
+    patient_id: int
+    staff_id: int
+    diagnosis: str
+    admission_date: date
+    discharge_date: date
+    duration_of_stay: int
+
+MEDICAL_RECORD_ROWS = live_columns(MedicalRecord, MedicalRecordRow)
+
+DOSE_PATTERN = re.compile(r'\d+(?:\.\d+)?\s*(?:mg|mcg|g|ml|units?|iu|%)(?![a-z])', re.IGNORECASE)
+FREQUENCY_PATTERN = re.compile(
+    r'\b(?:(?:once|twice|three times|four times)\s+(?:a\s+)?(?:day|daily|week|weekly)'
+    r'|every\s+\d+\s*(?:hours|hrs|h)|as needed'
+    r'|daily|nightly|weekly|od|bd|bid|tds|tid|qds|qid|prn|stat)\b',
+    re.IGNORECASE
+)
+
+def normalize_drug(name):
+    #Normalize a drug name for indexed equality lookups
+    return ' '.join(name.lower().split())
+
+def parse_medications(text):
+    #Split a free-text medications field into drug/dose/frequency entries
+    entries = []
+    for item in re.split(r'[,;\n]+', text or ''):
+        item = item.strip()
+        if not item:
+            continue
+        dose = DOSE_PATTERN.search(item)
+        frequency = FREQUENCY_PATTERN.search(item)
+        # The drug name is whatever precedes the first dose/frequency token
+        cut = min([m.start() for m in (dose, frequency) if m] or [len(item)])
+        drug = normalize_drug(item[:cut]) or normalize_drug(item)
+        entries.append({
+            'drug': drug[:100],
+            'dose': dose.group(0) if dose else None,
+            'frequency': frequency.group(0).lower() if frequency else None
+        })
+    return entries
 
 class MedicalRecordService:
     @staticmethod
@@ -29,16 +81,24 @@ class MedicalRecordService:
             notes=record_data.get('notes', '')
         )
         
+        MedicalRecordService.sync_prescriptions(record)
+        
         # Add to database
         db.add(record)
+        StatsService.track_medical_record(db, record, 1)
         db.commit()
         db.refresh(record)
         return record
 
     @staticmethod
-    def get_medical_record(db: Session, record_id: int):
+    def get_medical_record(db: Session, record_id: int, include_deleted: bool = False):
         #Get medical record by ID
-        return db.query(MedicalRecord).filter(MedicalRecord.id == record_id).first()
+        return get_live(db, MedicalRecord, record_id, include_deleted)
+
+    @staticmethod
+    def get_many(db: Session, record_ids, include_deleted: bool = False):
+        #Get several medical records by ID in the given order, with one query for those not already loaded
+        return get_many(db, MedicalRecord, record_ids, include_deleted)
 
     @staticmethod
     def get_all_medical_records(db: Session):
@@ -48,14 +108,26 @@ class MedicalRecordService:
     @staticmethod
     def get_patient_medical_records(db: Session, patient_id: int):
         #Get all medical records for a specific patient
-        return db.query(MedicalRecord).filter(MedicalRecord.patient_id == patient_id).all()
+        return db.execute(RECORDS_BY_PATIENT, {'patient_id': patient_id}).scalars().all()
+
+    @staticmethod
+    def list_medical_records(db: Session, patient_id: int = None):
+        #Medical records as MedicalRecordRow tuples, for listings; all of them or one patient's
+        statement = MEDICAL_RECORD_ROWS
+        if patient_id is not None:
+            statement = statement.where(MedicalRecord.patient_id == patient_id)
+        return read_rows(db, MedicalRecord, MedicalRecordRow, statement)
 
     @staticmethod
-    def update_medical_record(db: Session, record_id: int, update_data: dict):
-        #Update medical record information
-        record = db.query(MedicalRecord).filter(MedicalRecord.id == record_id).first()
+    def update_medical_record(db: Session, record_id: int, update_data: dict, expected_version: int = None):
+        #Update medical record information; expected_version is the version the caller read
+        record = get_live(db, MedicalRecord, record_id)
         if not record:
             return None
+        validate_version(record, expected_version, f"Medical record {record_id}")
+        
+        # Move the record out of its old counter bucket before changing it
+        StatsService.track_medical_record(db, record, -1)
         
         # Update fields
         if 'diagnosis' in update_data:
@@ -77,16 +149,74 @@ class MedicalRecordService:
         else:
             record.duration_of_stay = None
         
-        db.commit()
+        if {'medications', 'admission_date', 'discharge_date'} & set(update_data):
+            MedicalRecordService.sync_prescriptions(record)
+        
+        StatsService.track_medical_record(db, record, 1)
+        commit_or_conflict(db, f"Medical record {record_id}")
         db.refresh(record)
         return record
 
     @staticmethod
     def delete_medical_record(db: Session, record_id: int):
         #Delete a medical record
-        record = db.query(MedicalRecord).filter(MedicalRecord.id == record_id).first()
+        record = get_live(db, MedicalRecord, record_id)
         if record:
-            db.delete(record)
-            db.commit()
+            StatsService.track_medical_record(db, record, -1)
+            # Prescriptions stay with the tombstoned record and go when it is purged
+            record.deleted_at = datetime.utcnow()
+            commit_or_conflict(db, f"Medical record {record_id}")
             return True
-        return False
\ No newline at end of file
+        return False
+
+    @staticmethod
+    def restore_medical_record(db: Session, record_id: int):
+        #Undo delete_medical_record
+        record = MedicalRecordService.get_medical_record(db, record_id, include_deleted=True)
+        if not record or not record.deleted_at:
+            return None
+        if not db.execute(PATIENT_ID_BY_ID, {'id': record.patient_id}).first():
+            raise ValueError(f"Patient {record.patient_id} is deleted; restore the patient instead")
+        record.deleted_at = None
+        StatsService.track_medical_record(db, record, 1)
+        commit_or_conflict(db, f"Medical record {record_id}")
+        db.refresh(record)
+        return record
+
+    @staticmethod
+    def sync_prescriptions(record: MedicalRecord):
+        #Rebuild the normalized prescriptions from the record's medications text
+        start_date = record.admission_date or date.today()
+        record.prescriptions = [
+            Prescription(
+                drug=entry['drug'],
+                dose=entry['dose'],
+                frequency=entry['frequency'],
+                start_date=start_date,
+                end_date=record.discharge_date
+            )
+            for entry in parse_medications(record.medications)
+        ]
+
+    @staticmethod
+    def get_patients_on_drug(db: Session, drug: str, active_on: date = None):
+        #Get patients with a prescription for the drug, optionally only those active on a date
+        query = db.query(Patient).join(MedicalRecord, MedicalRecord.patient_id == Patient.id).join(
+            Prescription, Prescription.record_id == MedicalRecord.id
+        ).filter(Prescription.drug == normalize_drug(drug))
+        if active_on:
+            query = query.filter(
+                Prescription.start_date <= active_on,
+                or_(Prescription.end_date.is_(None), Prescription.end_date >= active_on)
+            )
+        return query.distinct().all()
+
+    @staticmethod
+    def get_active_prescriptions(db: Session, patient_id: int, active_on: date = None):
+        #Get a patient's prescriptions that are active on a date (default: today)
+        active_on = active_on or date.today()
+        return db.query(Prescription).join(MedicalRecord, Prescription.record_id == MedicalRecord.id).filter(
+            MedicalRecord.patient_id == patient_id,
+            Prescription.start_date <= active_on,
+            or_(Prescription.end_date.is_(None), Prescription.end_date >= active_on)
+        ).order_by(Prescription.drug).all()
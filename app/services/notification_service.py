@@ -0,0 +1,118 @@
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session, aliased
+from app.models import Appointment, AppointmentStatus, OutboxMessage, OutboxStatus, Patient, Staff, status_equals
+from datetime import datetime, timedelta
+
+REMINDER_WINDOW = timedelta(hours=24)
+MAX_DELIVERY_ATTEMPTS = 3
+
+class NotificationService:
+    # Messages are written to the outbox table in the same transaction as the
+    # change they announce and delivered later by the scheduler. The dedupe
+    # key makes queueing idempotent, so jobs can safely run again.
+
+    @staticmethod
+    def recipient(email, contact_number):
+        return email or contact_number
+
+    @staticmethod
+    def queue(db: Session, messages):
+        #Insert outbox messages, skipping any whose dedupe key is already queued; returns how many were added
+        if not messages:
+            return 0
+        stmt = insert(OutboxMessage.__table__).on_conflict_do_nothing(index_elements=['dedupe_key'])
+        # Executed on the session's connection (same transaction) to get the inserted row count
+        rows = [dict(message, status=OutboxStatus.PENDING, attempts=0, created_at=datetime.utcnow())
+                for message in messages]
+        return db.connection().execute(stmt, rows).rowcount
+
+    @staticmethod
+    def queue_appointment_reminders(db: Session, now: datetime = None, window: timedelta = REMINDER_WINDOW):
+        #Queue a reminder for every scheduled appointment starting within the window
+        now = now or datetime.now()
+        doctor = aliased(Staff)
+        rows = db.execute(select(
+            Appointment.id, Appointment.appointment_date, Appointment.purpose, Appointment.patient_id,
+            Patient.first_name, Patient.email, Patient.contact_number,
+            doctor.first_name.label('staff_first_name'), doctor.last_name.label('staff_last_name')
+        ).join(Patient, Patient.id == Appointment.patient_id).join(
+            doctor, doctor.id == Appointment.staff_id
+        ).where(
+            # Range scan on the partial index of scheduled appointment dates
+            status_equals(Appointment.status, AppointmentStatus.SCHEDULED),
+            Appointment.appointment_date >= now,
+            Appointment.appointment_date < now + window
+        )).all()
+
+        messages = [{
+            'kind': 'appointment_reminder',
+            # Keyed on the time too, so a rescheduled appointment is reminded again
+            'dedupe_key': f"appointment_reminder:{row.id}:{row.appointment_date.isoformat()}",
+            'patient_id': row.patient_id,
+            'recipient': NotificationService.recipient(row.email, row.contact_number),
+            'subject': f"Appointment reminder for {row.appointment_date:%Y-%m-%d %H:%M}",
+            'body': (f"Dear {row.first_name}, this is a reminder of your appointment with "
+                     f"{row.staff_first_name} {row.staff_last_name} on {row.appointment_date:%A %d %B at %H:%M}"
+                     + (f" ({row.purpose})" if row.purpose else "") + ".")
+        } for row in rows]
+        queued = NotificationService.queue(db, messages)
+        db.commit()
+        return queued
+
+    @staticmethod
+    def queue_overdue_notices(db: Session, bills):
+        #Queue a notice for bills just marked overdue (rows with id, patient_id, amount, due_date); no commit
+        patients = {row.id: row for row in db.execute(
+            select(Patient.id, Patient.first_name, Patient.email, Patient.contact_number).where(
+                Patient.id.in_({bill.patient_id for bill in bills})
+            )
+        )}
+        messages = []
+        for bill in bills:
+            patient = patients.get(bill.patient_id)
+            if patient is None:
+                continue
+            messages.append({
+                'kind': 'bill_overdue',
+                'dedupe_key': f"bill_overdue:{bill.id}",
+                'patient_id': bill.patient_id,
+                'recipient': NotificationService.recipient(patient.email, patient.contact_number),
+                'subject': f"Bill #{bill.id} is overdue",
+                'body': (f"Dear {patient.first_name}, bill #{bill.id} for {bill.amount:,.2f} was due on "
+                         f"{bill.due_date} and is now overdue. Please contact the billing office.")
+            })
+        return NotificationService.queue(db, messages)
+
+    @staticmethod
+    def deliver_pending(db: Session, deliver, batch_size: int = 100, max_attempts: int = MAX_DELIVERY_ATTEMPTS):
+        #Hand pending messages to deliver(message), oldest first; returns (sent, failed)
+        messages = db.query(OutboxMessage).filter(
+            status_equals(OutboxMessage.status, OutboxStatus.PENDING)
+        ).order_by(OutboxMessage.id).limit(batch_size).all()
+
+        sent = failed = 0
+        for message in messages:
+            message.attempts += 1
+            try:
+                deliver(message)
+            except Exception as e:
+                message.last_error = str(e)[:500]
+                if message.attempts >= max_attempts:
+                    message.status = OutboxStatus.FAILED
+                    failed += 1
+                continue
+            message.status = OutboxStatus.SENT
+            message.sent_at = datetime.utcnow()
+            message.last_error = None
+            sent += 1
+        db.commit()
+        return sent, failed
+
+    @staticmethod
+    def get_messages(db: Session, status=None, limit: int = 50):
+        #Most recent outbox messages, optionally with one status
+        query = db.query(OutboxMessage)
+        if status is not None:
+            query = query.filter(status_equals(OutboxMessage.status, OutboxStatus.parse(status)))
+        return query.order_by(OutboxMessage.id.desc()).limit(limit).all()
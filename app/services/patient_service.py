@@ -1,7 +1,201 @@
+from typing import NamedTuple
+from sqlalchemy import and_, or_
 from sqlalchemy.orm import Session
-from app.models import Patient
-from app.validators import validate_name, validate_email, validate_phone, validate_date, validate_gender
-from datetime import date
+from app.encryption import blind_index
+from app.models import Patient, PatientSearchKey, Appointment, AppointmentSeries, MedicalRecord, Bill, get_live, get_many, live_columns, read_rows
+from app.validators import validate_name, validate_email, validate_phone, validate_date, validate_gender, validate_version, commit_or_conflict
+from app.services.stats_service import StatsService
+from datetime import date, datetime
+
+class PatientRow(NamedTuple):
+    # A patient as the listings show one
+    id: int
+    first_name: str
+    last_name: str
+    date_of_birth: date
+    gender: str
+    contact_number: str
+    email: str
+
+PATIENT_ROWS = live_columns(Patient, PatientRow)
+
+class FacilityMatch(NamedTuple):
+    # A patient found by a search across facilities; ids are only unique within a facility
+    facility: str
+    patient: PatientRow
+    score: float
+
+# Fuzzy name search reads patient_search_keys, one row per patient with the
+# Soundex and Metaphone codes of the first and last name (indexed, so
+# candidates are an index lookup however many patients there are) and the
+# trigram set of the name (used to rank the candidates).
+FUZZY_MAX_CANDIDATES = 2000   # rows read per search before ranking
+FUZZY_MIN_SCORE = 0.3
+FUZZY_EXACT_SCORE = 0.9       # a match this close ends the search before the wider lookup
+
+SOUNDEX_DIGITS = {letter: digit for digit, letters in enumerate(
+    ['AEIOUYHW', 'BFPV', 'CGJKQSXZ', 'DT', 'L', 'MN', 'R']) for letter in letters}
+VOWELS = 'AEIOU'
+
+def name_tokens(name):
+    #Lower-case words of a name with anything but letters removed
+    return [word for word in (''.join(c for c in token if c.isascii() and c.isalpha())
+                              for token in (name or '').lower().split()) if word]
+
+def soundex(name):
+    #Four character Soundex code ('' for an empty name)
+    letters = ''.join(name_tokens(name)).upper()
+    if not letters:
+        return ''
+    code = letters[0]
+    previous = SOUNDEX_DIGITS[letters[0]]
+    for letter in letters[1:]:
+        digit = SOUNDEX_DIGITS[letter]
+        if digit and digit != previous:
+            code += str(digit)
+            if len(code) == 4:
+                break
+        # H and W do not separate letters with the same code; vowels do
+        if letter not in 'HW':
+            previous = digit
+    return code.ljust(4, '0')
+
+def metaphone(name, max_length=12):
+    #Metaphone code (Philips, 1990); '0' stands for "th"
+    word = ''.join(name_tokens(name)).upper()
+    if word[:2] in ('AE', 'GN', 'KN', 'PN', 'WR'):
+        word = word[1:]
+    elif word[:2] == 'WH':
+        word = 'W' + word[2:]
+    elif word[:1] == 'X':
+        word = 'S' + word[1:]
+
+    code = ''
+    for i, letter in enumerate(word):
+        before = word[i - 1] if i else ''
+        after = word[i + 1:i + 2]
+        rest = word[i + 1:]
+        if letter == before and letter != 'C':
+            continue
+        if letter in VOWELS:
+            if i == 0:
+                code += letter
+        elif letter == 'B':
+            if not (before == 'M' and not after):
+                code += 'B'
+        elif letter == 'C':
+            if after == 'H':
+                code += 'K' if before == 'S' else 'X'
+            elif rest[:2] == 'IA':
+                code += 'X'
+            elif after in ('I', 'E', 'Y'):
+                if before != 'S':
+                    code += 'S'
+            else:
+                code += 'K'
+        elif letter == 'D':
+            code += 'J' if after == 'G' and word[i + 2:i + 3] in ('E', 'I', 'Y') else 'T'
+        elif letter == 'G':
+            if after == 'H' and word[i + 2:i + 3] and word[i + 2] not in VOWELS:
+                continue
+            if after == 'N' and rest[1:] in ('', 'ED'):
+                continue
+            if before == 'D' and after in ('E', 'I', 'Y'):
+                continue
+            code += 'J' if after in ('E', 'I', 'Y') else 'K'
+        elif letter == 'H':
+            # Silent after C, S, P, T, G (sounded there) and after a vowel unless another follows
+            if before and before in 'CSPTG':
+                continue
+            if before and before in VOWELS and not (after and after in VOWELS):
+                continue
+            code += 'H'
+        elif letter == 'K':
+            if before != 'C':
+                code += 'K'
+        elif letter == 'P':
+            code += 'F' if after == 'H' else 'P'
+        elif letter == 'Q':
+            code += 'K'
+        elif letter == 'S':
+            code += 'X' if after == 'H' or rest[:2] in ('IO', 'IA') else 'S'
+        elif letter == 'T':
+            if rest[:2] in ('IO', 'IA'):
+                code += 'X'
+            elif after == 'H':
+                code += '0'
+            elif rest[:2] != 'CH':
+                code += 'T'
+        elif letter == 'V':
+            code += 'F'
+        elif letter in 'WY':
+            if after and after in VOWELS:
+                code += letter
+        elif letter == 'X':
+            code += 'KS'
+        elif letter == 'Z':
+            code += 'S'
+        else:
+            code += letter
+    return code[:max_length]
+
+def trigrams(*names):
+    #Set of three-letter sequences of the words in names, padded like pg_trgm ("  j", " jo", "joh", ...)
+    grams = set()
+    for word in name_tokens(' '.join(names)):
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+def name_keys(first_name, last_name):
+    #Column values of a patient_search_keys row
+    return {
+        'first_soundex': soundex(first_name),
+        'first_metaphone': metaphone(first_name),
+        'last_soundex': soundex(last_name),
+        'last_metaphone': metaphone(last_name),
+        # '|  j| jo|joh|...|', so membership is a substring test
+        'trigrams': '|' + '|'.join(sorted(trigrams(first_name, last_name))) + '|'
+    }
+
+def name_matcher(tokens):
+    #score(keys) -> 0..1 for (first_soundex, first_metaphone, last_soundex, last_metaphone, trigrams):
+    #trigram similarity of the names, blended with how many phonetic codes agree
+    query = [f'|{gram}|' for gram in trigrams(*tokens)]
+    codes = [(soundex(token), metaphone(token)) for token in tokens]
+    if len(codes) == 1:
+        # A single word may be either name
+        orders = [(codes[0], None), (None, codes[0])]
+    else:
+        orders = [(codes[0], codes[-1]), (codes[-1], codes[0])]
+    # Patients with the same name share keys, so each distinct name is scored once
+    scores = {}
+
+    def score(keys):
+        if keys in scores:
+            return scores[keys]
+        first_soundex, first_metaphone, last_soundex, last_metaphone, stored = keys
+        shared = sum(gram in stored for gram in query)
+        if len(codes) == 1:
+            # One word is compared with one of the names, so the other name's trigrams do not count
+            similarity = shared / len(query)
+        else:
+            similarity = shared / (len(query) + len(stored) // 4 - shared)
+        agreeing = 0
+        for first, last in orders:
+            matches = 0
+            if first:
+                matches += (first[0] == first_soundex) + (first[1] == first_metaphone)
+            if last:
+                matches += (last[0] == last_soundex) + (last[1] == last_metaphone)
+            agreeing = max(agreeing, matches / (2 * ((first is not None) + (last is not None))))
+        scores[keys] = round(0.6 * similarity + 0.4 * agreeing, 3)
+        return scores[keys]
+    return score
+
+def starts_with(column, prefix):
+    #column starts with prefix, written as a range so an index on column can serve it
+    return and_(column >= prefix, column < prefix[:-1] + chr(ord(prefix[-1]) + 1))
 
 class PatientService:
     @staticmethod
@@ -26,22 +220,35 @@ class PatientService:
             address=patient_data.get('address', '')
         )
         
+        PatientService.sync_search_key(patient)
+        
         # Add to database
         db.add(patient)
+        StatsService.track_patient(db, 1)
         db.commit()
         db.refresh(patient)
         return patient
 
     @staticmethod
-    def get_patient(db: Session, patient_id: int):
+    def get_patient(db: Session, patient_id: int, include_deleted: bool = False):
         #Get patient by ID
-        return db.query(Patient).filter(Patient.id == patient_id).first()
+        return get_live(db, Patient, patient_id, include_deleted)
+
+    @staticmethod
+    def get_many(db: Session, patient_ids, include_deleted: bool = False):
+        #Get several patients by ID in the given order, with one query for those not already loaded
+        return get_many(db, Patient, patient_ids, include_deleted)
 
     @staticmethod
     def get_all_patients(db: Session):
         #Get all patients
         return db.query(Patient).all()
 
+    @staticmethod
+    def list_patients(db: Session):
+        #All patients as PatientRow tuples, for listings that only show these columns
+        return read_rows(db, Patient, PatientRow, PATIENT_ROWS)
+
     @staticmethod
     def search_patients(db: Session, search_term: str):
         #Search patients by name
@@ -51,11 +258,102 @@ class PatientService:
         ).all()
 
     @staticmethod
-    def update_patient(db: Session, patient_id: int, update_data: dict):
-        #Update patient information
-        patient = db.query(Patient).filter(Patient.id == patient_id).first()
+    def find_by_contact(db: Session, contact: str):
+        #Patients with this phone number or email, matched on its blind index (the columns are encrypted)
+        if '@' in contact:
+            condition = Patient.email_index == blind_index(contact, 'email')
+        else:
+            condition = Patient.contact_number_index == blind_index(contact, 'phone')
+        return db.query(Patient).filter(condition).order_by(Patient.id).all()
+
+    @staticmethod
+    def fuzzy_search_patients(db: Session, name: str, date_of_birth=None, limit: int = 20):
+        #Patients whose name sounds like or is spelled close to name, best first, as (patient, score) pairs
+        tokens = name_tokens(name)
+        if not tokens:
+            return []
+        # Candidates are ranked on their keys; only the patients returned are loaded
+        keys = PatientSearchKey
+        query = db.query(keys.patient_id, keys.first_soundex, keys.first_metaphone, keys.last_soundex,
+                         keys.last_metaphone, keys.trigrams).join(Patient, Patient.id == keys.patient_id)
+        score = name_matcher(tokens)
+        
+        def ranked(*conditions):
+            scores = {row[0]: score(tuple(row[1:])) for row in query.filter(*conditions).limit(FUZZY_MAX_CANDIDATES)}
+            return {patient_id: value for patient_id, value in scores.items() if value >= FUZZY_MIN_SCORE}
+        
+        codes = [(soundex(token), metaphone(token)) for token in tokens]
+        if date_of_birth:
+            # Few patients share a birthday, so all of them are ranked and typos the codes miss still match
+            if isinstance(date_of_birth, str):
+                date_of_birth = validate_date(date_of_birth)
+            scores = ranked(keys.date_of_birth == date_of_birth)
+        elif len(tokens) == 1:
+            (sx, mp), = codes
+            scores = ranked(or_(keys.last_soundex == sx, keys.last_metaphone == mp,
+                                keys.first_soundex == sx, keys.first_metaphone == mp))
+            if max(scores.values(), default=0) < FUZZY_EXACT_SCORE:
+                # No close match: widen to names sharing the initial and first Soundex digit
+                scores.update(ranked(or_(starts_with(keys.last_soundex, sx[:2]), starts_with(keys.first_soundex, sx[:2]))))
+        else:
+            # First and last word as first and last name, in either order
+            orders = ((codes[0], codes[-1]), (codes[-1], codes[0]))
+            scores = ranked(or_(*(
+                and_(keys.last_soundex == last_sx, keys.first_soundex == first_sx)
+                for (first_sx, first_mp), (last_sx, last_mp) in orders
+            )))
+            if max(scores.values(), default=0) < FUZZY_EXACT_SCORE:
+                # No close match: a typo can change both codes of a word, so widen to a code of
+                # one name with the initial of the other (the first letter of its Soundex code)
+                scores.update(ranked(or_(*(condition for (first_sx, first_mp), (last_sx, last_mp) in orders for condition in (
+                    and_(keys.last_soundex == last_sx, starts_with(keys.first_soundex, first_sx[0])),
+                    and_(keys.last_metaphone == last_mp, starts_with(keys.first_soundex, first_sx[0])),
+                    and_(keys.first_soundex == first_sx, starts_with(keys.last_soundex, last_sx[0])),
+                    and_(keys.first_metaphone == first_mp, starts_with(keys.last_soundex, last_sx[0])),
+                )))))
+        
+        best = sorted(scores, key=lambda patient_id: (-scores[patient_id], patient_id))[:limit]
+        patients = {patient.id: patient for patient in db.query(Patient).filter(Patient.id.in_(best))} if best else {}
+        return [(patients[patient_id], scores[patient_id]) for patient_id in best if patient_id in patients]
+
+    @staticmethod
+    def search_all_facilities(name: str, date_of_birth=None, limit: int = 20, facilities=None, workers: int = None):
+        #Fuzzy name search run on every facility's database in parallel, merged best first as FacilityMatch tuples
+        from app.database import fan_out
+
+        def search(db):
+            matches = PatientService.fuzzy_search_patients(db, name, date_of_birth, limit)
+            if not matches and not date_of_birth:
+                # Partial names ("Smi") are found by the plain substring search
+                matches = [(patient, None) for patient in PatientService.search_patients(db, name)[:limit]]
+            # Plain tuples, since the worker's session is closed once it returns
+            return [(PatientRow(*(getattr(patient, field) for field in PatientRow._fields)), score)
+                    for patient, score in matches]
+
+        found = [FacilityMatch(facility, patient, score)
+                 for facility, matches in fan_out(search, facilities, workers=workers).items() for patient, score in matches]
+        # fan_out returns the facilities in order, so equal scores keep main first
+        found.sort(key=lambda match: -(match.score or 0))
+        return found[:limit]
+
+    @staticmethod
+    def sync_search_key(patient: Patient):
+        #Recompute the patient's fuzzy search row from their name and date of birth
+        keys = name_keys(patient.first_name, patient.last_name)
+        if patient.search_key is None:
+            patient.search_key = PatientSearchKey(date_of_birth=patient.date_of_birth, **keys)
+            return
+        patient.search_key.date_of_birth = patient.date_of_birth
+        for column, value in keys.items():
+            setattr(patient.search_key, column, value)
+
+    @staticmethod
+    def update_patient(db: Session, patient_id: int, update_data: dict, expected_version: int = None):
+        #Update patient information; expected_version is the version the caller read
+        patient = get_live(db, Patient, patient_id)
         if not patient:
             return None
+        validate_version(patient, expected_version, f"Patient {patient_id}")
         
         # Validate and update fields
         if 'first_name' in update_data:
@@ -72,17 +370,60 @@ class PatientService:
             patient.email = validate_email(update_data.get('email', ''))
         if 'address' in update_data:
             patient.address = update_data['address']
+        if {'first_name', 'last_name', 'date_of_birth'} & update_data.keys():
+            PatientService.sync_search_key(patient)
         
-        db.commit()
+        commit_or_conflict(db, f"Patient {patient_id}")
         db.refresh(patient)
         return patient
 
+    @staticmethod
+    def dependents(db: Session, patient_id: int, deleted_at: datetime = None):
+        #Appointments, series, medical records and bills of a patient: live ones, or those deleted at deleted_at
+        rows = {}
+        for model in (Appointment, AppointmentSeries, MedicalRecord, Bill):
+            query = db.query(model).filter(model.patient_id == patient_id)
+            if deleted_at:
+                query = query.filter(model.deleted_at == deleted_at).execution_options(include_deleted=True)
+            rows[model] = query.all()
+        return rows
+
     @staticmethod
     def delete_patient(db: Session, patient_id: int):
-        #Delete a patient
-        patient = db.query(Patient).filter(Patient.id == patient_id).first()
+        #Delete a patient with their appointments, series, medical records and bills; restorable until purged
+        patient = get_live(db, Patient, patient_id)
         if patient:
-            db.delete(patient)
-            db.commit()
+            # One timestamp marks the whole set, so restore_patient brings back exactly these rows
+            deleted_at = datetime.utcnow()
+            rows = PatientService.dependents(db, patient_id)
+            StatsService.track_appointments(db, rows[Appointment], -1)
+            for record in rows[MedicalRecord]:
+                StatsService.track_medical_record(db, record, -1)
+            for bill in rows[Bill]:
+                StatsService.track_bill(db, bill, -1)
+            for row in [patient, *(row for model_rows in rows.values() for row in model_rows)]:
+                row.deleted_at = deleted_at
+            StatsService.track_patient(db, -1)
+            commit_or_conflict(db, f"Patient {patient_id}")
             return True
-        return False
\ No newline at end of file
+        return False
+
+    @staticmethod
+    def restore_patient(db: Session, patient_id: int):
+        #Undo delete_patient, bringing back the rows deleted together with the patient
+        patient = PatientService.get_patient(db, patient_id, include_deleted=True)
+        if not patient or not patient.deleted_at:
+            return None
+        
+        rows = PatientService.dependents(db, patient_id, patient.deleted_at)
+        for row in [patient, *(row for model_rows in rows.values() for row in model_rows)]:
+            row.deleted_at = None
+        StatsService.track_patient(db, 1)
+        StatsService.track_appointments(db, rows[Appointment], 1)
+        for record in rows[MedicalRecord]:
+            StatsService.track_medical_record(db, record, 1)
+        for bill in rows[Bill]:
+            StatsService.track_bill(db, bill, 1)
+        commit_or_conflict(db, f"Patient {patient_id}")
+        db.refresh(patient)
+        return patient
\ No newline at end of file
@@ -0,0 +1,231 @@
+import heapq
+from bisect import bisect_right
+from calendar import timegm
+from itertools import repeat
+from typing import NamedTuple
+from sqlalchemy import select, func, or_, Integer
+from sqlalchemy.orm import Session
+from app.models import (Appointment, AppointmentStatus, Staff, StaffWorkingHours, status_equals,
+                        DEFAULT_APPOINTMENT_MINUTES, DEFAULT_WORKING_HOURS)
+from app.validators import validate_duration
+from app.services.appointment_service import AppointmentService, LONGEST_APPOINTMENT
+from datetime import datetime, timedelta
+
+# Slot search: the candidates are a department's staff in a role; each has
+# weekly working hours and a sorted list of busy intervals (its own
+# appointments plus the patient's, who cannot be in two rooms). A generator
+# per staff member walks its free gaps in time order and heapq.merge
+# interleaves them, so the earliest slots across all staff come out first
+# (at equal times, whoever has fewer bookings in the stretch read) and the
+# search stops as soon as enough are found.
+#
+# Bookings are read one stretch of working time at a time, starting with
+# FIRST_SPAN and doubling up to MAX_SPAN, each read picking up where the last
+# one stopped, so the usual request - a free slot in the next few hours or
+# days - reads a few thousand rows at most however far ahead the diary is
+# filled. Times are whole seconds since the epoch (computed by SQLite from
+# the covering ix_appointments_busy index), which keeps the per-row work to
+# integer tuples.
+SLOT_MINUTES = 15           # proposed start times fall on this grid
+SEARCH_DAYS = 28            # default search window
+FIRST_SPAN = timedelta(hours=1)
+MAX_SPAN = timedelta(days=8)
+
+class Slot(NamedTuple):
+    start: datetime
+    end: datetime
+    staff_id: int
+    staff_name: str
+
+EPOCH = datetime(1970, 1, 1)
+GRID = SLOT_MINUTES * 60
+
+def _seconds(moment):
+    return timegm(moment.timetuple())
+
+def _datetime(seconds):
+    return EPOCH + timedelta(seconds=seconds)
+
+def _round_up(seconds):
+    # Next grid point at or after seconds
+    return -(-seconds // GRID) * GRID
+
+def _merge(intervals):
+    # Sorted, non-overlapping (start, end) list
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+def _free_starts(blocks, busy, length, until):
+    # Grid-aligned starts before until, in order, of back-to-back slots inside the blocks that miss every busy interval
+    ends = [end for _, end in busy]
+    for block_start, block_end in blocks:
+        cursor = _round_up(block_start)
+        while cursor < until and cursor + length <= block_end:
+            # First busy interval still running at cursor
+            i = bisect_right(ends, cursor)
+            if i < len(busy) and busy[i][0] < cursor + length:
+                cursor = _round_up(busy[i][1])
+                continue
+            yield cursor
+            cursor += length
+
+class SchedulingService:
+    @staticmethod
+    def candidates(db: Session, department: str, role: str = 'Doctor'):
+        #Live staff of a department (and role) as {id: name}
+        query = select(Staff.id, Staff.first_name, Staff.last_name).where(func.lower(Staff.department) == department.lower())
+        if role:
+            query = query.where(func.lower(Staff.role) == role.lower())
+        return {row.id: f"{row.first_name} {row.last_name}" for row in db.execute(query.order_by(Staff.id))}
+
+    @staticmethod
+    def working_hours(db: Session, staff_ids):
+        #Weekly hours of several staff members as {staff_id: {weekday: [(start, end), ...]}}
+        hours = {}
+        for row in db.execute(select(StaffWorkingHours.staff_id, StaffWorkingHours.weekday, StaffWorkingHours.start_time,
+                                     StaffWorkingHours.end_time).where(StaffWorkingHours.staff_id.in_(staff_ids))
+                              .order_by(StaffWorkingHours.weekday, StaffWorkingHours.start_time)):
+            hours.setdefault(row.staff_id, {}).setdefault(row.weekday, []).append((row.start_time, row.end_time))
+        return {staff_id: hours.get(staff_id, DEFAULT_WORKING_HOURS) for staff_id in staff_ids}
+
+    @staticmethod
+    def busy_intervals(db: Session, staff_ids, patient_id, start: datetime, end: datetime, since: datetime = None):
+        #Appointments (not cancelled) of the staff or the patient overlapping [start, end), as epoch-second intervals
+        # {staff_id: [(start, end), ...]}, with the patient's own appointments under None; since skips those
+        # beginning before it, already read by an earlier call
+        staff_ids = set(staff_ids)
+        begins = func.cast(func.strftime('%s', Appointment.appointment_date), Integer)
+        finishes = begins + Appointment.duration_minutes * 60
+        # Plain Core on the session's connection: a few thousand integer rows per call, no ORM row handling
+        rows = db.connection().execute(select(
+            Appointment.staff_id, Appointment.patient_id, begins, finishes
+        ).where(
+            # Starts are indexed; an appointment can begin up to the longest length before the range,
+            # and those already over by then are dropped before they reach Python
+            Appointment.appointment_date >= (since or start - LONGEST_APPOINTMENT),
+            Appointment.appointment_date < end,
+            finishes > _seconds(start),
+            Appointment.deleted_at.is_(None),
+            ~status_equals(Appointment.status, AppointmentStatus.CANCELLED),
+            or_(Appointment.staff_id.in_(sorted(staff_ids)), Appointment.patient_id == patient_id)
+        )).all()
+        busy = {}
+        for staff_id, booked_patient, begin, finish in rows:
+            if staff_id in staff_ids:
+                busy.setdefault(staff_id, []).append((begin, finish))
+            if booked_patient == patient_id:
+                busy.setdefault(None, []).append((begin, finish))
+        return busy
+
+    @staticmethod
+    def find_slots(db: Session, department: str, patient_id: int, duration: int = DEFAULT_APPOINTMENT_MINUTES,
+                   earliest: datetime = None, latest: datetime = None, limit: int = 5, role: str = 'Doctor',
+                   distinct_times: bool = True):
+        #Earliest free slots of `duration` minutes with any of a department's staff between earliest and latest
+        # distinct_times offers each start time once, with the least booked of the staff free then
+        length = validate_duration(duration) * 60
+        now = datetime.now()
+        earliest = _datetime(_round_up(_seconds(max(earliest or now, now))))
+        latest = latest or earliest + timedelta(days=SEARCH_DAYS)
+        if latest <= earliest:
+            raise ValueError("The latest time must be after the earliest")
+
+        staff = SchedulingService.candidates(db, department, role)
+        if not staff:
+            raise ValueError(f"No {role or 'staff'} found in department '{department}'")
+        hours = SchedulingService.working_hours(db, list(staff))
+        first, last = _seconds(earliest), _seconds(latest)
+
+        def blocks_on(day):
+            # Working blocks per staff member on day in epoch seconds, clipped to [earliest, latest);
+            # staff sharing a weekly pattern (e.g. the default) share the converted blocks
+            weekday = day.weekday()
+            midnight = _seconds(datetime.combine(day, datetime.min.time()))
+            converted = {}
+            blocks = {}
+            for staff_id in staff:
+                pattern = hours[staff_id].get(weekday)
+                if not pattern:
+                    continue
+                if id(pattern) not in converted:
+                    converted[id(pattern)] = [
+                        (start, end) for start, end in (
+                            (max(midnight + begin.hour * 3600 + begin.minute * 60, first),
+                             min(midnight + finish.hour * 3600 + finish.minute * 60, last)) for begin, finish in pattern)
+                        if start < end
+                    ]
+                if converted[id(pattern)]:
+                    blocks[staff_id] = converted[id(pattern)]
+            return blocks
+
+        slots = []
+        span = FIRST_SPAN
+        start = earliest
+        day, day_blocks = None, {}
+        while start < latest:
+            if start.date() != day:
+                day = start.date()
+                day_blocks = blocks_on(day)
+                next_day = datetime.combine(day + timedelta(days=1), datetime.min.time())
+                if not day_blocks:
+                    start = next_day
+                    continue
+                # Windows run from the first block of the day to the end of the last
+                start = max(start, _datetime(min(blocks[0][0] for blocks in day_blocks.values())))
+                closes = _datetime(max(blocks[-1][1] for blocks in day_blocks.values()))
+                # Bookings of everyone working that day, read forward window by window
+                busy, read_until = {}, None
+            if start >= closes:
+                start = next_day
+                continue
+            end = min(start + span, closes)
+            window_start, window_end = _seconds(start), _seconds(end)
+            working = {staff_id: blocks for staff_id, blocks in day_blocks.items()
+                       if any(block_start < window_end and block_end > window_start for block_start, block_end in blocks)}
+            if working:
+                # Starts fall in the window; the slots themselves may run past its end
+                until = end + timedelta(seconds=length)
+                for key, intervals in SchedulingService.busy_intervals(db, day_blocks, patient_id, start, until,
+                                                                       read_until).items():
+                    busy.setdefault(key, []).extend(intervals)
+                read_until = until
+                patient_busy = busy.get(None, [])
+                streams = []
+                for staff_id, blocks in working.items():
+                    starts = _free_starts([(max(block_start, window_start), block_end) for block_start, block_end in blocks],
+                                          _merge(busy.get(staff_id, []) + patient_busy), length, window_end)
+                    streams.append(zip(starts, repeat(len(busy.get(staff_id, []))), repeat(staff_id)))
+                # Lazily interleaved by start time, then load: a priority queue over the staff
+                for begin, _, staff_id in heapq.merge(*streams):
+                    if distinct_times and slots and slots[-1].start == _datetime(begin):
+                        continue
+                    slots.append(Slot(_datetime(begin), _datetime(begin + length), staff_id, staff[staff_id]))
+                    if len(slots) == limit:
+                        return slots
+                span = min(span * 2, MAX_SPAN)
+            start = end
+        return slots
+
+    @staticmethod
+    def book_slot(db: Session, patient_id: int, staff_id: int, start: datetime, duration: int = DEFAULT_APPOINTMENT_MINUTES,
+                  purpose: str = ''):
+        #Book a slot from find_slots after checking nobody took it in the meantime
+        length = validate_duration(duration) * 60
+        busy = SchedulingService.busy_intervals(db, [staff_id], patient_id, start, start + timedelta(seconds=length))
+        begin = _seconds(start)
+        for busy_start, busy_end in busy.get(staff_id, []) + busy.get(None, []):
+            if busy_start < begin + length and begin < busy_end:
+                raise ValueError("That slot has just been taken; search again")
+        return AppointmentService.create_appointment(db, {
+            'patient_id': patient_id,
+            'staff_id': staff_id,
+            'appointment_date': start.strftime('%Y-%m-%d %H:%M'),
+            'duration_minutes': length // 60,
+            'purpose': purpose
+        })
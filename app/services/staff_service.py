@@ -1,6 +1,45 @@
+from typing import NamedTuple
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
-from app.models import Staff
-from app.validators import validate_name, validate_email, validate_phone, validate_date
+from app.models import (Staff, StaffWorkingHours, StaffShift, ShiftKind, DepartmentCoverage, Appointment, AppointmentStatus,
+                        status_equals, get_live, get_many, live_columns, read_rows, DEFAULT_WORKING_HOURS, COVERAGE_ALL_ROLES,
+                        MAX_SHIFT_HOURS)
+from app.validators import (validate_name, validate_email, validate_phone, validate_date, validate_datetime, validate_time,
+                            validate_version, commit_or_conflict)
+from app.services.stats_service import StatsService
+from app.services.coverage_service import CoverageService
+from datetime import date, datetime, timedelta
+
+class StaffRow(NamedTuple):
+    # A staff member as the listings show one
+    id: int
+    first_name: str
+    last_name: str
+    role: str
+    department: str
+    contact_number: str
+    email: str
+
+STAFF_ROWS = live_columns(Staff, StaffRow)
+
+class OnDutyRow(NamedTuple):
+    # A shift being worked at the time asked about
+    staff_id: int
+    first_name: str
+    last_name: str
+    role: str
+    department: str
+    kind: ShiftKind
+    starts_at: datetime
+    ends_at: datetime
+
+# Shifts running at :at - an indexed range on starts_at, bounded by the longest shift
+ON_DUTY = select(
+    StaffShift.staff_id, Staff.first_name, Staff.last_name, StaffShift.role, StaffShift.department,
+    StaffShift.kind, StaffShift.starts_at, StaffShift.ends_at
+).join(Staff, Staff.id == StaffShift.staff_id)
+
+COVERAGE_FIGURES = ('staff', 'on_call', 'covered_minutes', 'staff_minutes', 'peak', 'lowest')
 
 class StaffService:
     @staticmethod
@@ -26,20 +65,31 @@ class StaffService:
         
         # Add to database
         db.add(staff)
+        StatsService.track_staff(db, staff, 1)
         db.commit()
         db.refresh(staff)
         return staff
 
     @staticmethod
-    def get_staff(db: Session, staff_id: int):
+    def get_staff(db: Session, staff_id: int, include_deleted: bool = False):
         #Get staff by ID
-        return db.query(Staff).filter(Staff.id == staff_id).first()
+        return get_live(db, Staff, staff_id, include_deleted)
+
+    @staticmethod
+    def get_many(db: Session, staff_ids, include_deleted: bool = False):
+        #Get several staff members by ID in the given order, with one query for those not already loaded
+        return get_many(db, Staff, staff_ids, include_deleted)
 
     @staticmethod
     def get_all_staff(db: Session):
         #Get all staff members
         return db.query(Staff).all()
 
+    @staticmethod
+    def list_staff(db: Session):
+        #All staff as StaffRow tuples, for listings that only show these columns
+        return read_rows(db, Staff, StaffRow, STAFF_ROWS)
+
     @staticmethod
     def search_staff(db: Session, search_term: str):
         #Search staff by name or role
@@ -50,11 +100,12 @@ class StaffService:
         ).all()
 
     @staticmethod
-    def update_staff(db: Session, staff_id: int, update_data: dict):
-        #Update staff information
-        staff = db.query(Staff).filter(Staff.id == staff_id).first()
+    def update_staff(db: Session, staff_id: int, update_data: dict, expected_version: int = None):
+        #Update staff information; expected_version is the version the caller read
+        staff = get_live(db, Staff, staff_id)
         if not staff:
             return None
+        validate_version(staff, expected_version, f"Staff member {staff_id}")
         
         # Validate and update fields
         if 'first_name' in update_data:
@@ -68,20 +119,233 @@ class StaffService:
         if 'role' in update_data:
             staff.role = update_data['role']
         if 'department' in update_data:
+            StatsService.move_staff_department(db, staff.id, staff.department, update_data['department'])
             staff.department = update_data['department']
         if 'hire_date' in update_data:
             staff.hire_date = validate_date(update_data['hire_date'])
         
-        db.commit()
+        commit_or_conflict(db, f"Staff member {staff_id}")
         db.refresh(staff)
         return staff
 
     @staticmethod
     def delete_staff(db: Session, staff_id: int):
-        #Delete a staff member
-        staff = db.query(Staff).filter(Staff.id == staff_id).first()
+        #Delete a staff member; their past appointments and records keep pointing at them
+        staff = get_live(db, Staff, staff_id)
         if staff:
-            db.delete(staff)
-            db.commit()
+            upcoming = db.query(func.count(Appointment.id)).filter(
+                Appointment.staff_id == staff_id,
+                status_equals(Appointment.status, AppointmentStatus.SCHEDULED),
+                Appointment.appointment_date >= datetime.now()
+            ).scalar()
+            if upcoming:
+                raise ValueError(f"Staff member has {upcoming} upcoming appointments; reassign or cancel them first")
+            shifts = db.query(func.count(StaffShift.id)).filter(
+                StaffShift.staff_id == staff_id,
+                StaffShift.ends_at > datetime.now()
+            ).scalar()
+            if shifts:
+                raise ValueError(f"Staff member has {shifts} upcoming shifts; remove them first")
+            StatsService.track_staff(db, staff, -1)
+            staff.deleted_at = datetime.utcnow()
+            commit_or_conflict(db, f"Staff member {staff_id}")
             return True
-        return False
\ No newline at end of file
+        return False
+
+    @staticmethod
+    def restore_staff(db: Session, staff_id: int):
+        #Undo delete_staff
+        staff = StaffService.get_staff(db, staff_id, include_deleted=True)
+        if not staff or not staff.deleted_at:
+            return None
+        staff.deleted_at = None
+        StatsService.track_staff(db, staff, 1)
+        commit_or_conflict(db, f"Staff member {staff_id}")
+        db.refresh(staff)
+        return staff
+
+    @staticmethod
+    def get_working_hours(db: Session, staff_id: int):
+        #Weekly hours as {weekday: [(start, end), ...]} (0 = Monday); DEFAULT_WORKING_HOURS if none are set
+        hours = {}
+        for block in db.query(StaffWorkingHours).filter(StaffWorkingHours.staff_id == staff_id).order_by(
+                StaffWorkingHours.weekday, StaffWorkingHours.start_time):
+            hours.setdefault(block.weekday, []).append((block.start_time, block.end_time))
+        return hours or DEFAULT_WORKING_HOURS
+
+    @staticmethod
+    def set_working_hours(db: Session, staff_id: int, hours: dict):
+        #Replace a staff member's weekly hours with {weekday: [(start, end), ...]}; times as time or "HH:MM"
+        staff = get_live(db, Staff, staff_id)
+        if not staff:
+            raise ValueError(f"Staff member {staff_id} not found")
+        blocks = []
+        for weekday, day_blocks in hours.items():
+            if not 0 <= int(weekday) <= 6:
+                raise ValueError("Weekday must be 0 (Monday) to 6 (Sunday)")
+            day_blocks = sorted((validate_time(start) if isinstance(start, str) else start,
+                                 validate_time(end) if isinstance(end, str) else end) for start, end in day_blocks)
+            for i, (start, end) in enumerate(day_blocks):
+                if start >= end:
+                    raise ValueError(f"Working hours must end after they start ({start:%H:%M}-{end:%H:%M})")
+                if i and start < day_blocks[i - 1][1]:
+                    raise ValueError(f"Working hours overlap on weekday {weekday}")
+                blocks.append(StaffWorkingHours(weekday=int(weekday), start_time=start, end_time=end))
+        staff.working_hours = blocks
+        db.commit()
+        return StaffService.get_working_hours(db, staff_id)
+
+    @staticmethod
+    def _shift_times(starts_at, ends_at):
+        #Validated (start, end) of a shift; times as datetime or "YYYY-MM-DD HH:MM"
+        starts_at = validate_datetime(starts_at) if isinstance(starts_at, str) else starts_at
+        ends_at = validate_datetime(ends_at) if isinstance(ends_at, str) else ends_at
+        if starts_at >= ends_at:
+            raise ValueError("A shift must end after it starts")
+        if ends_at - starts_at > timedelta(hours=MAX_SHIFT_HOURS):
+            raise ValueError(f"A shift can be at most {MAX_SHIFT_HOURS} hours long; split longer ones")
+        return starts_at, ends_at
+
+    @staticmethod
+    def _overlapping_shift(db: Session, staff_id: int, starts_at: datetime, ends_at: datetime):
+        #The staff member's first shift overlapping [starts_at, ends_at), if any
+        return db.query(StaffShift).filter(
+            StaffShift.staff_id == staff_id,
+            StaffShift.starts_at > starts_at - timedelta(hours=MAX_SHIFT_HOURS),
+            StaffShift.starts_at < ends_at,
+            StaffShift.ends_at > starts_at
+        ).order_by(StaffShift.starts_at).first()
+
+    @staticmethod
+    def add_shift(db: Session, staff_id: int, starts_at, ends_at, kind=ShiftKind.REGULAR, department: str = None,
+                  role: str = None):
+        #Roster a shift; department and role default to the staff member's own
+        staff = get_live(db, Staff, staff_id)
+        if not staff:
+            raise ValueError(f"Staff member {staff_id} not found")
+        starts_at, ends_at = StaffService._shift_times(starts_at, ends_at)
+        department = department or staff.department
+        if not department:
+            raise ValueError("The shift needs a department")
+        clash = StaffService._overlapping_shift(db, staff_id, starts_at, ends_at)
+        if clash:
+            raise ValueError(f"Overlaps the shift {clash.starts_at:%Y-%m-%d %H:%M} - {clash.ends_at:%Y-%m-%d %H:%M}")
+        
+        shift = StaffShift(staff_id=staff_id, department=department, role=role or staff.role,
+                           starts_at=starts_at, ends_at=ends_at, kind=ShiftKind.parse(kind))
+        db.add(shift)
+        db.flush()
+        CoverageService.refresh_shift(db, shift)
+        db.commit()
+        db.refresh(shift)
+        return shift
+
+    @staticmethod
+    def roster_working_hours(db: Session, staff_id: int, first_day: date, last_day: date):
+        #Add a regular shift for each block of the staff member's weekly hours between two days, skipping any that
+        # would overlap a shift already rostered; returns the shifts added
+        staff = get_live(db, Staff, staff_id)
+        if not staff:
+            raise ValueError(f"Staff member {staff_id} not found")
+        if not staff.department:
+            raise ValueError("The staff member needs a department")
+        if last_day < first_day:
+            raise ValueError("The last day must not be before the first")
+        hours = StaffService.get_working_hours(db, staff_id)
+        added = []
+        day = first_day
+        while day <= last_day:
+            for start, end in hours.get(day.weekday(), []):
+                starts_at, ends_at = datetime.combine(day, start), datetime.combine(day, end)
+                if not StaffService._overlapping_shift(db, staff_id, starts_at, ends_at):
+                    shift = StaffShift(staff_id=staff_id, department=staff.department, role=staff.role,
+                                       starts_at=starts_at, ends_at=ends_at, kind=ShiftKind.REGULAR)
+                    db.add(shift)
+                    added.append(shift)
+            day += timedelta(days=1)
+        if added:
+            db.flush()
+            CoverageService.refresh(db, staff.department, (shift.starts_at.date() for shift in added))
+        db.commit()
+        return added
+
+    @staticmethod
+    def remove_shift(db: Session, shift_id: int):
+        #Remove a rostered shift
+        shift = db.get(StaffShift, shift_id)
+        if not shift:
+            return False
+        db.delete(shift)
+        db.flush()
+        CoverageService.refresh_shift(db, shift)
+        db.commit()
+        return True
+
+    @staticmethod
+    def get_shifts(db: Session, staff_id: int, start: datetime = None, end: datetime = None):
+        #A staff member's shifts overlapping [start, end), in order; from now on by default
+        start = start or datetime.now()
+        query = db.query(StaffShift).filter(
+            StaffShift.staff_id == staff_id,
+            StaffShift.starts_at > start - timedelta(hours=MAX_SHIFT_HOURS),
+            StaffShift.ends_at > start
+        )
+        if end:
+            query = query.filter(StaffShift.starts_at < end)
+        return query.order_by(StaffShift.starts_at).all()
+
+    @staticmethod
+    def on_duty(db: Session, at: datetime = None, department: str = None, role: str = None, kind=None):
+        #Staff on a shift at a moment (now by default) as OnDutyRow tuples, by department, role and name
+        at = at or datetime.now()
+        query = ON_DUTY.where(
+            StaffShift.starts_at > at - timedelta(hours=MAX_SHIFT_HOURS),
+            StaffShift.starts_at <= at,
+            StaffShift.ends_at > at
+        )
+        if department:
+            query = query.where(StaffShift.department == department)
+        if role:
+            query = query.where(StaffShift.role == role)
+        if kind is not None:
+            query = query.where(StaffShift.kind == ShiftKind.parse(kind))
+        query = query.order_by(StaffShift.department, StaffShift.role, StaffShift.kind, Staff.last_name, Staff.first_name)
+        return [OnDutyRow._make(row) for row in db.execute(query)]
+
+    @staticmethod
+    def department_coverage(db: Session, department: str, start: date, end: date, role: str = None):
+        #Coverage of a department (all roles, or one) for every day from start to end, read from department_coverage
+        # (days without shifts come back with zeros)
+        if end < start:
+            raise ValueError("The end date must not be before the start date")
+        role = role or COVERAGE_ALL_ROLES
+        stored = {row.day: row for row in db.execute(select(
+            DepartmentCoverage.day, *(getattr(DepartmentCoverage, figure) for figure in COVERAGE_FIGURES)
+        ).where(
+            DepartmentCoverage.department == department,
+            DepartmentCoverage.day >= start,
+            DepartmentCoverage.day <= end,
+            DepartmentCoverage.role == role
+        ))}
+        coverage = []
+        day = start
+        while day <= end:
+            row = stored.get(day)
+            coverage.append({'day': day, **{figure: getattr(row, figure) if row else 0 for figure in COVERAGE_FIGURES}})
+            day += timedelta(days=1)
+        return coverage
+
+    @staticmethod
+    def on_call_board(db: Session, at: datetime = None):
+        #Per department: who is on duty and on call at a moment (now by default) and that day's coverage
+        at = at or datetime.now()
+        board = {}
+        for row in StaffService.on_duty(db, at):
+            entry = board.setdefault(row.department, {'department': row.department, 'on_duty': [], 'on_call': [], 'coverage': None})
+            entry['on_call' if row.kind == ShiftKind.ON_CALL else 'on_duty'].append(row)
+        for row in db.execute(select(
+            DepartmentCoverage.department, *(getattr(DepartmentCoverage, figure) for figure in COVERAGE_FIGURES)
+        ).where(DepartmentCoverage.day == at.date(), DepartmentCoverage.role == COVERAGE_ALL_ROLES)):
+            entry = board.setdefault(row.department, {'department': row.department, 'on_duty': [], 'on_call': [], 'coverage': None})
+            entry['coverage'] = {figure: getattr(row, figure) for figure in COVERAGE_FIGURES}
+        return [board[department] for department in sorted(board)]
@@ -0,0 +1,199 @@
+from collections import Counter
+from decimal import Decimal
+from sqlalchemy import bindparam, func, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from app.models import Patient, Staff, Appointment, MedicalRecord, Bill, StatCounter
+from datetime import date
+
+# Looked up for every appointment and admission counted
+STAFF_DEPARTMENT = select(Staff.department).where(Staff.id == bindparam('id'))
+
+class StatsService:
+    # Counters are updated inside the caller's transaction, so they commit
+    # (or roll back) together with the write they describe.
+
+    @staticmethod
+    def increment(db: Session, metric: str, day=None, department=None, status=None, count: int = 1, total: Decimal = 0):
+        #Add count/total to a single counter bucket, creating it if needed
+        stmt = insert(StatCounter).values(
+            metric=metric,
+            day=day.isoformat() if day else '',
+            department=department or '',
+            status=str(status) if status is not None else '',
+            count=count,
+            total=total
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['metric', 'day', 'department', 'status'],
+            set_={
+                'count': StatCounter.count + stmt.excluded.count,
+                'total': StatCounter.total + stmt.excluded.total
+            }
+        )
+        db.execute(stmt)
+
+    @staticmethod
+    def staff_department(db: Session, staff_id):
+        #Look up the department used to key a staff member's counters
+        if staff_id is None:
+            return None
+        # Deleted staff included: their appointments stay counted under the department
+        return db.execute(STAFF_DEPARTMENT, {'id': staff_id}, execution_options={'include_deleted': True}).scalar()
+
+    @staticmethod
+    def track_patient(db: Session, sign: int):
+        StatsService.increment(db, 'patients', count=sign)
+
+    @staticmethod
+    def track_staff(db: Session, staff: Staff, sign: int):
+        StatsService.increment(db, 'staff', department=staff.department, count=sign)
+
+    @staticmethod
+    def track_appointment(db: Session, appointment: Appointment, sign: int):
+        #Count an appointment under its day, the staff department and its status
+        StatsService.increment(
+            db, 'appointments',
+            day=appointment.appointment_date.date() if appointment.appointment_date else None,
+            department=StatsService.staff_department(db, appointment.staff_id),
+            status=appointment.status,
+            count=sign
+        )
+
+    @staticmethod
+    def track_appointments(db: Session, appointments, sign: int):
+        #Batch version of track_appointment: one upsert per bucket instead of per appointment
+        departments = {}
+        buckets = Counter()
+        for appointment in appointments:
+            if appointment.staff_id not in departments:
+                departments[appointment.staff_id] = StatsService.staff_department(db, appointment.staff_id)
+            day = appointment.appointment_date.date() if appointment.appointment_date else None
+            buckets[(day, departments[appointment.staff_id], appointment.status)] += sign
+        for (day, department, status), count in buckets.items():
+            StatsService.increment(db, 'appointments', day=day, department=department, status=status, count=count)
+
+    @staticmethod
+    def track_medical_record(db: Session, record: MedicalRecord, sign: int):
+        #Only admissions without a discharge date are counted as active
+        if record.admission_date and not record.discharge_date:
+            StatsService.increment(
+                db, 'active_admissions',
+                department=StatsService.staff_department(db, record.staff_id),
+                count=sign
+            )
+
+    @staticmethod
+    def track_bill(db: Session, bill: Bill, sign: int):
+        StatsService.increment(db, 'bills', status=bill.status, count=sign, total=sign * (bill.amount or Decimal(0)))
+
+    @staticmethod
+    def move_bills(db: Session, from_status, to_status, count: int, total: Decimal):
+        #Move a batch of bills between status buckets, e.g. after a bulk status update
+        StatsService.increment(db, 'bills', status=from_status, count=-count, total=-total)
+        StatsService.increment(db, 'bills', status=to_status, count=count, total=total)
+
+    @staticmethod
+    def move_staff_department(db: Session, staff_id: int, old_department, new_department):
+        #Re-key counters that depend on a staff member's department
+        old_department = old_department or ''
+        new_department = new_department or ''
+        if old_department == new_department:
+            return
+
+        StatsService.increment(db, 'staff', department=old_department, count=-1)
+        StatsService.increment(db, 'staff', department=new_department, count=1)
+
+        appointment_groups = db.query(
+            func.date(Appointment.appointment_date), Appointment.status, func.count(Appointment.id)
+        ).filter(Appointment.staff_id == staff_id).group_by(
+            func.date(Appointment.appointment_date), Appointment.status
+        ).all()
+        for day, status, count in appointment_groups:
+            day = date.fromisoformat(day) if day else None
+            StatsService.increment(db, 'appointments', day=day, department=old_department, status=status, count=-count)
+            StatsService.increment(db, 'appointments', day=day, department=new_department, status=status, count=count)
+
+        active = db.query(func.count(MedicalRecord.id)).filter(
+            MedicalRecord.staff_id == staff_id,
+            MedicalRecord.admission_date.isnot(None),
+            MedicalRecord.discharge_date.is_(None)
+        ).scalar()
+        if active:
+            StatsService.increment(db, 'active_admissions', department=old_department, count=-active)
+            StatsService.increment(db, 'active_admissions', department=new_department, count=active)
+
+    @staticmethod
+    def rebuild(db: Session):
+        #Recompute every counter from the source tables
+        db.query(StatCounter).delete()
+        counters = []
+
+        patient_count = db.query(func.count(Patient.id)).scalar()
+        counters.append(StatCounter(metric='patients', count=patient_count, total=0))
+
+        staff_department = func.coalesce(Staff.department, '')
+        for department, count in db.query(
+            staff_department, func.count(Staff.id)
+        ).group_by(staff_department):
+            counters.append(StatCounter(metric='staff', department=department, count=count, total=0))
+
+        appointment_day = func.coalesce(func.date(Appointment.appointment_date), '')
+        appointment_department = func.coalesce(Staff.department, '')
+        for day, department, status, count in db.query(
+            appointment_day, appointment_department, Appointment.status, func.count(Appointment.id)
+        ).outerjoin(Staff, Staff.id == Appointment.staff_id).filter(
+            Appointment.deleted_at.is_(None)
+        ).execution_options(include_deleted=True).group_by(
+            appointment_day, appointment_department, Appointment.status
+        ):
+            counters.append(StatCounter(metric='appointments', day=day, department=department,
+                                        status=str(status), count=count, total=0))
+
+        record_department = func.coalesce(Staff.department, '')
+        for department, count in db.query(
+            record_department, func.count(MedicalRecord.id)
+        ).outerjoin(Staff, Staff.id == MedicalRecord.staff_id).filter(
+            MedicalRecord.admission_date.isnot(None),
+            MedicalRecord.discharge_date.is_(None),
+            MedicalRecord.deleted_at.is_(None)
+        ).execution_options(include_deleted=True).group_by(record_department):
+            counters.append(StatCounter(metric='active_admissions', department=department, count=count, total=0))
+
+        for status, count, total in db.query(
+            Bill.status, func.count(Bill.id), func.coalesce(func.sum(Bill.amount), 0)
+        ).group_by(Bill.status):
+            counters.append(StatCounter(metric='bills', status=str(status), count=count, total=total))
+
+        db.add_all(counters)
+        db.commit()
+        return len(counters)
+
+    @staticmethod
+    def get_dashboard(db: Session, day: date = None):
+        #Read the dashboard figures from the counter table only
+        day = day or date.today()
+
+        def buckets(metric, key, **filters):
+            column = getattr(StatCounter, key)
+            query = db.query(column, func.sum(StatCounter.count), func.sum(StatCounter.total)).filter(
+                StatCounter.metric == metric
+            )
+            for name, value in filters.items():
+                query = query.filter(getattr(StatCounter, name) == value)
+            return {k or 'Unassigned': (c, t) for k, c, t in query.group_by(column) if c}
+
+        appointments_today = buckets('appointments', 'status', day=day.isoformat())
+        admissions = buckets('active_admissions', 'department')
+        bills = buckets('bills', 'status')
+        patients = buckets('patients', 'metric')
+        staff = buckets('staff', 'department')
+
+        return {
+            'day': day,
+            'total_patients': sum(c for c, _ in patients.values()),
+            'total_staff': sum(c for c, _ in staff.values()),
+            'appointments_today': {status: c for status, (c, _) in appointments_today.items()},
+            'active_admissions': {department: c for department, (c, _) in admissions.items()},
+            'bills': bills
+        }
@@ -0,0 +1,74 @@
+import time
+from sqlalchemy import delete, exists, select
+from sqlalchemy.orm import Session
+from app.models import (Patient, PatientSearchKey, Staff, StaffWorkingHours, StaffShift, Appointment, AppointmentSeries, MedicalRecord, Bill,
+                        Prescription, OutboxMessage)
+from app.audit import audit_log
+from datetime import datetime, timedelta
+
+# Tombstones younger than this can still be restored; purge removes the rest
+PURGE_AFTER = timedelta(days=30)
+
+class TrashService:
+    # Soft-deleted rows stay in their tables with deleted_at set. Listing and
+    # purging them reads the partial ix_<table>_deleted_at indexes, which
+    # only hold tombstones and stay small however large the tables grow.
+
+    @staticmethod
+    def get_deleted(db: Session, model, limit: int = 50):
+        #Most recently deleted rows of a soft-deletable model
+        return db.query(model).filter(model.deleted_at.isnot(None)).execution_options(
+            include_deleted=True
+        ).order_by(model.deleted_at.desc()).limit(limit).all()
+
+    @staticmethod
+    def purge_plan():
+        #(table, extra conditions, dependent rows deleted first) in foreign key order
+        appointments = Appointment.__table__
+        series = AppointmentSeries.__table__
+        records = MedicalRecord.__table__
+        bills = Bill.__table__
+        patients = Patient.__table__
+        staff = Staff.__table__
+        prescriptions = Prescription.__table__
+        outbox = OutboxMessage.__table__
+        search_keys = PatientSearchKey.__table__
+        working_hours = StaffWorkingHours.__table__
+        shifts = StaffShift.__table__
+        # Parents go only once nothing (live or tombstoned) references them any more
+        return [
+            (appointments, [], []),
+            (records, [], [prescriptions.c.record_id]),
+            (bills, [], []),
+            (series, [~exists().where(appointments.c.series_id == series.c.id)], []),
+            (patients, [~exists().where(table.c.patient_id == patients.c.id)
+                        for table in (appointments, series, records, bills)], [outbox.c.patient_id, search_keys.c.patient_id]),
+            (staff, [~exists().where(table.c.staff_id == staff.c.id)
+                     for table in (appointments, series, records)], [working_hours.c.staff_id, shifts.c.staff_id]),
+        ]
+
+    @staticmethod
+    def purge(db: Session, older_than: timedelta = PURGE_AFTER, batch_size: int = 500, pause: float = 0.05, now: datetime = None):
+        #Physically delete rows tombstoned before now - older_than, one short transaction per batch; returns counts per table
+        cutoff = (now or datetime.utcnow()) - older_than
+        purged = {}
+        for table, conditions, dependents in TrashService.purge_plan():
+            purged[table.name] = 0
+            while True:
+                ids = db.execute(
+                    select(table.c.id).where(table.c.deleted_at < cutoff, *conditions)
+                    .order_by(table.c.deleted_at).limit(batch_size).execution_options(include_deleted=True)
+                ).scalars().all()
+                if not ids:
+                    break
+                for column in dependents:
+                    db.execute(delete(column.table).where(column.in_(ids)))
+                db.execute(delete(table).where(table.c.id.in_(ids)))
+                db.commit()
+                # Core deletes bypass the session hooks, so the purge is recorded here
+                audit_log.record('purge', table.name, changes={'ids': ids}, facility=db.info.get('facility'))
+                purged[table.name] += len(ids)
+                # Let other writers take the lock between batches
+                if pause and len(ids) == batch_size:
+                    time.sleep(pause)
+        return purged
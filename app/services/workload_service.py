@@ -0,0 +1,139 @@
+import time
+from sqlalchemy import select, func, case, union, and_, event
+from sqlalchemy.orm import Session
+from app.models import Appointment, AppointmentStatus, MedicalRecord, Staff, status_equals
+from datetime import date, datetime, timedelta
+
+# Per-staff workload: appointment counts for the day and its week, average
+# appointments per day, no-show and cancellation rates over a trailing
+# window, and active patients (an open admission or an upcoming scheduled
+# appointment with them). Each figure set is one grouped query; results are
+# cached per (facility, day, department, window) for WORKLOAD_CACHE_SECONDS and
+# dropped whenever a session in this process commits a change to an
+# appointment or medical record (bulk Core updates only age out).
+WORKLOAD_CACHE_SECONDS = 300
+WORKLOAD_WINDOW_DAYS = 30
+SUGGESTION_ROLE = 'Doctor'
+
+_cache = {}
+
+@event.listens_for(Session, 'after_flush')
+def _note_workload_changes(session, flush_context):
+    # Changed appointments or admissions make the cached figures stale once they commit
+    for instances in (session.new, session.dirty, session.deleted):
+        if any(isinstance(instance, (Appointment, MedicalRecord)) for instance in instances):
+            session.info['workload_changed'] = True
+            return
+
+@event.listens_for(Session, 'after_commit')
+def _drop_stale_workload(session):
+    if session.info.pop('workload_changed', False):
+        WorkloadService.invalidate()
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_workload_changes(session):
+    session.info.pop('workload_changed', None)
+
+class WorkloadService:
+    @staticmethod
+    def invalidate():
+        #Forget cached workload figures, after a change to appointments or admissions
+        _cache.clear()
+
+    @staticmethod
+    def staff_workload(db: Session, day: date = None, department: str = None, days: int = WORKLOAD_WINDOW_DAYS):
+        #Workload figures for every live staff member (optionally one department), busiest first
+        day = day or date.today()
+        if days < 1:
+            raise ValueError("The window must be at least one day")
+        key = (db.info.get('facility'), day, department.lower() if department else None, days)
+        cached = _cache.get(key)
+        if cached and time.monotonic() - cached[0] < WORKLOAD_CACHE_SECONDS:
+            return cached[1]
+
+        results = WorkloadService._compute(db, day, department, days)
+        _cache[key] = (time.monotonic(), results)
+        return results
+
+    @staticmethod
+    def _compute(db: Session, day: date, department: str, days: int):
+        #Run the grouped queries behind staff_workload
+        day_start = datetime.combine(day, datetime.min.time())
+        day_end = day_start + timedelta(days=1)
+        week_start = day_start - timedelta(days=day.weekday())
+        week_end = week_start + timedelta(days=7)
+        window_start = day_end - timedelta(days=days)
+        now = datetime.now()
+
+        def count_if(*conditions):
+            return func.sum(case((and_(*conditions), 1), else_=0))
+
+        # One pass over the appointments between the window start and the end of the week;
+        # cancelled ones count towards the cancellation rate but not the load
+        booked = ~status_equals(Appointment.status, AppointmentStatus.CANCELLED)
+        appointments = select(
+            Appointment.staff_id,
+            count_if(Appointment.appointment_date >= day_start, Appointment.appointment_date < day_end, booked).label('today'),
+            count_if(Appointment.appointment_date >= week_start, Appointment.appointment_date < week_end, booked).label('week'),
+            count_if(Appointment.appointment_date >= window_start, Appointment.appointment_date < day_end, booked).label('booked'),
+            count_if(Appointment.appointment_date >= window_start, Appointment.appointment_date < day_end).label('in_window'),
+            # Rates are over appointments already due, the only ones that can have been missed
+            count_if(Appointment.appointment_date >= window_start, Appointment.appointment_date < min(day_end, now)).label('due'),
+            count_if(Appointment.appointment_date >= window_start, Appointment.appointment_date < min(day_end, now),
+                     status_equals(Appointment.status, AppointmentStatus.NO_SHOW)).label('no_shows'),
+            count_if(Appointment.appointment_date >= window_start, Appointment.appointment_date < day_end,
+                     status_equals(Appointment.status, AppointmentStatus.CANCELLED)).label('cancelled')
+        ).where(
+            Appointment.appointment_date >= min(window_start, week_start),
+            Appointment.appointment_date < max(day_end, week_end)
+        ).group_by(Appointment.staff_id).subquery()
+
+        # Distinct patients per staff member across open admissions and upcoming appointments
+        open_admissions = select(MedicalRecord.staff_id, MedicalRecord.patient_id).where(
+            MedicalRecord.admission_date.isnot(None), MedicalRecord.discharge_date.is_(None)
+        )
+        upcoming = select(Appointment.staff_id, Appointment.patient_id).where(
+            status_equals(Appointment.status, AppointmentStatus.SCHEDULED),
+            Appointment.appointment_date >= now
+        )
+        active_pairs = union(open_admissions, upcoming).subquery()
+        active = select(
+            active_pairs.c.staff_id, func.count().label('patients')
+        ).group_by(active_pairs.c.staff_id).subquery()
+
+        query = select(
+            Staff.id, Staff.first_name, Staff.last_name, Staff.role, Staff.department,
+            appointments.c.today, appointments.c.week, appointments.c.booked, appointments.c.in_window, appointments.c.due,
+            appointments.c.no_shows, appointments.c.cancelled, active.c.patients
+        ).outerjoin(appointments, appointments.c.staff_id == Staff.id).outerjoin(active, active.c.staff_id == Staff.id)
+        if department:
+            query = query.where(func.lower(Staff.department) == department.lower())
+
+        results = []
+        for row in db.execute(query):
+            window = row.in_window or 0
+            due = row.due or 0
+            results.append({
+                'staff_id': row.id,
+                'name': f"{row.first_name} {row.last_name}",
+                'role': row.role,
+                'department': row.department,
+                'today': row.today or 0,
+                'week': row.week or 0,
+                'per_day': round((row.booked or 0) / days, 1),
+                'no_show_rate': round((row.no_shows or 0) / due * 100, 1) if due else None,
+                'cancellation_rate': round((row.cancelled or 0) / window * 100, 1) if window else None,
+                'active_patients': row.patients or 0
+            })
+        results.sort(key=lambda entry: (-entry['today'], -entry['week'], -entry['active_patients'], entry['staff_id']))
+        return results
+
+    @staticmethod
+    def suggest_staff(db: Session, department: str, day: date = None, role: str = SUGGESTION_ROLE, limit: int = 3):
+        #Least loaded staff in a department for an appointment on day: fewest that day, then that week, then active patients
+        candidates = [entry for entry in WorkloadService.staff_workload(db, day, department)
+                      if not role or (entry['role'] or '').lower() == role.lower()]
+        if not candidates:
+            raise ValueError(f"No {role or 'staff'} found in department '{department}'")
+        candidates.sort(key=lambda entry: (entry['today'], entry['week'], entry['active_patients'], entry['staff_id']))
+        return candidates[:limit]
@@ -0,0 +1,226 @@
+import argparse
+import csv
+import html
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import groupby
+
+# Add the parent directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select
+from app.facilities import MAIN_FACILITY, current_facility, set_facility
+from app.models import Bill, BillStatus, Patient, OUTSTANDING_BILL_STATUSES, status_in
+
+# Month-end statements for every patient with unpaid or overdue bills. One
+# query streams the bills ordered by patient (served by the partial index
+# ix_bills_outstanding_patient, so SQLite never sorts), rows are grouped
+# into statements as they arrive, and batches of statements are rendered and
+# written by a process pool. Only a bounded number of batches is in flight,
+# so memory stays flat however many patients owe money.
+
+STATEMENTS_DIR = 'statements'
+FORMATS = {'markdown': '.md', 'html': '.html'}
+BATCH_SIZE = 500
+HOSPITAL_NAME = 'Valy Hospital'
+
+def outstanding_bills_query():
+    return select(
+        Bill.patient_id, Patient.first_name, Patient.last_name, Patient.address, Patient.contact_number,
+        Patient.email, Bill.id.label('bill_id'), Bill.date_issued, Bill.due_date, Bill.description,
+        Bill.status, Bill.amount
+    ).join(Patient, Bill.patient_id == Patient.id).where(
+        # Runs on a plain connection, so deleted rows are filtered here
+        status_in(Bill.status, OUTSTANDING_BILL_STATUSES), Bill.deleted_at.is_(None), Patient.deleted_at.is_(None)
+    ).order_by(Bill.patient_id, Bill.due_date, Bill.id)
+
+def stream_statements(connection, as_of=None, yield_per=2000):
+    #Yield one statement dict per patient with outstanding bills, in patient id order
+    as_of = as_of or date.today()
+    rows = connection.execution_options(yield_per=yield_per).execute(outstanding_bills_query())
+    for patient_id, patient_rows in groupby(rows, key=lambda row: row.patient_id):
+        patient_rows = list(patient_rows)
+        patient = patient_rows[0]
+        bills = []
+        for row in patient_rows:
+            # Unpaid bills past their due date are shown as overdue even before the status changes
+            overdue = row.status == BillStatus.OVERDUE or (row.due_date is not None and row.due_date < as_of)
+            bills.append({
+                'id': row.bill_id, 'issued': row.date_issued, 'due': row.due_date,
+                'description': row.description or '', 'status': 'Overdue' if overdue else row.status.label,
+                'amount': row.amount
+            })
+        yield {
+            'patient_id': patient_id,
+            'name': f"{patient.first_name} {patient.last_name}",
+            'address': patient.address or '',
+            'contact': patient.contact_number,
+            'email': patient.email or '',
+            'as_of': as_of,
+            'bills': bills,
+            'balance': sum((bill['amount'] for bill in bills), Decimal('0.00')),
+            'overdue': sum((bill['amount'] for bill in bills if bill['status'] == 'Overdue'), Decimal('0.00'))
+        }
+
+def render_markdown(statement):
+    lines = [
+        f"# {HOSPITAL_NAME} - Patient Statement",
+        "",
+        f"**Statement date:** {statement['as_of']}  ",
+        f"**Patient:** {statement['name']} (ID {statement['patient_id']})  ",
+        f"**Address:** {statement['address']}  ",
+        f"**Contact:** {statement['contact']} {statement['email']}".rstrip(),
+        "",
+        "| Bill | Issued | Due | Description | Status | Amount |",
+        "|---:|---|---|---|---|---:|",
+    ]
+    for bill in statement['bills']:
+        description = bill['description'].replace('|', '\\|')
+        lines.append(f"| {bill['id']} | {bill['issued'] or ''} | {bill['due'] or ''} | {description} "
+                     f"| {bill['status']} | {bill['amount']:,.2f} |")
+    lines += [
+        "",
+        f"**Total due:** {statement['balance']:,.2f}  ",
+        f"**Of which overdue:** {statement['overdue']:,.2f}",
+        ""
+    ]
+    return "\n".join(lines)
+
+def render_html(statement):
+    e = lambda value: html.escape(str(value))
+    rows = "\n".join(
+        f"<tr><td>{bill['id']}</td><td>{e(bill['issued'] or '')}</td><td>{e(bill['due'] or '')}</td>"
+        f"<td>{e(bill['description'])}</td><td>{bill['status']}</td><td class=\"amount\">{bill['amount']:,.2f}</td></tr>"
+        for bill in statement['bills']
+    )
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Statement {statement['patient_id']}</title>
+<style>body{{font-family:sans-serif}} table{{border-collapse:collapse}} td,th{{border:1px solid #999;padding:4px 8px}} .amount{{text-align:right}}</style>
+</head><body>
+<h1>{e(HOSPITAL_NAME)} - Patient Statement</h1>
+<p>Statement date: {statement['as_of']}<br>
+Patient: {e(statement['name'])} (ID {statement['patient_id']})<br>
+Address: {e(statement['address'])}<br>
+Contact: {e(statement['contact'])} {e(statement['email'])}</p>
+<table>
+<tr><th>Bill</th><th>Issued</th><th>Due</th><th>Description</th><th>Status</th><th>Amount</th></tr>
+{rows}
+</table>
+<p><strong>Total due: {statement['balance']:,.2f}</strong><br>Of which overdue: {statement['overdue']:,.2f}</p>
+</body></html>
+"""
+
+RENDERERS = {'markdown': render_markdown, 'html': render_html}
+
+def write_batch(statements, directory, fmt):
+    #Worker: render and write a batch of statements; returns their manifest rows
+    render = RENDERERS[fmt]
+    manifest = []
+    for statement in statements:
+        file_name = f"statement_{statement['patient_id']}{FORMATS[fmt]}"
+        with open(os.path.join(directory, file_name), 'w', encoding='utf-8') as f:
+            f.write(render(statement))
+        manifest.append([statement['patient_id'], statement['name'], len(statement['bills']),
+                         statement['balance'], statement['overdue'], file_name])
+    return manifest
+
+def _batches(statements, size):
+    batch = []
+    for statement in statements:
+        batch.append(statement)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def generate_statements(engine, directory=None, fmt='markdown', workers=None, as_of=None,
+                        batch_size=BATCH_SIZE, progress=None):
+    #Write a statement per patient with outstanding bills plus manifest.csv; returns the summary
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format: {fmt}. Choose from {', '.join(FORMATS)}")
+    as_of = as_of or date.today()
+    if not directory:
+        # Facilities other than main write under statements/<code>/<date>
+        facility = current_facility()
+        parent = STATEMENTS_DIR if facility == MAIN_FACILITY else os.path.join(STATEMENTS_DIR, facility)
+        directory = os.path.join(parent, as_of.isoformat())
+    os.makedirs(directory, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+
+    started = time.perf_counter()
+    manifest = []
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        if pool:
+            # Start the workers before the database connection is opened, so
+            # no forked process inherits it
+            pool.submit(os.getpid).result()
+        with engine.connect() as connection:
+            pending = set()
+            for batch in _batches(stream_statements(connection, as_of), batch_size):
+                if not pool:
+                    manifest += write_batch(batch, directory, fmt)
+                else:
+                    # Keep the reader at most two batches per worker ahead of the writers
+                    if len(pending) >= workers * 2:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            manifest += future.result()
+                    pending.add(pool.submit(write_batch, batch, directory, fmt))
+                if progress:
+                    progress(len(manifest))
+            for future in pending:
+                manifest += future.result()
+    finally:
+        if pool:
+            pool.shutdown()
+
+    manifest.sort(key=lambda row: row[0])
+    with open(os.path.join(directory, 'manifest.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["Patient ID", "Name", "Bills", "Balance", "Overdue", "File"])
+        writer.writerows(manifest)
+
+    summary = {
+        'as_of': as_of.isoformat(),
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'format': fmt,
+        'statements': len(manifest),
+        'bills': sum(row[2] for row in manifest),
+        'balance': str(sum((row[3] for row in manifest), Decimal('0.00'))),
+        'overdue': str(sum((row[4] for row in manifest), Decimal('0.00'))),
+        'workers': workers,
+        'seconds': round(time.perf_counter() - started, 2),
+        'directory': directory
+    }
+    with open(os.path.join(directory, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+def main():
+    # Command line entry point: python -m app.statements
+    parser = argparse.ArgumentParser(description='Generate statements for patients with outstanding bills')
+    parser.add_argument('--format', choices=list(FORMATS), default='markdown')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--as-of', type=date.fromisoformat, help='statement date (default: today)')
+    parser.add_argument('--output', help='output directory (default: statements/<date>)')
+    parser.add_argument('--facility', help='facility code (default: HOSPITAL_FACILITY or main)')
+    args = parser.parse_args()
+    if args.facility:
+        set_facility(args.facility)
+
+    from app.database import init_db, read_engine
+    init_db()
+    summary = generate_statements(read_engine('replica'), args.output, args.format, args.workers, args.as_of,
+                                  progress=lambda count: print(f"\r  {count} statements", end='', flush=True))
+    print(f"\n{summary['statements']} statements, balance {Decimal(summary['balance']):,.2f}, "
+          f"in {summary['seconds']}s -> {summary['directory']}")
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,9 @@
 # important import modules
 import re
 from datetime import datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from sqlalchemy.orm.exc import StaleDataError
+from app.models import AppointmentStatus, BillStatus
 
 # name validation using regex patterns to allow letters and spaces only
 def validate_name(name):
@@ -20,6 +23,13 @@ def validate_phone(phone):
         raise ValueError("Phone number must be 10-15 digits, optionally starting with +")
     return phone
 
+# facility code: lowercase letters, digits and underscores, starting with a letter (used as a file name)
+def validate_facility(code):
+    code = str(code or '').strip().lower()
+    if not re.match(r'^[a-z][a-z0-9_]{0,29}$', code):
+        raise ValueError("Facility code must be 1-30 lowercase letters, digits or underscores, starting with a letter")
+    return code
+
 # date validator format (YYYY-MM-DD)
 def validate_date(date_str):
     try:
@@ -49,4 +59,57 @@ def validate_positive_number(value, field_name):
             raise ValueError(f"{field_name} must be a positive number")
         return num
     except ValueError:
-        raise ValueError(f"{field_name} must be a valid number")
\ No newline at end of file
+        raise ValueError(f"{field_name} must be a valid number")
+
+def validate_amount(value, field_name):
+    #Parse a money amount exactly, rounded half-up to cents
+    try:
+        amount = Decimal(str(value).strip().replace(',', ''))
+    except InvalidOperation:
+        raise ValueError(f"{field_name} must be a valid amount")
+    if not amount.is_finite() or amount <= 0:
+        raise ValueError(f"{field_name} must be a positive amount")
+    return amount.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+# appointment length in whole minutes, from 5 minutes to a full 8-hour day
+def validate_duration(minutes):
+    try:
+        minutes = int(str(minutes).strip())
+    except ValueError:
+        raise ValueError("Duration must be a whole number of minutes")
+    if not 5 <= minutes <= 480:
+        raise ValueError("Duration must be between 5 and 480 minutes")
+    return minutes
+
+# working hours time of day (HH:MM)
+def validate_time(time_str):
+    try:
+        return datetime.strptime(time_str.strip(), '%H:%M').time()
+    except ValueError:
+        raise ValueError("Time must be in HH:MM format")
+
+def validate_appointment_status(status):
+    return AppointmentStatus.parse(status)
+
+def validate_bill_status(status):
+    return BillStatus.parse(status)
+
+class ConflictError(ValueError):
+    # Raised when a record was changed by someone else since it was read;
+    # current_version lets the caller re-read and merge before retrying
+    def __init__(self, label, current_version=None):
+        super().__init__(f"{label} was changed by someone else since you opened it")
+        self.current_version = current_version
+
+# optimistic concurrency check: the version the user read must still be the stored one
+def validate_version(record, expected_version, label):
+    if expected_version is not None and record.version != int(expected_version):
+        raise ConflictError(label, record.version)
+
+def commit_or_conflict(db, label):
+    #Commit, turning a lost version race at flush time into a ConflictError
+    try:
+        db.commit()
+    except StaleDataError:
+        db.rollback()
+        raise ConflictError(label)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# Audit overhead benchmark: times medical record reads and read-modify-write
+# updates through the services with the audit hooks removed and installed,
+# then how fast the buffered events are written to hospital_audit.db.
+#
+#   python benchmarks/bench_audit.py [--patients 5000] [--operations 2000] [--rounds 4]
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_reports import populate
+
+
+def run(operations, record_ids, seed):
+    from app.database import SessionLocal
+    from app.services.medical_record_service import MedicalRecordService
+
+    rng = random.Random(seed)
+    reads, updates = [], []
+    with SessionLocal() as db:
+        for i in range(operations):
+            record_id = rng.choice(record_ids)
+            started = time.perf_counter()
+            record = MedicalRecordService.get_medical_record(db, record_id)
+            reads.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            MedicalRecordService.update_medical_record(db, record_id, {'notes': f'note {i}'}, record.version)
+            updates.append(time.perf_counter() - started)
+            # Forget loaded records so every read goes to the database
+            db.expunge_all()
+    return reads, updates
+
+
+def summary(label, timings):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95)]
+    return f"{label:<16}{statistics.median(timings) * 1e6:>10,.0f}{p95 * 1e6:>10,.0f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Audit overhead benchmark')
+    parser.add_argument('--patients', type=int, default=5000)
+    parser.add_argument('--operations', type=int, default=2000, help='reads + updates per mode')
+    parser.add_argument('--rounds', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cwd:
+        os.chdir(cwd)
+        from sqlalchemy import select
+        from app import audit
+        from app.database import engine, init_db
+        from app.models import MedicalRecord
+
+        init_db()
+        populate(engine, args.patients)
+        with engine.connect() as connection:
+            record_ids = connection.execute(select(MedicalRecord.id)).scalars().all()
+        print(f"{args.patients} patients, {len(record_ids)} medical records, {args.operations} reads + updates\n")
+        print(f"{'':<16}{'median us':>10}{'p95 us':>10}")
+
+        # Warm the page cache and statement caches before timing anything
+        run(args.operations // 4, record_ids, 0)
+        # Keep the writer thread out of the timings; the buffer is written at the end
+        audit.audit_log.flush_size = audit.audit_log.flush_interval = 10 ** 9
+
+        # Alternate plain and audited rounds so database growth does not favour either
+        timings = {False: ([], []), True: ([], [])}
+        for round_number in range(args.rounds):
+            for audited in ((False, True) if round_number % 2 == 0 else (True, False)):
+                audit.install() if audited else audit.uninstall()
+                reads, updates = run(args.operations // args.rounds, record_ids, round_number * 2 + audited + 1)
+                timings[audited][0].extend(reads)
+                timings[audited][1].extend(updates)
+
+        print(summary('read, no audit', timings[False][0]))
+        print(summary('update, no audit', timings[False][1]))
+        print(summary('read, audited', timings[True][0]))
+        print(summary('update, audited', timings[True][1]))
+        plain = statistics.median(timings[False][0]) + statistics.median(timings[False][1])
+        audited = statistics.median(timings[True][0]) + statistics.median(timings[True][1])
+        print(f"\nmedian overhead per read+update: {audited / plain - 1:+.1%}")
+
+        # Repeated reads of a record within a session are coalesced, so there are fewer events than operations
+        buffered = len(audit.audit_log.buffer)
+        started = time.perf_counter()
+        audit.audit_log.flush()
+        seconds = time.perf_counter() - started
+        print(f"{buffered} buffered events written in {seconds * 1000:.0f} ms ({buffered / seconds:,.0f} events/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# Backup benchmark: grows a synthetic database to the requested size, then
+# times online backups at several page-step sizes while a writer thread keeps
+# committing (reporting its worst commit latency and how often SQLite had to
+# restart the copy), followed by compression, verification and restore.
+#
+#   python benchmarks/bench_backup.py [--size-mb 2048] [--steps -1 1024 16384]
+
+import argparse
+import os
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+ROWS_PER_BATCH = 50000
+
+
+def grow(path, size_mb):
+    # Medical records with about 1 KB of partly repetitive text each
+    connection = sqlite3.connect(path)
+    target = size_mb * 1024 * 1024
+    while os.path.getsize(path) < target:
+        connection.execute(f"""
+            WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < {ROWS_PER_BATCH})
+            INSERT INTO medical_records (patient_id, staff_id, diagnosis, treatment, admission_date,
+                                         discharge_date, medications, notes, created_at)
+            SELECT abs(random()) % 100000 + 1, abs(random()) % 500 + 1,
+                   'Diagnosis ' || (abs(random()) % 200),
+                   'Treatment plan ' || hex(randomblob(40)),
+                   date('2023-01-01', '+' || (abs(random()) % 1000) || ' days'),
+                   date('2023-01-01', '+' || (abs(random()) % 1000 + 5) || ' days'),
+                   'Amoxicillin 500mg twice daily, Paracetamol 1g as needed',
+                   printf('%.600c', 'x') || hex(randomblob(120)),
+                   datetime('now')
+            FROM n
+        """)
+        connection.commit()
+    connection.close()
+
+
+class Writer(threading.Thread):
+    # Small committed inserts, as the CLI would make, timing each commit
+    def __init__(self, path, interval=0.005):
+        super().__init__(daemon=True)
+        self.path = path
+        self.interval = interval
+        self.latencies = []
+        self.stop = threading.Event()
+
+    def run(self):
+        connection = sqlite3.connect(self.path, timeout=60)
+        while not self.stop.is_set():
+            start = time.perf_counter()
+            connection.execute("INSERT INTO stat_counters (metric, day, department, status, count, total) "
+                               "VALUES ('bench', '', '', '', 1, 0) ON CONFLICT DO UPDATE SET count = count + 1")
+            connection.commit()
+            self.latencies.append((time.perf_counter() - start) * 1000)
+            time.sleep(self.interval)
+        connection.close()
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backup and restore benchmark')
+    parser.add_argument('--size-mb', type=int, default=2048)
+    parser.add_argument('--steps', type=int, nargs='+', default=[-1, 1024, 16384],
+                        help='pages copied per backup step (-1: everything in one step)')
+    parser.add_argument('--no-writer', action='store_true', help='back up an idle database')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cwd:
+        os.chdir(cwd)
+        from app.database import DATABASE_PATH, init_db, engine
+        from app import backup
+
+        init_db()
+        engine.dispose()
+        seconds, _ = timed(grow, DATABASE_PATH, args.size_mb)
+        size_mb = os.path.getsize(DATABASE_PATH) / 1024 / 1024
+        print(f"Synthetic database: {size_mb:,.0f} MB built in {seconds:.1f}s\n")
+
+        print(f"{'pages/step':>10}{'seconds':>9}{'MB/s':>8}{'restarts':>10}{'commits':>9}{'p99 ms':>8}{'max ms':>8}")
+        for pages in args.steps:
+            writer = None if args.no_writer else Writer(DATABASE_PATH)
+            if writer:
+                writer.start()
+            seconds, manifest = timed(backup.create_backup, compress=False, pages=pages, rotate=False,
+                                      label=f'step{pages}')
+            latencies = []
+            if writer:
+                writer.stop.set()
+                writer.join()
+                latencies = sorted(writer.latencies)
+            p99 = latencies[int(len(latencies) * 0.99)] if latencies else 0
+            print(f"{pages:>10}{seconds:>9.1f}{size_mb / seconds:>8.0f}{manifest['restarts']:>10}"
+                  f"{len(latencies):>9}{p99:>8.1f}{max(latencies, default=0):>8.1f}")
+            os.remove(os.path.join(backup.BACKUP_DIR, manifest['file']))
+            os.remove(os.path.join(backup.BACKUP_DIR, manifest['name'] + '.json'))
+
+        seconds, manifest = timed(backup.create_backup, compress=True, rotate=False)
+        compressed_mb = manifest['size'] / 1024 / 1024
+        print(f"\nCompressed backup: {seconds:.1f}s total ({manifest['copy_seconds']}s copying), "
+              f"{compressed_mb:,.0f} MB ({size_mb / compressed_mb:.1f}x smaller)")
+        seconds, _ = timed(backup.checksum, os.path.join(backup.BACKUP_DIR, manifest['file']))
+        print(f"SHA-256 of the compressed file: {seconds:.1f}s")
+        seconds, _ = timed(backup.verify_backup, manifest)
+        print(f"Verify (checksum, decompress, integrity_check): {seconds:.1f}s")
+        seconds, safety = timed(backup.restore_backup, manifest)
+        print(f"Restore (verify, safety backup, copy back, quick_check): {seconds:.1f}s")
+
+        timings = [timed(backup.integrity_check, DATABASE_PATH)[0] for _ in range(3)]
+        print(f"integrity_check of the restored database: {statistics.median(timings):.1f}s median")
+        shutil.rmtree(backup.BACKUP_DIR)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# Optimistic concurrency benchmark: N processes repeatedly read a bill, wait
+# (a desk "editing"), then add one cent with update_bill(expected_version),
+# re-reading and retrying on ConflictError. Each round reports throughput and
+# conflict rate, and checks that no increment was lost.
+#
+#   python benchmarks/bench_contention.py [--workers 1 2 4 8] [--hot 1 10 1000] [--updates 200]
+
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from decimal import Decimal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+CENT = Decimal('0.01')
+
+
+def worker(cwd, bill_ids, updates, think, seed):
+    # Runs in a fresh (spawned) process with its own engine on the shared file
+    os.chdir(cwd)
+    from app.database import SessionLocal
+    from app.services.billing_service import BillingService
+    from app.validators import ConflictError
+
+    rng = random.Random(seed)
+    committed = conflicts = 0
+    started = time.perf_counter()
+    with SessionLocal() as db:
+        while committed < updates:
+            bill_id = rng.choice(bill_ids)
+            while True:
+                bill = BillingService.get_bill(db, bill_id)
+                version, amount = bill.version, bill.amount
+                # End the read; the write below starts from a fresh transaction
+                db.rollback()
+                if think:
+                    time.sleep(think)
+                try:
+                    BillingService.update_bill(db, bill_id, {'amount': amount + CENT}, version)
+                    break
+                except ConflictError:
+                    db.rollback()
+                    conflicts += 1
+            committed += 1
+    return committed, conflicts, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Optimistic concurrency benchmark')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--hot', type=int, nargs='+', default=[1, 10, 1000], help='bills shared by all workers')
+    parser.add_argument('--updates', type=int, default=200, help='committed updates per worker')
+    parser.add_argument('--think-ms', type=float, default=1.0, help='pause between read and write')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cwd:
+        os.chdir(cwd)
+        from sqlalchemy import func, insert, select
+        from app.database import engine, init_db
+        from app.models import Bill, Patient
+
+        init_db()
+        bill_count = max(args.hot)
+        with engine.begin() as connection:
+            connection.execute(insert(Patient).values(first_name='Patient', last_name='Hot', date_of_birth=date(1980, 1, 1),
+                                                      gender='Other', contact_number='0711111111'))
+            connection.execute(insert(Bill), [dict(patient_id=1, amount=Decimal('100.00'), description='hot')
+                                              for _ in range(bill_count)])
+        engine.dispose()
+
+        context = multiprocessing.get_context('spawn')
+        print(f"{os.cpu_count()} CPUs, {args.updates} committed updates per worker, "
+              f"{args.think_ms:g} ms between read and write\n")
+        print(f"{'hot bills':>9}{'workers':>8}{'updates/s':>11}{'conflicts':>11}{'retry rate':>12}{'lost':>6}")
+        for hot in args.hot:
+            bill_ids = list(range(1, hot + 1))
+            for workers in args.workers:
+                with engine.connect() as connection:
+                    before = connection.execute(select(func.sum(Bill.amount)).where(Bill.id <= hot)).scalar()
+                started = time.perf_counter()
+                with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+                    results = list(pool.map(worker, [cwd] * workers, [bill_ids] * workers, [args.updates] * workers,
+                                            [args.think_ms / 1000] * workers, range(workers)))
+                seconds = time.perf_counter() - started
+                with engine.connect() as connection:
+                    after = connection.execute(select(func.sum(Bill.amount)).where(Bill.id <= hot)).scalar()
+                engine.dispose()
+
+                committed = sum(result[0] for result in results)
+                conflicts = sum(result[1] for result in results)
+                # Every committed update added one cent; anything missing was overwritten
+                lost = committed - int((after - before) / CENT)
+                # Wall time includes spawning the workers; throughput uses their own timings
+                busy = max(result[2] for result in results)
+                print(f"{hot:>9}{workers:>8}{committed / busy:>11,.0f}{conflicts:>11}"
+                      f"{conflicts / (committed + conflicts):>12.1%}{lost:>6}   ({seconds:.1f}s wall)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# Shift roster benchmark: N departments staffed around the clock (three
+# 8-hour shifts a day plus a 24-hour on-call) over a number of days, then the
+# latency of the on-call board queries and of a month's coverage read from
+# department_coverage against computing it from the shifts each time.
+#
+#   python benchmarks/bench_coverage.py [--departments 20] [--staff 60] [--days 365] [--calls 200]
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def populate(engine, departments, staff, days, seed=5):
+    # Returns the number of shifts inserted; the roster runs from days / 2 ago to days / 2 ahead
+    from sqlalchemy import insert
+    from app.models import ShiftKind, Staff, StaffShift
+
+    rng = random.Random(seed)
+    names = [f'Department {i}' for i in range(departments)]
+    with engine.begin() as connection:
+        connection.execute(insert(Staff), [
+            dict(first_name='Staff', last_name=str(i), role='Doctor' if i % 3 == 0 else 'Nurse', department=names[i % departments],
+                 contact_number='0700000000', hire_date=date(2020, 1, 1))
+            for i in range(departments * staff)
+        ])
+        members = {name: [i + 1 for i in range(departments * staff) if i % departments == d] for d, name in enumerate(names)}
+        first = datetime.combine(date.today() - timedelta(days=days // 2), datetime.min.time())
+        shifts = 0
+        for offset in range(days):
+            day = first + timedelta(days=offset)
+            rows = []
+            for name in names:
+                team = rng.sample(members[name], 10)
+                # Three on each 8-hour shift, one on call for the day
+                for start in range(3):
+                    for staff_id in team[start * 3:start * 3 + 3]:
+                        rows.append(dict(staff_id=staff_id, department=name, role='Doctor' if (staff_id - 1) % 3 == 0 else 'Nurse',
+                                         starts_at=day + timedelta(hours=7 + 8 * start),
+                                         ends_at=day + timedelta(hours=15 + 8 * start), kind=ShiftKind.REGULAR))
+                rows.append(dict(staff_id=team[9], department=name, role='Doctor' if (team[9] - 1) % 3 == 0 else 'Nurse',
+                                 starts_at=day + timedelta(hours=8), ends_at=day + timedelta(hours=32), kind=ShiftKind.ON_CALL))
+            connection.execute(insert(StaffShift), rows)
+            shifts += len(rows)
+    return names, shifts
+
+
+def timed(call, calls):
+    # Median and p95 milliseconds of calls
+    timings = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return statistics.median(timings) * 1000, timings[int(len(timings) * 0.95)] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Shift roster benchmark')
+    parser.add_argument('--departments', type=int, default=20)
+    parser.add_argument('--staff', type=int, default=60, help='staff per department')
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--calls', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cwd:
+        os.chdir(cwd)
+        from app import audit
+        from app.database import SessionLocal, engine, init_db
+        from app.services.coverage_service import CoverageService
+        from app.services.staff_service import StaffService
+
+        init_db()
+        audit.uninstall()
+        names, shifts = populate(engine, args.departments, args.staff, args.days)
+        with SessionLocal() as db:
+            started = time.perf_counter()
+            rows = CoverageService.rebuild(db)
+        print(f"{args.departments} departments, {shifts} shifts over {args.days} days; "
+              f"{rows} coverage rows built in {time.perf_counter() - started:.1f}s\n")
+
+        rng = random.Random(1)
+        today = date.today()
+        month = lambda: today + timedelta(days=rng.randrange(-args.days // 2, args.days // 2 - 30))
+        with SessionLocal() as db:
+            def computed():
+                first = month()
+                CoverageService.compute(db, rng.choice(names), first, first + timedelta(days=29))
+
+            def stored():
+                first = month()
+                StaffService.department_coverage(db, rng.choice(names), first, first + timedelta(days=29))
+
+            def add_and_remove():
+                staff_id = rng.randrange(1, args.departments * args.staff + 1)
+                moment = datetime.combine(month(), datetime.min.time()) + timedelta(hours=rng.randrange(24))
+                try:
+                    shift = StaffService.add_shift(db, staff_id, moment, moment + timedelta(hours=4))
+                except ValueError:
+                    return
+                StaffService.remove_shift(db, shift.id)
+
+            print(f"{'':<36}{'median ms':>10}{'p95 ms':>9}")
+            for label, call in [
+                ('on duty now, all departments', lambda: StaffService.on_duty(db)),
+                ('on duty now, one department', lambda: StaffService.on_duty(db, department=rng.choice(names))),
+                ('on-call board', lambda: StaffService.on_call_board(db)),
+                ('30 days coverage, from shifts', computed),
+                ('30 days coverage, from table', stored),
+                ('add and remove a shift', add_and_remove),
+            ]:
+                median, p95 = timed(call, args.calls)
+                print(f"{label:<36}{median:>10.2f}{p95:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# Cross-facility patient search benchmark: N facility databases with the same
+# number of patients each (names as in bench_patient_search.py, search keys
+# backfilled), then the latency of a fuzzy search on one facility against
+# the same search fanned out to all of them one facility at a time and in
+# parallel threads, one per facility.
+#
+#   python benchmarks/bench_facilities.py [--facilities 8] [--patients 50000] [--queries 100]
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_patient_search import FIRST_NAMES, LAST_NAMES, misspell, populate
+
+
+def timed(call, queries):
+    # Median and p95 milliseconds of call(name) over the queries
+    timings = []
+    for name in queries:
+        started = time.perf_counter()
+        call(name)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return statistics.median(timings) * 1000, timings[int(len(timings) * 0.95)] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cross-facility patient search benchmark')
+    parser.add_argument('--facilities', type=int, default=8)
+    parser.add_argument('--patients', type=int, default=50000, help='patients per facility')
+    parser.add_argument('--queries', type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cwd:
+        os.chdir(cwd)
+        from app import audit
+        from app.data_migrations import run_data_migration
+        from app.database import facilities, facility_engine, init_db, read_session
+        from app.facilities import MAIN_FACILITY, using_facility
+        from app.services.patient_service import PatientService
+
+        codes = [MAIN_FACILITY] + [f'clinic_{i}' for i in range(1, args.facilities)]
+        started = time.perf_counter()
+        for seed, code in enumerate(codes):
+            init_db(code)
+            populate(facility_engine(code), args.patients, seed=seed)
+            run_data_migration(facility_engine(code), 'backfill_patient_search_keys', 5000, 0, lambda message: None)
+        print(f"{len(facilities())} facilities of {args.patients} patients each built in "
+              f"{time.perf_counter() - started:.1f}s\n")
+        audit.uninstall()
+
+        rng = random.Random(1)
+        queries = [f"{misspell(rng, rng.choice(FIRST_NAMES))} {misspell(rng, rng.choice(LAST_NAMES))}"
+                   for _ in range(args.queries)]
+
+        def one_facility(name):
+            with using_facility(MAIN_FACILITY), read_session() as db:
+                PatientService.fuzzy_search_patients(db, name)
+
+        print(f"{'':<34}{'median ms':>10}{'p95 ms':>9}")
+        for label, call in [
+            ('one facility', one_facility),
+            (f'{len(codes)} facilities, one at a time', lambda name: PatientService.search_all_facilities(name, workers=1)),
+            (f'{len(codes)} facilities, in parallel', lambda name: PatientService.search_all_facilities(name)),
+        ]:
+            median, p95 = timed(call, queries)
+            print(f"{label:<34}{median:>10.2f}{p95:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# Listing read path benchmark: the CLI listings' rows read as ORM objects
+# (get_all_*) against the column tuples they now use (list_*), reporting
+# rows per second and the memory held per row while the list is alive.
+# Timings keep the audit trail's read logging, as the CLI does; memory is
+# measured without it, so the buffered audit events do not count as rows.
+#
+#   python benchmarks/bench_listings.py [--patients 20000] [--repeat 5]
+
+import argparse
+import gc
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_reports import populate
+
+
+def measure(session_factory, fetch, repeat):
+    # Median rows/s over fresh sessions, then bytes allocated per row by one fetch still being held
+    from app import audit
+
+    timings = []
+    for _ in range(repeat):
+        with session_factory() as db:
+            started = time.perf_counter()
+            rows = fetch(db)
+            timings.append(time.perf_counter() - started)
+    del rows
+    audit.uninstall()
+    # Write out the queued read events now, not from the writer thread while memory is traced
+    audit.audit_log.flush()
+    with session_factory() as db:
+        gc.collect()
+        tracemalloc.start()
+        rows = fetch(db)
+        held, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    audit.install()
+    return len(rows), len(rows) / statistics.median(timings), held / len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Listing read path benchmark')
+    parser.add_argument('--patients', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cwd:
+        os.chdir(cwd)
+        from app.database import SessionLocal, engine, init_db
+        from app.services.appointment_service import AppointmentService
+        from app.services.billing_service import BillingService
+        from app.services.medical_record_service import MedicalRecordService
+        from app.services.patient_service import PatientService
+        from app.services.staff_service import StaffService
+
+        init_db()
+        populate(engine, args.patients)
+
+        listings = [
+            ('patients', PatientService.get_all_patients, PatientService.list_patients),
+            ('staff', StaffService.get_all_staff, StaffService.list_staff),
+            ('appointments', AppointmentService.get_all_appointments, AppointmentService.list_appointments),
+            ('medical records', MedicalRecordService.get_all_medical_records, MedicalRecordService.list_medical_records),
+            ('bills', BillingService.get_all_bills, BillingService.list_bills),
+        ]
+        print(f"{args.patients} patients, median of {args.repeat} reads\n")
+        print(f"{'':<17}{'rows':>8}{'ORM rows/s':>13}{'tuple rows/s':>14}{'ORM B/row':>11}{'tuple B/row':>13}")
+        for label, objects, tuples in listings:
+            count, orm_rate, orm_bytes = measure(SessionLocal, objects, args.repeat)
+            _, tuple_rate, tuple_bytes = measure(SessionLocal, tuples, args.repeat)
+            print(f"{label:<17}{count:>8}{orm_rate:>13,.0f}{tuple_rate:>14,.0f}{orm_bytes:>11,.0f}{tuple_bytes:>13,.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# Lookup overhead benchmark: per-call time of the services' primary-key
+# lookups (Session.get) and per-patient lookups (prebuilt statements) against
+# the same lookups written as a Query built on every call (how the services
+# did it before). Rows are found through the primary key or an index either
+# way, so the difference is statement construction and cache-key overhead.
+# Then the names behind a listing page: one get per id, get_many on a cold
+# session, and get_many again once the people are in the identity map.
+#
+#   python benchmarks/bench_lookups.py [--patients 5000] [--calls 5000] [--page 200]
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_reports import populate
+
+
+def per_call(db, lookup, ids):
+    # Median time of one call; objects are dropped afterwards so every call loads its rows
+    timings = []
+    for key in ids:
+        started = time.perf_counter()
+        lookup(db, key)
+        timings.append(time.perf_counter() - started)
+        db.expunge_all()
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Service lookup overhead benchmark')
+    parser.add_argument('--patients', type=int, default=5000)
+    parser.add_argument('--calls', type=int, default=5000)
+    parser.add_argument('--page', type=int, default=200, help='ids per listing page')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cwd:
+        os.chdir(cwd)
+        from app import audit
+        from app.database import SessionLocal, engine, init_db
+        from app.models import Appointment, Bill, MedicalRecord, Patient, Staff
+        from app.services.appointment_service import AppointmentService
+        from app.services.billing_service import BillingService
+        from app.services.medical_record_service import MedicalRecordService
+        from app.services.patient_service import PatientService
+        from app.services.staff_service import StaffService
+
+        init_db()
+        records, appointments, bills = populate(engine, args.patients)
+        # Audit events are queued for every row read either way; leave them out of the comparison
+        audit.uninstall()
+
+        counts = {Patient: args.patients, Staff: max(10, args.patients // 200), Appointment: appointments,
+                  MedicalRecord: records, Bill: bills}
+        lookups = [
+            ('get_patient', Patient, PatientService.get_patient,
+             lambda db, key: db.query(Patient).filter(Patient.id == key).execution_options(include_deleted=False).first()),
+            ('get_staff', Staff, StaffService.get_staff,
+             lambda db, key: db.query(Staff).filter(Staff.id == key).execution_options(include_deleted=False).first()),
+            ('get_appointment', Appointment, AppointmentService.get_appointment,
+             lambda db, key: db.query(Appointment).filter(Appointment.id == key).execution_options(include_deleted=False).first()),
+            ('get_medical_record', MedicalRecord, MedicalRecordService.get_medical_record,
+             lambda db, key: db.query(MedicalRecord).filter(MedicalRecord.id == key).execution_options(include_deleted=False).first()),
+            ('get_bill', Bill, BillingService.get_bill,
+             lambda db, key: db.query(Bill).filter(Bill.id == key).execution_options(include_deleted=False).first()),
+            ('get_patient_appointments', Patient, AppointmentService.get_patient_appointments,
+             lambda db, key: db.query(Appointment).filter(Appointment.patient_id == key).all()),
+            ('get_patient_medical_records', Patient, MedicalRecordService.get_patient_medical_records,
+             lambda db, key: db.query(MedicalRecord).filter(MedicalRecord.patient_id == key).all()),
+            ('get_patient_bills', Patient, BillingService.get_patient_bills,
+             lambda db, key: db.query(Bill).filter(Bill.patient_id == key).all()),
+        ]
+
+        rng = random.Random(1)
+        print(f"{args.patients} patients, {args.calls} calls per lookup, median per call\n")
+        print(f"{'':<30}{'query us':>10}{'cached us':>11}{'saved':>8}")
+        with SessionLocal() as db:
+            for label, model, cached, rebuilt in lookups:
+                ids = [rng.randint(1, counts[model]) for _ in range(args.calls)]
+                # Warm both paths (compiled cache, page cache), then alternate halves
+                per_call(db, rebuilt, ids[:200])
+                per_call(db, cached, ids[:200])
+                half = len(ids) // 2
+                before = statistics.mean([per_call(db, rebuilt, ids[:half]), per_call(db, rebuilt, ids[half:])])
+                after = statistics.mean([per_call(db, cached, ids[half:]), per_call(db, cached, ids[:half])])
+                print(f"{label:<30}{before * 1e6:>10.1f}{after * 1e6:>11.1f}{1 - after / before:>8.0%}")
+
+            # A listing page refers to the same people many times over
+            pages = [[rng.randint(1, args.patients // 4) for _ in range(args.page)] for _ in range(50)]
+            fetches = {
+                'get_patient per id': lambda ids: [PatientService.get_patient(db, key) for key in ids],
+                'get_many': lambda ids: PatientService.get_many(db, ids),
+            }
+            print(f"\n{args.page} patient ids per page, median per page")
+            print(f"{'':<30}{'cold ms':>10}{'loaded ms':>11}")
+            for label, fetch in fetches.items():
+                cold, loaded = [], []
+                for ids in pages:
+                    started = time.perf_counter()
+                    # The session's identity map holds objects weakly; keep them, as a listing being built would
+                    kept = fetch(ids)
+                    cold.append(time.perf_counter() - started)
+                    started = time.perf_counter()
+                    fetch(ids)
+                    loaded.append(time.perf_counter() - started)
+                    del kept
+                    db.expunge_all()
+                print(f"{label:<30}{statistics.median(cold) * 1e3:>10.2f}{statistics.median(loaded) * 1e3:>11.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# Fuzzy patient search benchmark: fills a database with patients drawn from
+# common first and last names, backfills patient_search_keys through the data
+# migration, then searches for misspelled names (a letter dropped, doubled,
+# swapped or replaced) and reports latency and how often the intended patient
+# is among the results, against the substring search.
+#
+#   python benchmarks/bench_patient_search.py [--patients 200000] [--queries 300]
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FIRST_NAMES = '''John Jon Jonathan James Jane Janet Joan Joseph Josephine Mary Maria Marie Michael Michelle Peter
+Paul Paula Grace Faith Mercy Joy Esther Ruth David Daniel Samuel Sarah Susan Stephen Steven Catherine Kathryn
+Christine Kristina Elizabeth Ann Anne Anna Brian Bryan Kevin Dennis Francis Frances Philip Phillip George Georgina
+Charles Charlotte Robert Rupert Richard Thomas Andrew Anthony Antony Agnes Alice Lucy Lucia Margaret Nancy Naomi
+Caroline Carolyn Christopher Kristopher Eric Erik Fredrick Frederick Isaac Ivy Joyce Judith Lilian Lillian
+Wanjiru Wanjiku Njeri Nyambura Akinyi Atieno Achieng Adhiambo Wambui Muthoni Kamau Otieno Ochieng Omondi Odhiambo
+Kiprono Kipchoge Cheruiyot Chebet Jepkosgei Wekesa Barasa Wafula Mutua Musyoka Kyalo Mwende Nduta Waweru
+Kaynan Mohamed Mohammed Ahmed Hassan Hussein Fatuma Amina Zainab Halima Abdi Yusuf Ibrahim'''.split()
+LAST_NAMES = '''Smith Smyth Schmidt Johnson Jonson Williams Brown Braun Jones Miller Davis Davies Wilson Anderson
+Andersen Taylor Thomas Thompson Thomson Moore White Harris Martin Martins Clark Clarke Lewis Walker Robinson
+Wright Hall Allen Allan Young King Scott Green Greene Baker Adams Nelson Carter Mitchell Roberts Phillips Philips
+Campbell Parker Evans Edwards Collins Stewart Stuart Morris Murphy Cook Cooke Rogers Reed Reid Morgan Bell Cooper
+Mwangi Kamau Njoroge Kariuki Wanjiku Otieno Ochieng Odhiambo Onyango Omondi Okoth Owino Kiprop Kipkemboi Rotich
+Kiptoo Cheruiyot Langat Mutai Wekesa Barasa Wafula Simiyu Mutua Musyoka Kilonzo Mwendwa Muthoka Ndungu Njuguna
+Kimani Karanja Gitau Macharia Maina Githinji Wambugu Waweru Nyaga Mugo Mbugua Kinyua Chege Ngugi Wairimu
+Hassan Mohamed Abdullahi Ali Omar Juma Salim Bakari Said Rashid Mwakio Mwamburi Kazungu Katana Baya Charo'''.split()
+
+
+def misspell(rng, word):
+    # One typing slip: drop, double, swap or replace a letter after the first
+    i = rng.randrange(1, len(word))
+    kind = rng.choice(('drop', 'double', 'swap', 'replace'))
+    if kind == 'drop' and len(word) > 3:
+        return word[:i] + word[i + 1:]
+    if kind == 'swap' and i < len(word) - 1:
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    if kind == 'replace':
+        return word[:i] + rng.choice('aeiouy' if word[i] in 'aeiouy' else 'bcdfghklmnprstvwz') + word[i + 1:]
+    return word[:i] + word[i] + word[i:]
+
+
+def populate(engine, patients, seed=7):
+    from sqlalchemy import insert
+    from app.models import Patient
+
+    rng = random.Random(seed)
+    born = date(1940, 1, 1)
+    with engine.begin() as connection:
+        for start in range(0, patients, 50000):
+            connection.execute(insert(Patient), [
+                dict(first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES),
+                     date_of_birth=born + timedelta(days=rng.randrange(80 * 365)),
+                     gender='Other', contact_number='0711111111')
+                for _ in range(start, min(patients, start + 50000))
+            ])
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+
+def report(label, timings, hits, queries):
+    timings = sorted(timings)
+    print(f"{label:<34}{statistics.median(timings) * 1000:>9.2f}{timings[int(len(timings) * 0.95)] * 1000:>9.2f}"
+          f"{hits / queries:>9.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fuzzy patient search benchmark')
+    parser.add_argument('--patients', type=int, default=200000)
+    parser.add_argument('--queries', type=int, default=300)
+    parser.add_argument('--limit', type=int, default=20, help='results returned per search')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cwd:
+        os.chdir(cwd)
+        from sqlalchemy import select
+        from app.data_migrations import run_data_migration
+        from app.database import SessionLocal, engine, init_db
+        from app.models import Patient
+        from app.services.patient_service import PatientService
+
+        init_db()
+        _, seconds = timed(populate, engine, args.patients)
+        print(f"{args.patients} patients inserted in {seconds:.1f}s")
+        _, seconds = timed(run_data_migration, engine, 'backfill_patient_search_keys', 5000, 0, lambda message: None)
+        print(f"search keys backfilled in {seconds:.1f}s ({args.patients / seconds:,.0f} patients/s)\n")
+
+        rng = random.Random(1)
+        with engine.connect() as connection:
+            targets = [connection.execute(select(Patient.id, Patient.first_name, Patient.last_name, Patient.date_of_birth)
+                                          .where(Patient.id == rng.randint(1, args.patients))).one()
+                       for _ in range(args.queries)]
+        queries = [(target, f"{misspell(rng, target.first_name)} {misspell(rng, target.last_name)}") for target in targets]
+
+        print(f"{'':<34}{'median ms':>9}{'p95 ms':>9}{'found':>9}")
+        modes = {
+            'substring (ilike), misspelled': lambda db, target, name: PatientService.search_patients(db, name),
+            'fuzzy, correctly spelled': lambda db, target, name: [
+                patient for patient, _ in PatientService.fuzzy_search_patients(
+                    db, f"{target.first_name} {target.last_name}", limit=args.limit)],
+            'fuzzy, misspelled': lambda db, target, name: [
+                patient for patient, _ in PatientService.fuzzy_search_patients(db, name, limit=args.limit)],
+            'fuzzy, misspelled + birth date': lambda db, target, name: [
+                patient for patient, _ in PatientService.fuzzy_search_patients(
+                    db, name, target.date_of_birth, limit=args.limit)],
+        }
+        with SessionLocal() as db:
+            for label, search in modes.items():
+                # Substring search scans the table; a sample is enough to time it
+                sample = queries[:20] if label.startswith('substring') else queries
+                # The intended patient counts as found if anyone with the same name is returned
+                timings, hits = [], 0
+                for target, name in sample:
+                    patients, seconds = timed(search, db, target, name)
+                    timings.append(seconds)
+                    hits += any((patient.first_name, patient.last_name) == (target.first_name, target.last_name)
+                                for patient in patients)
+                    db.expunge_all()
+                report(label, timings, hits, len(sample))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# Report runner benchmark: builds a synthetic database, then times each
+# report with 1 worker (in process) against process pools of N workers and
+# checks that every run produces the same rows.
+#
+#   python benchmarks/bench_reports.py [--patients 20000] [--workers 1 2 4] [--runs 3]
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEPARTMENTS = ['Cardiology', 'Neurology', 'Oncology', 'Pediatrics', 'Emergency', 'Orthopedics']
+DIAGNOSES = ['Pneumonia', 'Fracture', 'Stroke', 'Appendicitis', 'Diabetes', 'Asthma', 'Sepsis', 'Migraine']
+
+
+def populate(engine, patients, seed=42):
+    # Bulk Core inserts: a few records, appointments and bills per patient over three years
+    from sqlalchemy import insert
+    from app.models import Appointment, Bill, MedicalRecord, Patient, Staff, AppointmentStatus, BillStatus
+
+    rng = random.Random(seed)
+    first_day = date(2023, 1, 1)
+    staff_count = max(10, patients // 200)
+    with engine.begin() as connection:
+        connection.execute(insert(Staff), [
+            dict(first_name='Staff', last_name=str(i), role='Doctor', department=DEPARTMENTS[i % len(DEPARTMENTS)],
+                 contact_number='0700000000', email=f'staff{i}@example.com', hire_date=first_day)
+            for i in range(staff_count)
+        ])
+        connection.execute(insert(Patient), [
+            dict(first_name='Patient', last_name=str(i), date_of_birth=date(1950 + i % 60, 1 + i % 12, 1 + i % 28),
+                 gender='Other', contact_number='0711111111')
+            for i in range(patients)
+        ])
+
+        records, appointments, bills = [], [], []
+        for patient_id in range(1, patients + 1):
+            for _ in range(rng.randint(1, 3)):
+                admitted = first_day + timedelta(days=rng.randrange(1095))
+                records.append(dict(patient_id=patient_id, staff_id=rng.randint(1, staff_count),
+                                    diagnosis=rng.choice(DIAGNOSES), admission_date=admitted,
+                                    discharge_date=admitted + timedelta(days=rng.randint(1, 20))))
+            for _ in range(rng.randint(2, 6)):
+                when = datetime.combine(first_day + timedelta(days=rng.randrange(1095)), datetime.min.time())
+                appointments.append(dict(patient_id=patient_id, staff_id=rng.randint(1, staff_count),
+                                         appointment_date=when.replace(hour=rng.randint(8, 16)),
+                                         status=rng.choice(list(AppointmentStatus))))
+            for _ in range(rng.randint(1, 4)):
+                issued = first_day + timedelta(days=rng.randrange(1095))
+                bills.append(dict(patient_id=patient_id, amount=rng.randint(1000, 500000) / 100,
+                                  date_issued=issued, due_date=issued + timedelta(days=30),
+                                  status=rng.choice(list(BillStatus))))
+        connection.execute(insert(MedicalRecord), records)
+        connection.execute(insert(Appointment), appointments)
+        connection.execute(insert(Bill), bills)
+    return len(records), len(appointments), len(bills)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report runner benchmark')
+    parser.add_argument('--patients', type=int, default=20000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cwd:
+        # app.database opens hospital.db relative to the working directory
+        os.chdir(cwd)
+        from app.database import engine, init_db, DATABASE_PATH
+        from app.report_runner import REPORTS, run_report
+
+        init_db()
+        started = time.perf_counter()
+        records, appointments, bills = populate(engine, args.patients)
+        print(f"{args.patients} patients, {records} records, {appointments} appointments, {bills} bills "
+              f"({time.perf_counter() - started:.1f}s to build, {os.cpu_count()} CPUs)\n")
+
+        print(f"{'report':<26}{'workers':>8}{'median ms':>12}{'min ms':>10}{'speedup':>9}")
+        for name in REPORTS:
+            baseline = expected = None
+            for workers in args.workers:
+                timings = []
+                for _ in range(args.runs):
+                    start = time.perf_counter()
+                    rows = run_report(name, workers, DATABASE_PATH)
+                    timings.append((time.perf_counter() - start) * 1000)
+                if expected is None:
+                    expected = rows
+                elif rows != expected:
+                    raise SystemExit(f"{name}: {workers} workers produced different rows")
+                median = statistics.median(timings)
+                baseline = baseline or median
+                print(f"{name:<26}{workers:>8}{median:>12.1f}{min(timings):>10.1f}{baseline / median:>8.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# Slot search benchmark: one department of N doctors on the default weekday
+# hours with the coming months booked to a given occupancy (30-minute
+# appointments on the half hour), then find_slots latency for a few kinds of
+# request. Most requests are answered from the first day or two of bookings,
+# whatever the size of the schedule.
+#
+#   python benchmarks/bench_scheduling.py [--staff 300] [--days 90] [--occupancy 0.85] [--searches 200]
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def populate(engine, staff, days, occupancy, patients=5000, seed=3):
+    # Returns the number of appointments inserted
+    from sqlalchemy import insert
+    from app.models import Appointment, Patient, Staff
+
+    rng = random.Random(seed)
+    with engine.begin() as connection:
+        connection.execute(insert(Staff), [
+            dict(first_name='Doctor', last_name=str(i), role='Doctor', department='Cardiology',
+                 contact_number='0700000000', hire_date=date(2020, 1, 1))
+            for i in range(staff)
+        ])
+        connection.execute(insert(Patient), [
+            dict(first_name='Patient', last_name=str(i), date_of_birth=date(1970, 1, 1), gender='Other',
+                 contact_number='0711111111')
+            for i in range(patients)
+        ])
+        today = date.today()
+        booked = 0
+        for offset in range(days):
+            day = today + timedelta(days=offset)
+            if day.weekday() >= 5:
+                continue
+            rows = []
+            half_hours = [datetime.combine(day, datetime.min.time()) + timedelta(hours=8, minutes=30 * i) for i in range(18)]
+            for staff_id in range(1, staff + 1):
+                for start in half_hours:
+                    if rng.random() < occupancy:
+                        rows.append(dict(patient_id=rng.randint(1, patients), staff_id=staff_id, appointment_date=start,
+                                         duration_minutes=30))
+            connection.execute(insert(Appointment), rows)
+            booked += len(rows)
+    return booked
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Slot search benchmark')
+    parser.add_argument('--staff', type=int, default=300)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--occupancy', type=float, default=0.85, help='share of half-hour slots already booked')
+    parser.add_argument('--searches', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cwd:
+        os.chdir(cwd)
+        from app import audit
+        from app.database import SessionLocal, engine, init_db
+        from app.services.scheduling_service import SchedulingService
+
+        init_db()
+        started = time.perf_counter()
+        booked = populate(engine, args.staff, args.days, args.occupancy)
+        print(f"{args.staff} doctors, {booked} appointments over {args.days} days "
+              f"({args.occupancy:.0%} of slots) inserted in {time.perf_counter() - started:.1f}s\n")
+        audit.uninstall()
+
+        rng = random.Random(1)
+        soon = datetime.combine(date.today() + timedelta(days=1), datetime.min.time())
+        requests = {
+            'next 5 slots, 30 min': lambda db, patient: SchedulingService.find_slots(db, 'Cardiology', patient, 30, soon),
+            'next 5 slots, 90 min': lambda db, patient: SchedulingService.find_slots(db, 'Cardiology', patient, 90, soon),
+            'from a random later day': lambda db, patient: SchedulingService.find_slots(
+                db, 'Cardiology', patient, 30, soon + timedelta(days=rng.randrange(args.days - 7))),
+            'next 20 slots, 60 min': lambda db, patient: SchedulingService.find_slots(
+                db, 'Cardiology', patient, 60, soon, limit=20),
+        }
+        print(f"{'':<28}{'median ms':>10}{'p95 ms':>9}{'found':>7}")
+        with SessionLocal() as db:
+            for label, request in requests.items():
+                timings, found = [], 0
+                for _ in range(args.searches):
+                    patient = rng.randint(1, 5000)
+                    started = time.perf_counter()
+                    slots = request(db, patient)
+                    timings.append(time.perf_counter() - started)
+                    found += len(slots)
+                timings.sort()
+                print(f"{label:<28}{statistics.median(timings) * 1000:>10.2f}{timings[int(len(timings) * 0.95)] * 1000:>9.2f}"
+                      f"{found / args.searches:>7.1f}")
+
+
+if __name__ == '__main__':
+    main()
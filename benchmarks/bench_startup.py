@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# Startup benchmark: wall time of fresh interpreter launches plus an
+# `-X importtime` breakdown of the heaviest imports.
+#
+#   python benchmarks/bench_startup.py [--runs 10] [--top 15]
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    # Reaching the main menu: what every scripted launch pays
+    'main menu': "from app.cli import HospitalCLI; HospitalCLI()",
+    # First database access: session, schema marker check and services
+    'first query': "from app.cli import HospitalCLI; cli = HospitalCLI(); cli.db; cli.view_all_patients()",
+}
+
+
+def run(code, cwd, extra_args=()):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, *extra_args, '-c', code], cwd=cwd, env=env,
+                            capture_output=True, text=True, check=True)
+    return time.perf_counter() - start, result
+
+
+def import_breakdown(code, cwd, top):
+    # Parse "import time: self [us] | cumulative | imported package" lines
+    _, result = run(code, cwd, ('-X', 'importtime'))
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line.split(':', 1)[1].split('|')
+        rows.append((int(cumulative_us), int(self_us), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CLI startup benchmark')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cwd:
+        # Warm-up launch creates hospital.db and writes the schema marker
+        run(SCENARIOS['first query'], cwd)
+
+        print(f"{'scenario':<14}{'median ms':>12}{'min ms':>10}{'max ms':>10}")
+        for name, code in SCENARIOS.items():
+            timings = [run(code, cwd)[0] * 1000 for _ in range(args.runs)]
+            print(f"{name:<14}{statistics.median(timings):>12.1f}{min(timings):>10.1f}{max(timings):>10.1f}")
+
+        for name, code in SCENARIOS.items():
+            print(f"\nHeaviest imports ({name}, -X importtime):")
+            print(f"{'cumulative ms':>14}{'self ms':>10}  module")
+            for cumulative_us, self_us, module in import_breakdown(code, cwd, args.top):
+                print(f"{cumulative_us / 1000:>14.1f}{self_us / 1000:>10.1f}  {module}")
+
+
+if __name__ == '__main__':
+    main()
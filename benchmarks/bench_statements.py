@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# Statement generator benchmark: builds a synthetic database (see
+# bench_reports.py) and times month-end statements with 1 worker against
+# process pools of N workers, in each output format.
+#
+#   python benchmarks/bench_statements.py [--patients 100000] [--workers 1 2 4]
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_reports import populate
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Statement generator benchmark')
+    parser.add_argument('--patients', type=int, default=100000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--formats', nargs='+', default=['markdown', 'html'])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cwd:
+        os.chdir(cwd)
+        from app.database import engine, init_db, read_engine
+        from app.statements import generate_statements
+
+        init_db()
+        started = time.perf_counter()
+        populate(engine, args.patients)
+        print(f"{args.patients} patients built in {time.perf_counter() - started:.1f}s ({os.cpu_count()} CPUs)\n")
+
+        print(f"{'format':<10}{'workers':>8}{'statements':>12}{'seconds':>9}{'per second':>12}")
+        for fmt in args.formats:
+            for workers in args.workers:
+                summary = generate_statements(read_engine('replica'), os.path.join(cwd, f'{fmt}_{workers}'),
+                                              fmt, workers)
+                print(f"{fmt:<10}{workers:>8}{summary['statements']:>12}{summary['seconds']:>9.1f}"
+                      f"{summary['statements'] / summary['seconds']:>12,.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Add stat counters
+
+Revision ID: 8c41d2a7f0b3
+Revises: 3a9113e75e34
+Create Date: 2026-10-19 09:12:44.118203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c41d2a7f0b3'
+down_revision: Union[str, None] = '3a9113e75e34'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('stat_counters',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('metric', sa.String(length=50), nullable=False),
+    sa.Column('day', sa.String(length=10), nullable=False),
+    sa.Column('department', sa.String(length=50), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.Column('total', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('metric', 'day', 'department', 'status', name='uq_stat_counters_key')
+    )
+
+    # Seed the counters from existing data (same buckets as StatsService.rebuild)
+    op.execute("""
+        INSERT INTO stat_counters (metric, day, department, status, count, total)
+        SELECT 'patients', '', '', '', COUNT(*), 0 FROM patients
+    """)
+    op.execute("""
+        INSERT INTO stat_counters (metric, day, department, status, count, total)
+        SELECT 'staff', '', COALESCE(department, ''), '', COUNT(*), 0
+        FROM staff GROUP BY COALESCE(department, '')
+    """)
+    op.execute("""
+        INSERT INTO stat_counters (metric, day, department, status, count, total)
+        SELECT 'appointments', COALESCE(date(a.appointment_date), ''), COALESCE(s.department, ''),
+               COALESCE(a.status, ''), COUNT(*), 0
+        FROM appointments a LEFT JOIN staff s ON s.id = a.staff_id
+        GROUP BY 2, 3, 4
+    """)
+    op.execute("""
+        INSERT INTO stat_counters (metric, day, department, status, count, total)
+        SELECT 'active_admissions', '', COALESCE(s.department, ''), '', COUNT(*), 0
+        FROM medical_records m LEFT JOIN staff s ON s.id = m.staff_id
+        WHERE m.admission_date IS NOT NULL AND m.discharge_date IS NULL
+        GROUP BY 3
+    """)
+    op.execute("""
+        INSERT INTO stat_counters (metric, day, department, status, count, total)
+        SELECT 'bills', '', '', COALESCE(status, ''), COUNT(*), COALESCE(SUM(amount), 0)
+        FROM bills GROUP BY COALESCE(status, '')
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('stat_counters')
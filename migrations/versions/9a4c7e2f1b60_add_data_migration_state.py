@@ -0,0 +1,33 @@
+"""Add data migration state
+
+Revision ID: 9a4c7e2f1b60
+Revises: f1b8d4e6a925
+Create Date: 2026-10-19 15:52:09.318442
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9a4c7e2f1b60'
+down_revision: Union[str, None] = 'f1b8d4e6a925'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('data_migrations',
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('last_id', sa.Integer(), nullable=False),
+    sa.Column('processed', sa.Integer(), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('completed_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('data_migrations')
@@ -0,0 +1,27 @@
+"""Index report shard columns
+
+Revision ID: a3d7f9c2e814
+Revises: 9a4c7e2f1b60
+Create Date: 2026-10-19 16:48:31.207145
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3d7f9c2e814'
+down_revision: Union[str, None] = '9a4c7e2f1b60'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(op.f('ix_bills_date_issued'), 'bills', ['date_issued'], unique=False)
+    op.create_index(op.f('ix_appointments_appointment_date'), 'appointments', ['appointment_date'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_appointments_appointment_date'), table_name='appointments')
+    op.drop_index(op.f('ix_bills_date_issued'), table_name='bills')
@@ -0,0 +1,49 @@
+"""Add patient search keys
+
+Revision ID: a8e2c4f7d159
+Revises: f3b7d2e9a461
+Create Date: 2026-10-19 21:12:40.318274
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a8e2c4f7d159'
+down_revision: Union[str, None] = 'f3b7d2e9a461'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('patient_search_keys',
+    sa.Column('patient_id', sa.Integer(), nullable=False),
+    sa.Column('date_of_birth', sa.Date(), nullable=False),
+    sa.Column('first_soundex', sa.String(length=4), nullable=False),
+    sa.Column('first_metaphone', sa.String(length=12), nullable=False),
+    sa.Column('last_soundex', sa.String(length=4), nullable=False),
+    sa.Column('last_metaphone', sa.String(length=12), nullable=False),
+    sa.Column('trigrams', sa.String(length=500), nullable=False),
+    sa.ForeignKeyConstraint(['patient_id'], ['patients.id'], ),
+    sa.PrimaryKeyConstraint('patient_id')
+    )
+    op.create_index(op.f('ix_patient_search_keys_date_of_birth'), 'patient_search_keys', ['date_of_birth'], unique=False)
+    op.create_index('ix_patient_search_keys_soundex', 'patient_search_keys', ['last_soundex', 'first_soundex'], unique=False)
+    op.create_index('ix_patient_search_keys_metaphone', 'patient_search_keys', ['last_metaphone', 'first_soundex'], unique=False)
+    op.create_index('ix_patient_search_keys_first_soundex', 'patient_search_keys', ['first_soundex', 'last_soundex'], unique=False)
+    op.create_index('ix_patient_search_keys_first_metaphone', 'patient_search_keys', ['first_metaphone', 'last_soundex'], unique=False)
+
+    # Keys for existing patients are computed by the 'backfill_patient_search_keys'
+    # data migration (python -m app.data_migrations run-all), in batches.
+
+
+def downgrade() -> None:
+    op.drop_index('ix_patient_search_keys_first_metaphone', table_name='patient_search_keys')
+    op.drop_index('ix_patient_search_keys_first_soundex', table_name='patient_search_keys')
+    op.drop_index('ix_patient_search_keys_metaphone', table_name='patient_search_keys')
+    op.drop_index('ix_patient_search_keys_soundex', table_name='patient_search_keys')
+    op.drop_index(op.f('ix_patient_search_keys_date_of_birth'), table_name='patient_search_keys')
+    op.drop_table('patient_search_keys')
@@ -0,0 +1,65 @@
+"""Add prescriptions
+
+Revision ID: b5e9c13f7a42
+Revises: 8c41d2a7f0b3
+Create Date: 2026-10-19 10:41:07.552914
+
+"""
+from datetime import date
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.services.medical_record_service import parse_medications
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b5e9c13f7a42'
+down_revision: Union[str, None] = '8c41d2a7f0b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    prescriptions = op.create_table('prescriptions',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('record_id', sa.Integer(), nullable=False),
+    sa.Column('drug', sa.String(length=100), nullable=False),
+    sa.Column('dose', sa.String(length=50), nullable=True),
+    sa.Column('frequency', sa.String(length=50), nullable=True),
+    sa.Column('start_date', sa.Date(), nullable=True),
+    sa.Column('end_date', sa.Date(), nullable=True),
+    sa.ForeignKeyConstraint(['record_id'], ['medical_records.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_prescriptions_drug'), 'prescriptions', ['drug'], unique=False)
+    op.create_index(op.f('ix_prescriptions_record_id'), 'prescriptions', ['record_id'], unique=False)
+    op.create_index(op.f('ix_medical_records_patient_id'), 'medical_records', ['patient_id'], unique=False)
+
+    # Backfill by parsing the existing free-text medications column
+    records = sa.table('medical_records',
+        sa.column('id', sa.Integer()),
+        sa.column('medications', sa.String()),
+        sa.column('admission_date', sa.Date()),
+        sa.column('discharge_date', sa.Date()),
+        sa.column('created_at', sa.DateTime())
+    )
+    connection = op.get_bind()
+    rows = connection.execute(
+        sa.select(records).where(records.c.medications.isnot(None), records.c.medications != '')
+    )
+    backfill = []
+    for row in rows:
+        start_date = row.admission_date or (row.created_at.date() if row.created_at else date.today())
+        for entry in parse_medications(row.medications):
+            backfill.append(dict(entry, record_id=row.id, start_date=start_date, end_date=row.discharge_date))
+    if backfill:
+        op.bulk_insert(prescriptions, backfill)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_medical_records_patient_id'), table_name='medical_records')
+    op.drop_index(op.f('ix_prescriptions_record_id'), table_name='prescriptions')
+    op.drop_index(op.f('ix_prescriptions_drug'), table_name='prescriptions')
+    op.drop_table('prescriptions')
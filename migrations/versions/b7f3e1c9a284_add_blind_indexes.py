@@ -0,0 +1,42 @@
+"""Add blind indexes of encrypted columns
+
+Revision ID: b7f3e1c9a284
+Revises: e2d7b4a9c613
+Create Date: 2026-10-21 10:24:17.530916
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7f3e1c9a284'
+down_revision: Union[str, None] = 'e2d7b4a9c613'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # The encrypted columns themselves keep their SQLite type (text of any
+    # length); only the blind index columns are new.
+    op.add_column('patients', sa.Column('contact_number_index', sa.String(length=32), nullable=True))
+    op.add_column('patients', sa.Column('email_index', sa.String(length=32), nullable=True))
+    op.create_index(op.f('ix_patients_contact_number_index'), 'patients', ['contact_number_index'], unique=False)
+    op.create_index(op.f('ix_patients_email_index'), 'patients', ['email_index'], unique=False)
+    op.add_column('medical_records', sa.Column('diagnosis_index', sa.String(length=32), nullable=True))
+    op.create_index(op.f('ix_medical_records_diagnosis_index'), 'medical_records', ['diagnosis_index'], unique=False)
+
+    # Existing rows are indexed (and encrypted, once keys are configured) by the
+    # 'encrypt_patients', 'encrypt_medical_records' and 'encrypt_outbox' data
+    # migrations (python -m app.data_migrations run-all), in batches.
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_medical_records_diagnosis_index'), table_name='medical_records')
+    op.drop_column('medical_records', 'diagnosis_index')
+    op.drop_index(op.f('ix_patients_email_index'), table_name='patients')
+    op.drop_index(op.f('ix_patients_contact_number_index'), table_name='patients')
+    op.drop_column('patients', 'email_index')
+    op.drop_column('patients', 'contact_number_index')
@@ -0,0 +1,48 @@
+"""Add staff working hours and appointment durations
+
+Revision ID: c4e9f1a7b236
+Revises: a8e2c4f7d159
+Create Date: 2026-10-20 09:41:17.502863
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4e9f1a7b236'
+down_revision: Union[str, None] = 'a8e2c4f7d159'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Existing appointments take the default length; ADD COLUMN with a constant default does not rewrite the table
+    op.add_column('appointments', sa.Column('duration_minutes', sa.SmallInteger(), nullable=False, server_default='30'))
+
+    op.create_index('ix_appointments_busy', 'appointments',
+                    ['appointment_date', 'staff_id', 'patient_id', 'duration_minutes', 'status'],
+                    unique=False, sqlite_where=sa.text('deleted_at IS NULL'))
+
+    op.create_table('staff_working_hours',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('staff_id', sa.Integer(), nullable=False),
+    sa.Column('weekday', sa.SmallInteger(), nullable=False),
+    sa.Column('start_time', sa.Time(), nullable=False),
+    sa.Column('end_time', sa.Time(), nullable=False),
+    sa.CheckConstraint('weekday BETWEEN 0 AND 6', name='ck_staff_working_hours_weekday'),
+    sa.CheckConstraint('start_time < end_time', name='ck_staff_working_hours_order'),
+    sa.ForeignKeyConstraint(['staff_id'], ['staff.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_staff_working_hours_staff', 'staff_working_hours', ['staff_id', 'weekday'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_staff_working_hours_staff', table_name='staff_working_hours')
+    op.drop_table('staff_working_hours')
+    op.drop_index('ix_appointments_busy', table_name='appointments')
+    with op.batch_alter_table('appointments') as batch_op:
+        batch_op.drop_column('duration_minutes')
@@ -0,0 +1,28 @@
+"""Index outstanding bills by patient
+
+Revision ID: c6b1e8a3d527
+Revises: a3d7f9c2e814
+Create Date: 2026-10-19 17:25:46.813920
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c6b1e8a3d527'
+down_revision: Union[str, None] = 'a3d7f9c2e814'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Unpaid (0) and overdue (2) bills, in the order statements are generated
+    op.create_index('ix_bills_outstanding_patient', 'bills', ['patient_id', 'due_date'], unique=False,
+                    sqlite_where=sa.text('status IN (0, 2)'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_bills_outstanding_patient', table_name='bills')
@@ -0,0 +1,45 @@
+"""Add appointment series
+
+Revision ID: d2f6a8b91c07
+Revises: b5e9c13f7a42
+Create Date: 2026-10-19 11:58:31.204667
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd2f6a8b91c07'
+down_revision: Union[str, None] = 'b5e9c13f7a42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('appointment_series',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('patient_id', sa.Integer(), nullable=False),
+    sa.Column('staff_id', sa.Integer(), nullable=False),
+    sa.Column('start', sa.DateTime(), nullable=False),
+    sa.Column('rule', sa.String(length=200), nullable=False),
+    sa.Column('purpose', sa.String(length=200), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['patient_id'], ['patients.id'], ),
+    sa.ForeignKeyConstraint(['staff_id'], ['staff.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('appointments') as batch_op:
+        batch_op.add_column(sa.Column('series_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_appointments_series_id', 'appointment_series', ['series_id'], ['id'])
+        batch_op.create_index(batch_op.f('ix_appointments_series_id'), ['series_id'], unique=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('appointments') as batch_op:
+        batch_op.drop_index(batch_op.f('ix_appointments_series_id'))
+        batch_op.drop_constraint('fk_appointments_series_id', type_='foreignkey')
+        batch_op.drop_column('series_id')
+    op.drop_table('appointment_series')
@@ -0,0 +1,45 @@
+"""Add outbox
+
+Revision ID: d9a4f2c7b318
+Revises: c6b1e8a3d527
+Create Date: 2026-10-19 18:07:12.594031
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd9a4f2c7b318'
+down_revision: Union[str, None] = 'c6b1e8a3d527'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('outbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=30), nullable=False),
+    sa.Column('dedupe_key', sa.String(length=100), nullable=False),
+    sa.Column('patient_id', sa.Integer(), nullable=False),
+    sa.Column('recipient', sa.String(length=100), nullable=False),
+    sa.Column('subject', sa.String(length=200), nullable=False),
+    sa.Column('body', sa.String(length=1000), nullable=False),
+    sa.Column('status', sa.SmallInteger(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('last_error', sa.String(length=500), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('sent_at', sa.DateTime(), nullable=True),
+    sa.CheckConstraint('status IN (0, 1, 2)', name='ck_outbox_status'),
+    sa.ForeignKeyConstraint(['patient_id'], ['patients.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('dedupe_key')
+    )
+    op.create_index('ix_outbox_pending', 'outbox', ['id'], unique=False, sqlite_where=sa.text('status = 0'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_outbox_pending', table_name='outbox')
+    op.drop_table('outbox')
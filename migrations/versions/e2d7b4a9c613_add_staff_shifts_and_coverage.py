@@ -0,0 +1,59 @@
+"""Add staff shifts and department coverage
+
+Revision ID: e2d7b4a9c613
+Revises: c4e9f1a7b236
+Create Date: 2026-10-20 14:06:52.118430
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2d7b4a9c613'
+down_revision: Union[str, None] = 'c4e9f1a7b236'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('staff_shifts',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('staff_id', sa.Integer(), nullable=False),
+    sa.Column('department', sa.String(length=50), nullable=False),
+    sa.Column('role', sa.String(length=50), nullable=False),
+    sa.Column('starts_at', sa.DateTime(), nullable=False),
+    sa.Column('ends_at', sa.DateTime(), nullable=False),
+    sa.Column('kind', sa.SmallInteger(), nullable=False),
+    sa.CheckConstraint('starts_at < ends_at', name='ck_staff_shifts_order'),
+    sa.CheckConstraint('kind IN (0, 1)', name='ck_staff_shifts_kind'),
+    sa.ForeignKeyConstraint(['staff_id'], ['staff.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_staff_shifts_starts_at', 'staff_shifts',
+                    ['starts_at', 'ends_at', 'department', 'role', 'staff_id', 'kind'], unique=False)
+    op.create_index('ix_staff_shifts_staff', 'staff_shifts', ['staff_id', 'starts_at'], unique=False)
+
+    op.create_table('department_coverage',
+    sa.Column('department', sa.String(length=50), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('role', sa.String(length=50), nullable=False),
+    sa.Column('staff', sa.Integer(), nullable=False),
+    sa.Column('on_call', sa.Integer(), nullable=False),
+    sa.Column('covered_minutes', sa.Integer(), nullable=False),
+    sa.Column('staff_minutes', sa.Integer(), nullable=False),
+    sa.Column('peak', sa.Integer(), nullable=False),
+    sa.Column('lowest', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('department', 'day', 'role')
+    )
+    op.create_index('ix_department_coverage_day', 'department_coverage', ['day', 'department'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_department_coverage_day', table_name='department_coverage')
+    op.drop_table('department_coverage')
+    op.drop_index('ix_staff_shifts_staff', table_name='staff_shifts')
+    op.drop_index('ix_staff_shifts_starts_at', table_name='staff_shifts')
+    op.drop_table('staff_shifts')
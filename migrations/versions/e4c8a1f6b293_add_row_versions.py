@@ -0,0 +1,32 @@
+"""Add row version columns for optimistic concurrency
+
+Revision ID: e4c8a1f6b293
+Revises: d9a4f2c7b318
+Create Date: 2026-10-19 19:02:41.318604
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4c8a1f6b293'
+down_revision: Union[str, None] = 'd9a4f2c7b318'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+VERSIONED_TABLES = ('patients', 'staff', 'appointments', 'appointment_series', 'medical_records', 'bills')
+
+
+def upgrade() -> None:
+    # ADD COLUMN with a constant default does not rewrite the tables; existing rows start at version 1
+    for table in VERSIONED_TABLES:
+        op.add_column(table, sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade() -> None:
+    for table in reversed(VERSIONED_TABLES):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('version')
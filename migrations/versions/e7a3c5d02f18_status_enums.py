@@ -0,0 +1,100 @@
+"""Store appointment and bill status as integer codes
+
+Revision ID: e7a3c5d02f18
+Revises: d2f6a8b91c07
+Create Date: 2026-10-19 13:20:52.871390
+
+"""
+import difflib
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7a3c5d02f18'
+down_revision: Union[str, None] = 'd2f6a8b91c07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Frozen copies of the enums at this revision
+APPOINTMENT_STATUSES = {'Scheduled': 0, 'Completed': 1, 'Cancelled': 2, 'No Show': 3}
+BILL_STATUSES = {'Unpaid': 0, 'Paid': 1, 'Overdue': 2}
+
+
+def _status_codes(connection, table, statuses, default):
+    # Map every stored label to a code; free-text typos go to the closest label
+    labels = {label.lower(): code for label, code in statuses.items()}
+    mapping = {}
+    for (value,) in connection.execute(sa.text(f"SELECT DISTINCT status FROM {table}")):
+        key = (value or '').strip().lower()
+        if key in labels:
+            mapping[value] = labels[key]
+            continue
+        match = difflib.get_close_matches(key, labels, n=1, cutoff=0.6)
+        mapping[value] = labels[match[0]] if match else default
+        print(f"  {table}.status {value!r} -> {match[0] if match else 'default'}")
+    return mapping
+
+
+def _convert(table, statuses, default, index_name, index_columns):
+    connection = op.get_bind()
+    mapping = _status_codes(connection, table, statuses, default)
+
+    op.add_column(table, sa.Column('status_code', sa.SmallInteger(), nullable=True))
+    for value, code in mapping.items():
+        if value is None:
+            connection.execute(sa.text(f"UPDATE {table} SET status_code = :code WHERE status IS NULL"), {'code': code})
+        else:
+            connection.execute(sa.text(f"UPDATE {table} SET status_code = :code WHERE status = :value"),
+                               {'code': code, 'value': value})
+
+    codes = ', '.join(str(code) for code in statuses.values())
+    with op.batch_alter_table(table, recreate='always') as batch_op:
+        batch_op.drop_column('status')
+        batch_op.alter_column('status_code', new_column_name='status', nullable=False,
+                              existing_type=sa.SmallInteger())
+        batch_op.create_check_constraint(f'ck_{table}_status', f'status IN ({codes})')
+    op.create_index(index_name, table, index_columns, unique=False, sqlite_where=sa.text(f'status = {default}'))
+
+
+def _reseed_counters(metric, statuses, insert_sql):
+    # Counter buckets are keyed by label; rebuild them so typo buckets are merged
+    label = 'CASE status ' + ' '.join(f"WHEN {code} THEN '{name}'" for name, code in statuses.items()) + " ELSE '' END"
+    op.execute(f"DELETE FROM stat_counters WHERE metric = '{metric}'")
+    op.execute(insert_sql.format(label=label))
+
+
+def upgrade() -> None:
+    _convert('appointments', APPOINTMENT_STATUSES, 0, 'ix_appointments_scheduled_date', ['appointment_date'])
+    _convert('bills', BILL_STATUSES, 0, 'ix_bills_unpaid_due_date', ['due_date'])
+
+    _reseed_counters('appointments', APPOINTMENT_STATUSES, """
+        INSERT INTO stat_counters (metric, day, department, status, count, total)
+        SELECT 'appointments', COALESCE(date(a.appointment_date), ''), COALESCE(s.department, ''),
+               {label}, COUNT(*), 0
+        FROM appointments a LEFT JOIN staff s ON s.id = a.staff_id
+        GROUP BY 2, 3, a.status
+    """)
+    _reseed_counters('bills', BILL_STATUSES, """
+        INSERT INTO stat_counters (metric, day, department, status, count, total)
+        SELECT 'bills', '', '', {label}, COUNT(*), COALESCE(SUM(amount), 0)
+        FROM bills GROUP BY status
+    """)
+
+
+def _revert(table, statuses, index_name):
+    op.drop_index(index_name, table_name=table)
+    op.add_column(table, sa.Column('status_label', sa.String(length=20), nullable=True))
+    for name, code in statuses.items():
+        op.execute(f"UPDATE {table} SET status_label = '{name}' WHERE status = {code}")
+    with op.batch_alter_table(table, recreate='always') as batch_op:
+        batch_op.drop_constraint(f'ck_{table}_status', type_='check')
+        batch_op.drop_column('status')
+        batch_op.alter_column('status_label', new_column_name='status', existing_type=sa.String(length=20))
+
+
+def downgrade() -> None:
+    _revert('bills', BILL_STATUSES, 'ix_bills_unpaid_due_date')
+    _revert('appointments', APPOINTMENT_STATUSES, 'ix_appointments_scheduled_date')
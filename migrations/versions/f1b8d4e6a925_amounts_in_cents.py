@@ -0,0 +1,41 @@
+"""Store bill amounts and counter totals as integer cents
+
+Revision ID: f1b8d4e6a925
+Revises: e7a3c5d02f18
+Create Date: 2026-10-19 14:36:18.640251
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f1b8d4e6a925'
+down_revision: Union[str, None] = 'e7a3c5d02f18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _convert(table, column, to_cents):
+    # Copy into a temporary column, then swap it in with a table rebuild
+    temporary = f'{column}_converted'
+    new_type = sa.Integer() if to_cents else sa.Float()
+    expression = f'CAST(ROUND({column} * 100) AS INTEGER)' if to_cents else f'{column} / 100.0'
+
+    op.add_column(table, sa.Column(temporary, new_type, nullable=True))
+    op.execute(f'UPDATE {table} SET {temporary} = {expression}')
+    with op.batch_alter_table(table, recreate='always') as batch_op:
+        batch_op.drop_column(column)
+        batch_op.alter_column(temporary, new_column_name=column, nullable=False, existing_type=new_type)
+
+
+def upgrade() -> None:
+    _convert('bills', 'amount', to_cents=True)
+    _convert('stat_counters', 'total', to_cents=True)
+
+
+def downgrade() -> None:
+    _convert('stat_counters', 'total', to_cents=False)
+    _convert('bills', 'amount', to_cents=False)
@@ -0,0 +1,48 @@
+"""Add soft delete tombstones
+
+Revision ID: f3b7d2e9a461
+Revises: e4c8a1f6b293
+Create Date: 2026-10-19 19:48:03.520117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3b7d2e9a461'
+down_revision: Union[str, None] = 'e4c8a1f6b293'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SOFT_DELETE_TABLES = ('patients', 'staff', 'appointments', 'appointment_series', 'medical_records', 'bills')
+
+# Partial indexes that now cover live rows only: (name, table, columns, condition before this revision)
+LIVE_INDEXES = (
+    ('ix_appointments_scheduled_date', 'appointments', ['appointment_date'], 'status = 0'),
+    ('ix_bills_unpaid_due_date', 'bills', ['due_date'], 'status = 0'),
+    ('ix_bills_outstanding_patient', 'bills', ['patient_id', 'due_date'], 'status IN (0, 2)'),
+)
+
+
+def upgrade() -> None:
+    for table in SOFT_DELETE_TABLES:
+        op.add_column(table, sa.Column('deleted_at', sa.DateTime(), nullable=True))
+        op.create_index(f'ix_{table}_deleted_at', table, ['deleted_at'], unique=False,
+                        sqlite_where=sa.text('deleted_at IS NOT NULL'))
+    for name, table, columns, condition in LIVE_INDEXES:
+        op.drop_index(name, table_name=table)
+        op.create_index(name, table, columns, unique=False,
+                        sqlite_where=sa.text(f'{condition} AND deleted_at IS NULL'))
+
+
+def downgrade() -> None:
+    for name, table, columns, condition in LIVE_INDEXES:
+        op.drop_index(name, table_name=table)
+        op.create_index(name, table, columns, unique=False, sqlite_where=sa.text(condition))
+    for table in reversed(SOFT_DELETE_TABLES):
+        op.drop_index(f'ix_{table}_deleted_at', table_name=table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('deleted_at')